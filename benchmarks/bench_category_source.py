@@ -0,0 +1,157 @@
+"""
+Compares the throughput of the html and api category sources (see --source in scrape_wikicategory.py) on recorded
+responses so that the comparison does not depend on the network or on Wikipedia's rate limits.
+
+A small recorded set (a tree of 30 categories and 1230 pages, depth 2, in the markup of the HTML category pages and the
+format of the API) is in fixtures/category_source and is replayed by default:
+    python bench_category_source.py
+To compare the backends on another category tree, record the responses of both from Wikipedia into another folder and
+replay them as often as required:
+    python bench_category_source.py record "https://en.wikipedia.org/wiki/Category:Physics" -d 2 -f physics
+    python bench_category_source.py replay -f physics
+"""
+import argparse
+import asyncio
+import json
+import os
+import queue
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'src'))
+
+import requests
+import http_client
+import settings
+from parse_utils import check_link_format, crawl_categories
+from state_store import StateStore
+from dedup_index import DedupIndex
+from metrics import Metrics
+from category_graph import CategoryGraph
+
+FIXTURES_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'fixtures', 'category_source')
+BACKENDS = ['html', 'api']
+
+
+class RecordedResponse:
+    def __init__(self, status_code, text):
+        self.status_code = status_code
+        self.text = text
+        self.content = text.encode('utf-8')
+
+    def json(self):
+        return json.loads(self.text)
+
+
+def request_key(url, params=None):
+    return requests.Request('GET', url, params=params).prepare().url
+
+
+def reset_settings():
+    settings.init()
+    settings.MAXSIZE_EPNQ = 10 ** 9
+    settings.state = StateStore(':memory:')
+    settings.dedup = DedupIndex(tempfile.mkdtemp())
+    settings.metrics = Metrics()
+    settings.category_graph = CategoryGraph()
+    settings.cat_names, settings.cat_links, settings.done_links, settings.page_links, settings.page_names = \
+        [settings.state.sets[table] for table in ['cat_names', 'cat_links', 'done_links', 'page_links', 'page_names']]
+
+
+def crawl(backend, root_url, depth):
+    reset_settings()
+    settings.category_source = backend
+    epnq = queue.Queue()
+    asyncio.run(crawl_categories(root_url, depth, -1, -1, epnq, 1))
+    return epnq.qsize()
+
+
+def record(root_url, depth, fixtures_dir=FIXTURES_DIR):
+    real_get = http_client.get
+    os.makedirs(fixtures_dir, exist_ok=True)
+    meta = {'root_url': root_url, 'depth': depth}
+    for backend in BACKENDS:
+        responses = []
+
+        def recording_get(url, params=None, **kwargs):
+            response = real_get(url, params=params, **kwargs)
+            responses.append({'url': request_key(url, params), 'status': response.status_code, 'body': response.text})
+            return response
+
+        http_client.get = recording_get
+        try:
+            crawl(backend, root_url, depth)
+        finally:
+            http_client.get = real_get
+        with open(os.path.join(fixtures_dir, backend + '.jsonl'), 'w', encoding='utf-8') as f:
+            for response in responses:
+                f.write(json.dumps(response, ensure_ascii=False) + '\n')
+        print(f'{backend}: {len(responses)} responses recorded')
+    with open(os.path.join(fixtures_dir, 'meta.json'), 'w', encoding='utf-8') as f:
+        json.dump(meta, f)
+
+
+def replay(repeat, fixtures_dir=FIXTURES_DIR):
+    with open(os.path.join(fixtures_dir, 'meta.json'), encoding='utf-8') as f:
+        meta = json.load(f)
+    real_get = http_client.get
+    results = {}
+    for backend in BACKENDS:
+        with open(os.path.join(fixtures_dir, backend + '.jsonl'), encoding='utf-8') as f:
+            recorded = {}
+            for line in f:
+                response = json.loads(line)
+                recorded[response['url']] = response
+        stats = {'requests': 0, 'bytes': 0}
+
+        def replay_get(url, params=None, **kwargs):
+            response = recorded.get(request_key(url, params), {'status': 404, 'body': ''})
+            stats['requests'] += 1
+            stats['bytes'] += len(response['body'].encode('utf-8'))
+            return RecordedResponse(response['status'], response['body'])
+
+        http_client.get = replay_get
+        timings = []
+        try:
+            for _ in range(repeat):
+                stats['requests'], stats['bytes'] = 0, 0
+                start = time.perf_counter()
+                queued = crawl(backend, meta['root_url'], meta['depth'])
+                timings.append(time.perf_counter() - start)
+        finally:
+            http_client.get = real_get
+        best = min(timings)
+        members = len(settings.cat_links) + len(settings.page_links)
+        results[backend] = {'requests': stats['requests'], 'bytes': stats['bytes'],
+                            'categories': len(settings.cat_links), 'pages': len(settings.page_links),
+                            'pages_queued': queued, 'seconds': best,
+                            'members_per_second': members / best if best else 0,
+                            'requests_per_second': stats['requests'] / best if best else 0}
+    print(json.dumps(results, indent=2))
+    print(f"Root: {meta['root_url']} depth: {meta['depth']}")
+    for backend in BACKENDS:
+        r = results[backend]
+        print(f"{backend:>5}: {r['requests']:>6} requests {r['bytes'] / 1e6:>8.2f} MB {r['categories']:>7} categories "
+              f"{r['pages']:>8} pages {r['seconds']:>8.3f} s {r['members_per_second']:>10.0f} members/s")
+
+
+if __name__ == '__main__':
+    args_parser = argparse.ArgumentParser()
+    args_parser.add_argument('-f', '--fixtures', default=FIXTURES_DIR,
+                             help='Folder of the recorded responses. Default is the set in fixtures/category_source')
+    sub_parsers = args_parser.add_subparsers(dest='mode')
+    record_parser = sub_parsers.add_parser('record', help='Record the responses of both backends from Wikipedia')
+    record_parser.add_argument('parent_link', help='Category page from where the crawling will begin')
+    record_parser.add_argument('-d', '--depth', type=int, default=1, help='Depth of the category tree to record')
+    replay_parser = sub_parsers.add_parser('replay', help='Replay the recorded responses and compare the backends')
+    replay_parser.add_argument('-r', '--repeat', type=int, default=3, help='Number of runs per backend. The fastest '
+                                                                         'run is reported')
+    for sub_parser in (record_parser, replay_parser):
+        sub_parser.add_argument('-f', '--fixtures', default=argparse.SUPPRESS, help='Folder of the recorded responses')
+    args_parser.set_defaults(repeat=3)
+    args = args_parser.parse_args()
+    if args.mode == 'record':
+        record(check_link_format(args.parent_link), args.depth, args.fixtures)
+    else:
+        replay(args.repeat, args.fixtures)
@@ -0,0 +1,183 @@
+"""
+Per stage benchmark of the cleaning done in process_article(): every _remove_* stage of clean_text(), build_links() and
+process_text() are timed separately on the wikitext samples in the corpus folder (from small stubs to very large list
+articles). Each stage gets the output of the previous stage as its input, exactly as in clean_text().
+
+    python bench_cleaner.py                                   # benchmark wikitext_cleaner.py (used by the pipeline)
+    python bench_cleaner.py --impl cleaner                    # benchmark the reference implementation
+    python bench_cleaner.py -o results.json --compare old.json
+    python bench_cleaner.py --fetch "Photon" "List of cities in Japan"   # add articles to the corpus
+
+The results are written as JSON (-o) so that runs on different commits can be compared with --compare.
+"""
+import argparse
+import importlib
+import json
+import os
+import platform
+import subprocess
+import sys
+import time
+import xml.sax
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'src'))
+
+from wiki_explore import WikiReader, process_text, clean_name
+
+CORPUS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'corpus')
+STAGES = ['_remove_file_links', '_remove_image_links', '_remove_external_links', '_remove_refs', '_remove_emphasises',
+          '_remove_comments', '_remove_langs', '_remove_choices', '_remove_templates', '_remove_htmls', '_remove_lists',
+          '_remove_indents', '_remove_styles', '_remove_spaces', '_remove_continuous_newlines']
+
+
+def load_corpus(corpus_dir):
+    articles = []
+    for file_name in sorted(os.listdir(corpus_dir)):
+        if file_name.endswith('.wiki'):
+            with open(os.path.join(corpus_dir, file_name), encoding='utf-8') as f:
+                articles.append((file_name[:-5], f.read()))
+    return articles
+
+
+def fetch_articles(titles, corpus_dir):
+    """
+    Downloads the current wikitext of the titles through Special:Export and stores them in the corpus
+    """
+    import http_client
+    for title in titles:
+        response = http_client.get('https://en.wikipedia.org/wiki/Special:Export/' + title)
+        pages = []
+        xml.sax.parseString(response.content, WikiReader(lambda ns: ns == 0, pages.append, title))
+        for page_title, text, *_ in pages:
+            with open(os.path.join(corpus_dir, clean_name(page_title) + '.wiki'), 'w', encoding='utf-8') as f:
+                f.write(text)
+            print(f'{page_title}: {len(text.encode("utf-8"))} bytes added to the corpus')
+
+
+def percentile(values, p):
+    values = sorted(values)
+    if not values:
+        return 0.0
+    k = (len(values) - 1) * p / 100
+    low, high = int(k), min(int(k) + 1, len(values) - 1)
+    return values[low] + (values[high] - values[low]) * (k - low)
+
+
+def run_stages(implementation, text):
+    """
+    :return: dict of {stage: (input bytes, seconds)} for a single article
+    """
+    timings = {}
+    for stage in STAGES:
+        size = len(text.encode('utf-8'))
+        start = time.perf_counter()
+        text = getattr(implementation, stage)(text)
+        timings[stage] = (size, time.perf_counter() - start)
+    text = text.strip()
+    size = len(text.encode('utf-8'))
+    start = time.perf_counter()
+    implementation.build_links(text)
+    timings['build_links'] = (size, time.perf_counter() - start)
+    start = time.perf_counter()
+    process_text(text)
+    timings['process_text'] = (size, time.perf_counter() - start)
+    return timings
+
+
+def run_article(implementation, text):
+    """
+    :return: seconds taken by the work done in process_article() for one article
+    """
+    start = time.perf_counter()
+    process_text(implementation.clean_text(text))
+    return time.perf_counter() - start
+
+
+def benchmark(implementation_name, articles, repeat):
+    implementation = importlib.import_module(implementation_name)
+    stage_names = STAGES + ['build_links', 'process_text']
+    stage_bytes = dict.fromkeys(stage_names, 0)
+    stage_seconds = dict.fromkeys(stage_names, 0.0)
+    article_results = []
+    for name, text in articles:
+        best_stages, best_article = None, None
+        for _ in range(repeat):
+            timings = run_stages(implementation, text)
+            if best_stages is None:
+                best_stages = timings
+            else:
+                best_stages = {stage: min(best_stages[stage], timings[stage], key=lambda t: t[1]) for stage in timings}
+            seconds = run_article(implementation, text)
+            best_article = seconds if best_article is None else min(best_article, seconds)
+        for stage, (size, seconds) in best_stages.items():
+            stage_bytes[stage] += size
+            stage_seconds[stage] += seconds
+        article_results.append({'article': name, 'bytes': len(text.encode('utf-8')), 'seconds': best_article})
+    latencies = [article['seconds'] for article in article_results]
+    return {
+        'implementation': implementation_name,
+        'commit': git_commit(),
+        'python': platform.python_version(),
+        'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        'repeat': repeat,
+        'corpus_bytes': sum(article['bytes'] for article in article_results),
+        'stages': {stage: {'bytes': stage_bytes[stage], 'seconds': stage_seconds[stage],
+                           'mb_per_s': stage_bytes[stage] / 1e6 / stage_seconds[stage] if stage_seconds[stage] else 0.0}
+                   for stage in stage_names},
+        'latency': {'p50': percentile(latencies, 50), 'p90': percentile(latencies, 90),
+                    'p99': percentile(latencies, 99), 'max': max(latencies) if latencies else 0.0},
+        'articles': article_results
+    }
+
+
+def git_commit():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True,
+                              cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip() or None
+    except OSError:
+        return None
+
+
+def print_results(results, baseline=None):
+    print(f"{results['implementation']} @ {results['commit']}: {len(results['articles'])} articles, "
+          f"{results['corpus_bytes'] / 1e6:.2f} MB, best of {results['repeat']}")
+    header = f"{'stage':<30}{'seconds':>10}{'MB/s':>10}"
+    print(header + (f"{'baseline MB/s':>15}{'change':>9}" if baseline else ''))
+    for stage, result in results['stages'].items():
+        line = f"{stage:<30}{result['seconds']:>10.4f}{result['mb_per_s']:>10.2f}"
+        if baseline and stage in baseline['stages']:
+            old = baseline['stages'][stage]['mb_per_s']
+            line += f"{old:>15.2f}{(result['mb_per_s'] / old if old else 0):>8.2f}x"
+        print(line)
+    print('Per article latency (clean_text + process_text):')
+    for key, value in results['latency'].items():
+        line = f'  {key}: {value * 1000:.2f} ms'
+        if baseline:
+            line += f" (baseline {baseline['latency'][key] * 1000:.2f} ms)"
+        print(line)
+    for article in results['articles']:
+        print(f"  {article['article']:<40}{article['bytes']:>10} bytes{article['seconds'] * 1000:>10.2f} ms")
+
+
+if __name__ == '__main__':
+    args_parser = argparse.ArgumentParser()
+    args_parser.add_argument('--impl', choices=['wikitext_cleaner', 'cleaner'], default='wikitext_cleaner',
+                             help='Cleaner implementation to be benchmarked')
+    args_parser.add_argument('--corpus', default=CORPUS_DIR, help='Folder with the .wiki samples')
+    args_parser.add_argument('-r', '--repeat', type=int, default=3, help='Runs per article. The fastest is reported')
+    args_parser.add_argument('-o', '--output', help='JSON file where the results are written')
+    args_parser.add_argument('--compare', help='JSON results of an earlier run to compare against')
+    args_parser.add_argument('--fetch', nargs='+', help='Titles of Wikipedia articles to add to the corpus')
+    args = args_parser.parse_args()
+    if args.fetch:
+        fetch_articles(args.fetch, args.corpus)
+        sys.exit(0)
+    results = benchmark(args.impl, load_corpus(args.corpus), args.repeat)
+    baseline = None
+    if args.compare:
+        with open(args.compare, encoding='utf-8') as f:
+            baseline = json.load(f)
+    print_results(results, baseline)
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            json.dump(results, f, indent=2)
@@ -0,0 +1,92 @@
+"""
+Measures how fast pages are read from a pages-articles multistream dump (--dump) instead of being downloaded. A small
+synthetic dump is built the way Wikimedia publishes them: a first bz2 stream with the siteinfo, streams of 100 pages
+each, a closing stream and the bz2 offset index with a "stream offset:page id:title" line per page. A share of its
+pages is then read by get_content_from_dump() into the queue of the cleaning processes, which shows that only the
+streams holding wanted pages are decompressed.
+
+    python bench_dump_ingest.py
+    python bench_dump_ingest.py -n 20000 -w 0.1 -b 1000
+"""
+import argparse
+import bz2
+import os
+import queue
+import random
+import sys
+import tempfile
+import time
+from xml.sax.saxutils import escape
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'src'))
+
+from dump_reader import build_offsets, DumpReader, get_content_from_dump  # noqa: E402
+from dedup_index import DedupIndex  # noqa: E402
+from metrics import Metrics  # noqa: E402
+from pipeline import EOS  # noqa: E402
+
+CORPUS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'corpus')
+PAGES_PER_STREAM = 100
+
+
+def page_xml(title, page_id, text):
+    return (f'  <page>\n    <title>{escape(title)}</title>\n    <ns>0</ns>\n    <id>{page_id}</id>\n    <revision>\n'
+            f'      <id>{page_id + 1000000}</id>\n      <timestamp>2024-06-01T00:00:00Z</timestamp>\n'
+            f'      <sha1>{page_id:031d}</sha1>\n      <text bytes="{len(text)}" xml:space="preserve">{escape(text)}'
+            f'</text>\n    </revision>\n  </page>\n')
+
+
+def build_dump(directory, pages):
+    """
+    :return: path of the dump, list of its titles
+    """
+    with open(os.path.join(CORPUS_DIR, 'article_photon_excerpt.wiki'), encoding='utf-8') as f:
+        text = f.read()
+    dump_path = os.path.join(directory, 'synthwiki-pages-articles-multistream.xml.bz2')
+    titles = [f'Article {i}' for i in range(pages)]
+    index = []
+    with open(dump_path, 'wb') as f:
+        f.write(bz2.compress(b'<mediawiki>\n  <siteinfo>\n    <sitename>Synthwiki</sitename>\n  </siteinfo>\n'))
+        for start in range(0, pages, PAGES_PER_STREAM):
+            offset = f.tell()
+            stream = ''.join(page_xml(titles[i], i + 1, f'{titles[i]} {text}')
+                             for i in range(start, min(start + PAGES_PER_STREAM, pages)))
+            f.write(bz2.compress(stream.encode('utf-8')))
+            index.extend(f'{offset}:{i + 1}:{titles[i]}\n' for i in range(start, min(start + PAGES_PER_STREAM, pages)))
+        f.write(bz2.compress(b'</mediawiki>\n'))
+    with bz2.open(dump_path.replace('.xml.bz2', '-index.txt.bz2'), 'wt', encoding='utf-8') as f:
+        f.writelines(index)
+    return dump_path, titles
+
+
+if __name__ == '__main__':
+    args_parser = argparse.ArgumentParser()
+    args_parser.add_argument('-n', '--pages', type=int, default=10000, help='Pages in the synthetic dump')
+    args_parser.add_argument('-w', '--wanted', type=float, default=0.02, help='Share of the pages read from the dump')
+    args_parser.add_argument('-b', '--batch_size', type=int, default=1000, help='Pages looked up at a time')
+    args = args_parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as directory:
+        start = time.perf_counter()
+        dump_path, titles = build_dump(directory, args.pages)
+        print(f'Dump of {args.pages} pages: {os.path.getsize(dump_path) / 1e6:.1f} MB, built in '
+              f'{time.perf_counter() - start:.1f} s')
+        start = time.perf_counter()
+        build_offsets(dump_path)
+        print(f'Offsets built in {time.perf_counter() - start:.2f} s')
+
+        wanted = random.Random(0).sample(titles, int(len(titles) * args.wanted))
+        epnq, ctq = queue.Queue(), queue.Queue()
+        for title in wanted:
+            epnq.put((title, '/wiki/' + title.replace(' ', '_')))
+        epnq.put(EOS)
+        metrics = Metrics()
+        start = time.perf_counter()
+        get_content_from_dump(epnq, ctq, DumpReader(dump_path), args.batch_size, 5, 20, DedupIndex(directory),
+                              metrics)
+        seconds = time.perf_counter() - start
+        articles = sum(len(ctq.get()) for _ in range(ctq.qsize()))
+        streams = len({titles.index(title) // PAGES_PER_STREAM for title in wanted})
+        print(f'{len(wanted)} pages read in {seconds:.2f} s ({len(wanted) / seconds:.0f} pages/s), '
+              f'{articles} articles for the cleaning, {metrics.snapshot()["fetch"]["bytes"] / 1e6:.1f} MB read from '
+              f'{streams} of {-(-args.pages // PAGES_PER_STREAM)} streams')
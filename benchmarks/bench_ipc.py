@@ -0,0 +1,79 @@
+"""
+Measures the per message overhead of the queues between the pipeline stages for multiprocessing.Manager().Queue (used
+by the pipeline before) and multiprocessing.Queue (used now). Every stage is benchmarked with a message of the shape
+and size it actually carries, sent by 1 and by several producer processes at the same time to show whether the
+transport becomes a bottleneck when the worker counts go up. The content_text_queue carries batches of stub articles
+(--clean_batch), compare -b 1 with -b 20 to see what the batches save per article.
+
+    python bench_ipc.py
+    python bench_ipc.py -n 2000 -p 1 4 12 -b 1
+"""
+import argparse
+import multiprocessing
+import os
+import pickle
+import time
+
+CORPUS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'corpus')
+
+
+def stage_messages(clean_batch):
+    with open(os.path.join(CORPUS_DIR, 'article_photon_excerpt.wiki'), encoding='utf-8') as f:
+        text = f.read()
+    with open(os.path.join(CORPUS_DIR, 'stub_hydrogen_line.wiki'), encoding='utf-8') as f:
+        stub = f.read()
+    xml = ('<mediawiki><page><title>Photon</title><ns>0</ns><revision><text>' + text * 6 +
+           '</text></revision></page></mediawiki>').encode('utf-8')
+    revision = {'revid': 1185379573, 'timestamp': '2023-11-16T09:15:04Z', 'sha1': 'rj2mrfdw5vwhdvqhc0ivyk4wqq8ktpg'}
+    return {
+        'extracted_page_name_queue': ('Photon', '/wiki/Photon'),
+        'raw_xml_queue': ('Photon', '/wiki/Photon', xml),
+        'xml_content_queue': ('Photon', '/wiki/Photon', os.path.join('data', 'xml_files', 'Photon.xml')),
+        'content_text_queue': [(f'Hydrogen line {i}', f'{stub} {i}', f'/wiki/Hydrogen_line_{i}', dict(revision))
+                               for i in range(clean_batch)],
+        'cleaned_text_queue': {'page': 'Photon', 'sentences': text * 4, 'categories': ['Photons', 'Bosons', 'Optics'],
+                               **revision},
+    }
+
+
+def produce(q, message, count):
+    for _ in range(count):
+        q.put(message)
+    q.put(None)
+
+
+def measure(q, message, count, producers):
+    processes = [multiprocessing.Process(target=produce, args=(q, message, count)) for _ in range(producers)]
+    start = time.perf_counter()
+    for p in processes:
+        p.start()
+    finished = 0
+    while finished < producers:
+        if q.get() is None:
+            finished += 1
+    seconds = time.perf_counter() - start
+    for p in processes:
+        p.join()
+    return seconds / (count * producers)
+
+
+if __name__ == '__main__':
+    args_parser = argparse.ArgumentParser()
+    args_parser.add_argument('-n', '--messages', type=int, default=2000, help='Messages sent by every producer')
+    args_parser.add_argument('-p', '--producers', type=int, nargs='+', default=[1, 4],
+                             help='Number of producer processes sending at the same time')
+    args_parser.add_argument('-b', '--clean_batch', type=int, default=20,
+                             help='Articles per message of the content_text_queue')
+    args = args_parser.parse_args()
+    manager = multiprocessing.Manager()
+    transports = {'Manager().Queue': lambda: manager.Queue(maxsize=5000),
+                  'multiprocessing.Queue': lambda: multiprocessing.Queue(maxsize=5000)}
+    print(f"{'stage':<28}{'bytes':>9}{'producers':>11}" + ''.join(f'{name:>24}' for name in transports))
+    for stage, message in stage_messages(args.clean_batch).items():
+        size = len(pickle.dumps(message))
+        for producers in args.producers:
+            line = f'{stage:<28}{size:>9}{producers:>11}'
+            for name, make_queue in transports.items():
+                per_message = measure(make_queue(), message, args.messages, producers)
+                line += f'{per_message * 1e6:>17.1f} us/msg'
+            print(line)
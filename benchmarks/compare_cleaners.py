@@ -0,0 +1,76 @@
+"""
+Checks that wikitext_cleaner.py produces exactly the same output as the reference implementation in cleaner.py and
+compares their speed. The golden corpus can be any mix of Special:Export XML files (e.g. the xml_files folder of a
+scrape) and plain wikitext files:
+    python compare_cleaners.py ../Physics/data/xml_files
+"""
+import argparse
+import os
+import sys
+import time
+import xml.sax
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'src'))
+
+import cleaner
+import wikitext_cleaner
+from wiki_explore import WikiReader
+
+
+def load_articles(paths):
+    """
+    :param paths: list of files and directories
+    :return: list of (name, wikitext)
+    """
+    files = []
+    for path in paths:
+        if os.path.isdir(path):
+            files.extend(os.path.join(path, name) for name in sorted(os.listdir(path)))
+        else:
+            files.append(path)
+    articles = []
+    for file_name in files:
+        if file_name.endswith('.xml'):
+            with open(file_name, 'rb') as f:
+                content = f.read()
+            pages = []
+            xml.sax.parseString(content, WikiReader(lambda ns: ns == 0, pages.append, file_name))
+            articles.extend((title, text) for title, text, *_ in pages)
+        else:
+            with open(file_name, encoding='utf-8') as f:
+                articles.append((os.path.basename(file_name), f.read()))
+    return articles
+
+
+def compare(articles):
+    mismatches = []
+    timings = {'cleaner': 0.0, 'wikitext_cleaner': 0.0}
+    for name, text in articles:
+        start = time.perf_counter()
+        expected = cleaner.clean_text(text)
+        expected_links = cleaner.build_links(expected)
+        timings['cleaner'] += time.perf_counter() - start
+        start = time.perf_counter()
+        result = wikitext_cleaner.clean_text(text)
+        result_links = wikitext_cleaner.build_links(result)
+        timings['wikitext_cleaner'] += time.perf_counter() - start
+        if result != expected or result_links != expected_links:
+            mismatches.append(name)
+    return mismatches, timings
+
+
+if __name__ == '__main__':
+    args_parser = argparse.ArgumentParser()
+    args_parser.add_argument('paths', nargs='+', help='Special:Export XML files, wikitext files or directories of them')
+    args = args_parser.parse_args()
+    articles = load_articles(args.paths)
+    mismatches, timings = compare(articles)
+    size = sum(len(text.encode('utf-8')) for _, text in articles) / 1e6
+    print(f'{len(articles)} articles, {size:.2f} MB')
+    for implementation, seconds in timings.items():
+        print(f'{implementation:>16}: {seconds:8.3f} s {size / seconds if seconds else 0:8.2f} MB/s')
+    if timings['wikitext_cleaner']:
+        print(f'Speed up: {timings["cleaner"] / timings["wikitext_cleaner"]:.1f}x')
+    for name in mismatches:
+        print('Output differs for:', name)
+    sys.exit(1 if mismatches else 0)
@@ -0,0 +1,125 @@
+import os
+import time
+from pipeline import STAGE_ORDER, queue_size
+
+DEFAULT_BOUNDS = {'fetch': (2, 32), 'write_xml': (1, 8), 'parse': (1, os.cpu_count() or 1),
+                  'clean': (1, os.cpu_count() or 1), 'write': (1, 8)}
+# Share of a CPU a worker of the stage is expected to keep busy. The downloads and writes mostly wait on the network
+# and the disk while parsing and cleaning are CPU bound
+CPU_COST = {'fetch': 0.1, 'write_xml': 0.1, 'parse': 1.0, 'clean': 1.0, 'write': 0.1}
+
+
+def parse_bounds(text):
+    """
+    Parses the --worker_bounds option e.g. "clean=1:8,fetch=4:24"
+    :return: dict of {stage: (min workers, max workers)}
+    """
+    bounds = {}
+    for item in text.split(','):
+        stage, _, limits = item.partition('=')
+        low, _, high = limits.partition(':')
+        if stage.strip() not in STAGE_ORDER or int(low) < 1 or int(high) < int(low):
+            raise ValueError(f'Invalid worker bounds {item}')
+        bounds[stage.strip()] = (int(low), int(high))
+    return bounds
+
+
+class Autoscaler:
+    """
+    Sizes the StagePools from the depth of their input queues and the throughput of their stages in the Metrics. The
+    time the workers of a stage spent busy (sum of the stage latencies) tells how many of them were actually working.
+    Every `interval` seconds at most one worker is added to or removed from every stage:
+    up - the input queue holds more than high_watermark items, is not shrinking and the workers are busy. Not done while
+    the output queue is nearly full (the next stage is the bottleneck), while the rate limiter holds back the downloads
+    (fetch) or if the stage would exceed its max workers or the total cpu_budget
+    down - the input queue has been empty for idle_ticks rounds and the work done would have kept one worker less busy
+    for at most 70 % of the time
+    Workers that died are replaced up to the min workers. Every decision is printed
+    """
+    def __init__(self, pools, metrics, cpu_budget=None, interval=5, rate_limiter=None, high_watermark=50,
+                 idle_ticks=3):
+        self.pools = pools
+        self.metrics = metrics
+        self.cpu_budget = cpu_budget or os.cpu_count() or 1
+        self.interval = interval
+        self.rate_limiter = rate_limiter
+        self.high_watermark = high_watermark
+        self.idle_ticks = idle_ticks
+        self.previous = None
+        self.idle = {pool.name: 0 for pool in pools}
+        self.held = {}  # Stage: reason why it was not scaled up in the last round
+
+    def cpu_used(self):
+        return sum(pool.size() * CPU_COST[pool.name] for pool in self.pools)
+
+    def fetch_throttled(self, stages, elapsed):
+        if self.rate_limiter is None:
+            return False
+        limiter_state = self.rate_limiter.snapshot()
+        request_rate = (stages['http']['in'] - self.previous['stages']['http']['in']) / elapsed
+        return limiter_state['blocked_for'] > 0 or request_rate >= 0.9 * limiter_state['rate']
+
+    def step(self):
+        """
+        One round of scaling decisions
+        :return: list of (stage, workers before, workers after, details)
+        """
+        now = time.time()
+        stages = self.metrics.snapshot()
+        depths = {pool.name: queue_size(pool.input_queue) for pool in self.pools}
+        decisions, held = [], {}
+        for pool in self.pools:
+            size = pool.size()
+            if size < pool.min_workers:
+                for _ in range(pool.min_workers - size):
+                    pool.add()
+                decisions.append((pool.name, size, pool.min_workers, 'replacing stopped workers'))
+                continue
+            if self.previous is None:
+                continue
+            elapsed = max(now - self.previous['time'], 1e-6)
+            depth, previous_depth = depths[pool.name], self.previous['depths'][pool.name]
+            if depth < 0:
+                if self.held.get(pool.name) != 'queue size not available':
+                    print(f'Autoscaler: {pool.name} kept at {size} workers (queue size not available on this platform)')
+                held[pool.name] = 'queue size not available'
+                continue
+            in_rate = (stages[pool.name]['in'] - self.previous['stages'][pool.name]['in']) / elapsed
+            busy = (stages[pool.name]['latency_sum'] - self.previous['stages'][pool.name]['latency_sum']) / elapsed
+            details = f'queue {depth}, {in_rate:.1f} pages/s, {busy:.1f} workers busy'
+            self.idle[pool.name] = self.idle[pool.name] + 1 if depth == 0 else 0
+            if depth > self.high_watermark and depth >= previous_depth and size < pool.max_workers:
+                if busy < 0.7 * size:
+                    reason = 'workers not busy'
+                elif pool.output_full():
+                    reason = 'output queue full'
+                elif pool.name == 'fetch' and self.fetch_throttled(stages, elapsed):
+                    reason = 'request rate limited'
+                elif self.cpu_used() + CPU_COST[pool.name] > self.cpu_budget:
+                    reason = 'cpu budget reached'
+                else:
+                    pool.add()
+                    decisions.append((pool.name, size, size + 1, details))
+                    continue
+                if self.held.get(pool.name) != reason:  # Print a hold once and not every round
+                    print(f'Autoscaler: {pool.name} kept at {size} workers ({reason}; {details})')
+                held[pool.name] = reason
+            elif self.idle[pool.name] >= self.idle_ticks and size > pool.min_workers and busy <= 0.7 * (size - 1):
+                pool.retire()
+                self.idle[pool.name] = 0
+                decisions.append((pool.name, size, size - 1, details))
+        self.previous = {'time': now, 'stages': stages, 'depths': depths}
+        self.held = held
+        for stage, before, after, details in decisions:
+            print(f'Autoscaler: {stage} {before} -> {after} workers ({details})')
+        return decisions
+
+    def run(self, stop):
+        """
+        :param stop: threading.Event that ends the scaling. Must be set before the pipeline is drained
+        """
+        while not stop.wait(self.interval):
+            try:
+                self.step()
+            except Exception as e:
+                print(f'Autoscaler failed. Exception: {e}')
@@ -0,0 +1,110 @@
+import requests
+import http_client
+from urllib.parse import urlparse, parse_qs, unquote, quote
+import settings
+
+api_url = 'https://en.wikipedia.org/w/api.php'
+CATEGORY_NS = 14
+
+
+def wiki_link(title):
+    """
+    Converts a page title into the "/wiki/...." link that Wikipedia uses on the category pages so that the links
+    collected through the API match the ones collected from the HTML category pages
+    :param title: title of the page e.g. "Category:Quantum mechanics"
+    :return: link of the page e.g. "/wiki/Category:Quantum_mechanics"
+    """
+    return '/wiki/' + quote(title.replace(' ', '_'), safe=";@$!*(),/~:")
+
+
+def get_category_title(url):
+    """
+    Extracts the title of the category from a category url. The url can either be a category page link
+    ("https://en.wikipedia.org/wiki/Category:Physics" or "/wiki/Category:Physics") or an api.php link with a cmtitle
+    parameter as returned by process_api_page() for the next batch of members
+    :param url: url of the category
+    :return: title of the category e.g. "Category:Physics", cmcontinue value or None
+    """
+    parsed = urlparse(url)
+    query = parse_qs(parsed.query)
+    if 'cmtitle' in query:
+        return query['cmtitle'][0], query.get('cmcontinue', [None])[0]
+    if 'title' in query:
+        return query['title'][0].replace('_', ' '), None
+    return unquote(parsed.path.split('/wiki/', 1)[-1]).replace('_', ' '), None
+
+
+def get_category_members(title, cmcontinue=None):
+    """
+    Retrieves up to 500 members (subcategories and pages) of a category through the categorymembers API
+    :param title: title of the category e.g. "Category:Physics"
+    :param cmcontinue: continuation value returned by the previous call for the same category
+    :return: members - list of dicts with the pageid, ns and title of every member
+    next_cmcontinue - continuation value for the next call. None if all members have been retrieved
+    url_retrieved - same as in get_sections_and_next_flag()
+    """
+    params = {'action': 'query', 'list': 'categorymembers', 'cmtitle': title, 'cmtype': 'page|subcat',
+              'cmprop': 'ids|title', 'cmlimit': 500, 'format': 'json', 'formatversion': 2}
+    if cmcontinue:
+        params['cmcontinue'] = cmcontinue
+    try:
+        response = http_client.get(api_url, params=params)
+        if response.status_code == 200:
+            data = response.json()
+            members = data.get('query', {}).get('categorymembers', [])
+            return members, data.get('continue', {}).get('cmcontinue'), True
+        elif response.status_code == 429:
+            print('Overloaded response from Wikipedia. Pausing requests...')
+            return [], None, False
+        else:
+            print(response.status_code)
+            if response.status_code >= 500:
+                # Not retried, but the members of the category are unknown
+                settings.failed_categories.add(wiki_link(title))
+            return [], None, True
+    except Exception as e:
+        print(title)
+        print('Exception', e)
+        return [], None, False
+
+
+def process_api_page(url, parent_url, epnq):
+    """
+    Same as process_page() but the subcategories and pages are retrieved from the categorymembers API instead of the
+    HTML category page. If the category has more members than a single API call returns, the api.php url for the next
+    batch of members is returned as the next_page_link
+    :param epnq: Queue into which the name and the url is added for downstream processing
+    :param url: URL of the category page that is to be processed
+    :param parent_url: The original URL from where the script was run
+    :return: category_list, category_link_list, pages_list, pages_link_list, done_list, next_page_link
+    """
+    done_list = set()
+    next_page_link = None
+    title, cmcontinue = get_category_title(url)
+    members, next_cmcontinue, url_retrieved = get_category_members(title, cmcontinue)
+    category_list, category_link_list, pages_list, pages_link_list = set(), set(), set(), set()
+    for member in members:
+        link = wiki_link(member['title'])
+        if member['ns'] == CATEGORY_NS:
+            category_list.add(member['title'].split(':', 1)[1])
+            category_link_list.add(link)
+        else:
+            pages_list.add(member['title'])
+            pages_link_list.add(link)
+            if settings.dedup.claim(member['title']):
+                if settings.ledger is not None:
+                    settings.ledger.enqueue(member['title'], link)
+                epnq.put((member['title'], link))
+    if next_cmcontinue:
+        next_page_link = requests.Request('GET', api_url, params={'cmtitle': title,
+                                                                  'cmcontinue': next_cmcontinue}).prepare().url
+
+    if url_retrieved:
+        if url == parent_url:
+            done_list.add(url)
+        else:
+            done_list.add(url.replace('https://en.wikipedia.org', ''))
+    else:
+        print('URL not retrieved: ', url)
+    return category_list or None, category_link_list or None, pages_list or None, pages_link_list or None, \
+        done_list, next_page_link
@@ -0,0 +1,223 @@
+import array
+import os
+import struct
+import sys
+from collections import deque
+
+GRAPH_FILE = 'category_graph.bin'
+MAGIC = b'WCG1'
+HEADER = struct.Struct('<4sIQI')  # Magic, number of categories, number of edges, number of roots
+UNKNOWN = 2 ** 31 - 1  # Depth of a category not reachable from a root (yet)
+
+
+class CategoryGraph:
+    """
+    Category tree as a graph: every category title is interned to an integer id and the parent -> child edges are kept
+    in arrays instead of sets of strings. While crawling, the children of a category are a linked list in the arrays
+    head / next_edge / child (8 bytes per edge). Saved graphs are in CSR form (offsets into one array of children).
+    Every category has its minimum depth below the root categories (its BFS level), which is lowered and passed on to
+    its descendants whenever a shorter path to it is found, however the pages are ordered by the crawl
+    """
+    def __init__(self):
+        self.ids = {}  # Title: id
+        self.titles = []  # Id: title
+        self.depth = array.array('i')
+        self.head = array.array('i')  # Id: first edge of its children or -1
+        self.next_edge = array.array('i')
+        self.child = array.array('i')
+        self.roots = []
+
+    def __len__(self):
+        return len(self.titles)
+
+    def edge_count(self):
+        return len(self.child)
+
+    def node(self, title):
+        """
+        :return: id of the category, which is added if it is not known yet
+        """
+        node = self.ids.get(title)
+        if node is None:
+            node = self.ids[title] = len(self.titles)
+            self.titles.append(title)
+            self.depth.append(UNKNOWN)
+            self.head.append(-1)
+        return node
+
+    def children(self, node):
+        edge = self.head[node]
+        while edge != -1:
+            yield self.child[edge]
+            edge = self.next_edge[edge]
+
+    def depth_of(self, title):
+        """
+        :return: min depth of the category below the roots, None if it is unknown or not reachable
+        """
+        node = self.ids.get(title)
+        return None if node is None or self.depth[node] == UNKNOWN else self.depth[node]
+
+    def set_root(self, title):
+        """
+        :return: list of ids whose depth was lowered
+        """
+        node = self.node(title)
+        if node not in self.roots:
+            self.roots.append(node)
+        if self.depth[node] == 0:
+            return []
+        self.depth[node] = 0
+        return [node] + self.relax([node])
+
+    def add_children(self, title, child_titles):
+        """
+        Adds the edges from a category to its subcategories. Edges that are already known are ignored
+        :return: list of ids whose depth was lowered (subcategories and, through the edges known, their descendants)
+        """
+        parent = self.node(title)
+        known = set(self.children(parent)) if self.head[parent] != -1 else set()
+        improved = []
+        for child_title in child_titles:
+            node = self.node(child_title)
+            if node in known:
+                continue
+            known.add(node)
+            self.next_edge.append(self.head[parent])
+            self.child.append(node)
+            self.head[parent] = len(self.child) - 1
+            if self.depth[parent] != UNKNOWN and self.depth[parent] + 1 < self.depth[node]:
+                self.depth[node] = self.depth[parent] + 1
+                improved.append(node)
+        return improved + self.relax(improved)
+
+    def relax(self, nodes):
+        """
+        Passes lowered depths on to the descendants known, breadth first
+        :param nodes: ids whose depth was lowered
+        :return: list of the descendants whose depth was lowered
+        """
+        improved = []
+        pending = deque(nodes)
+        while pending:
+            node = pending.popleft()
+            for child in self.children(node):
+                if self.depth[node] + 1 < self.depth[child]:
+                    self.depth[child] = self.depth[node] + 1
+                    improved.append(child)
+                    pending.append(child)
+        return improved
+
+    def within_depth(self, max_depth):
+        """
+        :return: titles of the categories at most max_depth levels below the roots
+        """
+        return [title for title, depth in zip(self.titles, self.depth) if depth <= max_depth]
+
+    def to_csr(self):
+        """
+        :return: offsets (the children of category i are targets[offsets[i]:offsets[i + 1]]), targets
+        """
+        offsets, targets = array.array('q', [0]), array.array('i')
+        for node in range(len(self.titles)):
+            targets.extend(self.children(node))
+            offsets.append(len(targets))
+        return offsets, targets
+
+    def cycles(self, limit=100):
+        """
+        Finds cycles (e.g. Category:A in Category:B in Category:A) with a depth first search from the roots
+        :param limit: max number of cycles returned
+        :return: list of cycles, each a list of titles starting and ending with the same category
+        """
+        cycles = []
+        state = bytearray(len(self.titles))  # 0 not visited, 1 on the current path, 2 done
+        for root in self.roots:
+            if state[root]:
+                continue
+            path, stack = [root], [self.children(root)]
+            state[root] = 1
+            while stack and len(cycles) < limit:
+                node = next(stack[-1], None)
+                if node is None:
+                    state[path.pop()] = 2
+                    stack.pop()
+                elif state[node] == 1:
+                    cycle = path[path.index(node):] + [node]
+                    cycles.append([self.titles[n] for n in cycle])
+                elif state[node] == 0:
+                    state[node] = 1
+                    path.append(node)
+                    stack.append(self.children(node))
+        return cycles
+
+    def memory(self):
+        """
+        :return: bytes taken by the arrays and the interned titles
+        """
+        arrays = sum(a.itemsize * len(a) for a in (self.depth, self.head, self.next_edge, self.child))
+        return arrays + sys.getsizeof(self.ids) + sys.getsizeof(self.titles) + sum(map(sys.getsizeof, self.titles))
+
+    def save(self, path):
+        """
+        Writes the graph in CSR form: header, roots, depths, offsets and children (little-endian) followed by the
+        offsets of the titles into the UTF-8 encoded titles
+        """
+        offsets, targets = self.to_csr()
+        names = [title.encode('utf-8') for title in self.titles]
+        name_offsets = array.array('q', [0])
+        for name in names:
+            name_offsets.append(name_offsets[-1] + len(name))
+        with open(path + '.tmp', 'wb') as f:
+            f.write(HEADER.pack(MAGIC, len(self.titles), len(targets), len(self.roots)))
+            for values in (array.array('i', self.roots), self.depth, offsets, targets, name_offsets):
+                if sys.byteorder == 'big':
+                    values = array.array(values.typecode, values)
+                    values.byteswap()
+                values.tofile(f)
+            f.write(b''.join(names))
+        os.replace(path + '.tmp', path)
+
+    @classmethod
+    def load(cls, path):
+        graph = cls()
+        with open(path, 'rb') as f:
+            magic, nodes, edges, roots = HEADER.unpack(f.read(HEADER.size))
+            if magic != MAGIC:
+                raise ValueError(f'{path} is not a category graph')
+            values = []
+            for typecode, count in (('i', roots), ('i', nodes), ('q', nodes + 1), ('i', edges), ('q', nodes + 1)):
+                array_read = array.array(typecode)
+                array_read.fromfile(f, count)
+                if sys.byteorder == 'big':
+                    array_read.byteswap()
+                values.append(array_read)
+            graph.roots, graph.depth, offsets, targets, name_offsets = list(values[0]), *values[1:]
+            names = f.read()
+        graph.titles = [names[name_offsets[i]:name_offsets[i + 1]].decode('utf-8') for i in range(nodes)]
+        graph.ids = {title: node for node, title in enumerate(graph.titles)}
+        # Back to linked lists so that edges can be added
+        graph.head = array.array('i', [-1]) * nodes
+        graph.child = targets
+        graph.next_edge = array.array('i', range(1, edges + 1))
+        for node in range(nodes):
+            if offsets[node] < offsets[node + 1]:
+                graph.head[node] = offsets[node]
+                graph.next_edge[offsets[node + 1] - 1] = -1
+        return graph
+
+
+if __name__ == '__main__':
+    # Summary of the graph of an output: python category_graph.py <output folder>/data [max depth]
+    category_graph = CategoryGraph.load(os.path.join(sys.argv[1], GRAPH_FILE))
+    print(f'{len(category_graph)} categories, {category_graph.edge_count()} edges, '
+          f'{category_graph.memory() / 1e6:.1f} MB in memory')
+    levels = {}
+    for level in category_graph.depth:
+        levels[level] = levels.get(level, 0) + 1
+    for level, count in sorted(levels.items()):
+        print(f'Depth {"unreachable" if level == UNKNOWN else level}: {count} categories')
+    if len(sys.argv) > 2:
+        print('\n'.join(category_graph.within_depth(int(sys.argv[2]))))
+    found = category_graph.cycles()
+    print(f'{len(found)} cycles found' + ''.join('\n  ' + ' -> '.join(cycle) for cycle in found))
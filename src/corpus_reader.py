@@ -0,0 +1,166 @@
+import json
+import mmap
+import multiprocessing
+import os
+import sys
+from shard_writer import INDEX_FILE, SHARD_NAME, EXTENSIONS, REMOVED, clean_title
+from wiki_explore import clean_name
+
+
+class CorpusReader:
+    """
+    Read access to the text_files folder of a scraped output without opening and decoding every page, for both layouts
+    written by the pipeline: one .json file per page (-of files) and JSONL shards with index.tsv (-of jsonl). Both can
+    be mixed in the same folder if the output format was changed between sessions.
+    The shards are memory-mapped and a page is decoded from its slice of the shard (compressed shards: of its
+    decompressed batch, which is kept while the following pages of the same batch are read). Pages are listed from
+    index.tsv and the folder listing only, so creating the reader does not read any page.
+
+        reader = CorpusReader('Physics/data/text_files')
+        reader.get('Photon')
+        for page in reader.filter_category('Quantum field theory'):
+            ...
+        for page in reader.iter_parallel(processes=4):
+            ...
+    """
+    def __init__(self, directory):
+        """
+        :param directory: text_files folder (or the data folder that contains it)
+        """
+        if os.path.isdir(os.path.join(directory, 'text_files')):
+            directory = os.path.join(directory, 'text_files')
+        self.directory = directory
+        # Entry of a page: (file name, batch offset, batch length, record offset, record length). The offsets of a
+        # .json file are None. Only the last record of a page that was written more than once (updated) is kept
+        shard_entries = {}
+        index_path = os.path.join(directory, INDEX_FILE)
+        if os.path.exists(index_path):
+            with open(index_path, encoding='utf-8') as f:
+                for line in f:
+                    title, shard, *offsets = line.rstrip('\n').split('\t')
+                    shard_entries.pop(title, None)
+                    if shard != REMOVED:
+                        shard_entries[title] = (shard, *map(int, offsets))
+        self.entries = list(shard_entries.values())
+        self.titles = {title: position for position, title in enumerate(shard_entries)}
+        self.files = {}
+        for file_name in sorted(os.listdir(directory)):
+            if file_name.endswith('.json'):
+                self.files[file_name[:-len('.json')]] = len(self.entries)
+                self.entries.append((file_name, None, None, None, None))
+
+    def __len__(self):
+        return len(self.entries)
+
+    def __iter__(self):
+        return read_entries(self.directory, self.entries)
+
+    def __contains__(self, title):
+        return self.find(title) is not None
+
+    def find(self, title):
+        """
+        :return: entry of the page with the title or None
+        """
+        position = self.titles.get(clean_title(title))
+        if position is None:
+            position = self.files.get(clean_name(title))
+        return self.entries[position] if position is not None else None
+
+    def get(self, title):
+        """
+        :param title: title of the page
+        :return: dict of the page (page, sentences, categories, ...) or None if the page is not in the corpus
+        """
+        entry = self.find(title)
+        return next(read_entries(self.directory, [entry]), None) if entry else None
+
+    def filter_category(self, category):
+        """
+        Pages that belong to a category. Only the records whose raw bytes contain the JSON encoded category name are
+        decoded, all other pages are skipped without calling json.loads()
+        :param category: category name without the "Category:" prefix as in the 'categories' of the pages
+        :return: generator of dicts
+        """
+        needle = json.dumps(category, ensure_ascii=False).encode('utf-8')
+        for record in read_entries(self.directory, self.entries, needle):
+            if category in record.get('categories', []):
+                yield record
+
+    def chunks(self, count):
+        """
+        Splits the pages into up to `count` chunks for parallel processing. The pages of a compressed batch are never
+        split across chunks so that every batch is decompressed once
+        :return: list of lists of entries
+        """
+        batches = []
+        for entry in self.entries:
+            if batches and entry[1] is not None and batches[-1][-1][:3] == entry[:3]:
+                batches[-1].append(entry)
+            else:
+                batches.append([entry])
+        size = -(-len(batches) // max(count, 1))
+        return [[entry for batch in batches[i:i + size] for entry in batch] for i in range(0, len(batches), size)]
+
+    def iter_parallel(self, processes=None, chunk_count=None):
+        """
+        Reads the pages with a pool of processes, one chunk (see chunks()) at a time per process. The order of the pages
+        is kept
+        :param processes: number of processes. Default is the number of CPUs
+        :param chunk_count: number of chunks. Default is 4 chunks per process
+        :return: generator of dicts
+        """
+        processes = processes or os.cpu_count()
+        chunks = self.chunks(chunk_count or processes * 4)
+        with multiprocessing.Pool(processes) as pool:
+            for records in pool.imap(read_chunk, [(self.directory, chunk) for chunk in chunks]):
+                yield from records
+
+
+def read_chunk(args):
+    directory, entries = args
+    return list(read_entries(directory, entries))
+
+
+def read_entries(directory, entries, needle=None):
+    """
+    Decodes the pages of a list of entries of a CorpusReader
+    :param directory: text_files folder
+    :param entries: entries of CorpusReader.entries
+    :param needle: if given, only the records whose raw bytes contain it are decoded
+    :return: generator of dicts
+    """
+    maps = {}
+    batch_key, batch = None, None
+    try:
+        for file_name, offset, length, record_offset, record_length in entries:
+            if offset is None:
+                with open(os.path.join(directory, file_name), 'rb') as f:
+                    raw = f.read()
+            else:
+                if file_name not in maps or offset + length > len(maps[file_name]):  # Shard grown since mapped
+                    if file_name in maps:
+                        maps[file_name].close()
+                    with open(os.path.join(directory, file_name), 'rb') as f:
+                        maps[file_name] = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+                decompress = EXTENSIONS[SHARD_NAME.match(file_name).group(2) or '']
+                if decompress is None:
+                    start = offset + record_offset
+                    raw = maps[file_name][start:start + record_length]
+                else:
+                    if batch_key != (file_name, offset):
+                        batch_key, batch = (file_name, offset), decompress(maps[file_name][offset:offset + length])
+                    raw = batch[record_offset:record_offset + record_length]
+            if needle is None or needle in raw:
+                yield json.loads(raw)
+    finally:
+        for shard_map in maps.values():
+            shard_map.close()
+
+
+if __name__ == '__main__':
+    # python corpus_reader.py <output folder>/data "<page title>"
+    reader = CorpusReader(sys.argv[1])
+    print(f'{len(reader)} pages')
+    if len(sys.argv) > 2:
+        print(json.dumps(reader.get(sys.argv[2]), ensure_ascii=False, indent=2))
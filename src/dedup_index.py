@@ -0,0 +1,171 @@
+import hashlib
+import math
+import multiprocessing
+import os
+import threading
+from wiki_explore import clean_name, normalize_title
+from shard_writer import load_index, clean_title
+
+JOURNAL_FILE = 'processed_pages.txt'
+
+
+def page_key(name):
+    """
+    :param name: page name from a category page, the export or a text file name (without the extension)
+    :return: the normalized title under which the page is stored in the index
+    """
+    return clean_name(normalize_title(name))
+
+
+class DedupIndex:
+    """
+    Index of the pages that have been processed (written to text_files) and of the pages that are in flight (queued
+    for download by the crawler in this session), keyed by page_key().
+    The processed pages are appended to a journal file (one line per page: the key and, if known, the revision id,
+    revision timestamp and title of the page separated by tabs) so that the index is loaded at startup and a resumed
+    crawl does not download them again. A page that has to be downloaded again (changed or removed, see
+    revision_check.py) gets a "<key>\t-" line. Every process keeps the keys in a set and reads the lines appended by
+    the other processes when it has to answer a query it has not seen yet. A Bloom filter in shared memory sits in
+    front of the journal: a page that is not in the filter has certainly not been processed, so most queries from the
+    download processes (which mostly ask about unprocessed pages) are answered without touching the journal. The index
+    must be created in the main process and passed to the other processes as an argument, like the RateLimiter
+    """
+    def __init__(self, directory, bloom_capacity=2000000, bloom_error_rate=0.01):
+        """
+        :param directory: folder of the journal (the data folder of the output)
+        :param bloom_capacity: number of pages the Bloom filter is sized for. 0 disables the filter
+        :param bloom_error_rate: false positive rate of the filter at bloom_capacity pages
+        """
+        self.path = os.path.join(directory, JOURNAL_FILE)
+        self.lock = multiprocessing.Lock()
+        self.bloom, self.bloom_bits, self.bloom_hashes = None, 0, 0
+        if bloom_capacity > 0:
+            self.bloom_bits = int(-bloom_capacity * math.log(bloom_error_rate) / math.log(2) ** 2)
+            self.bloom_hashes = max(1, round(self.bloom_bits / bloom_capacity * math.log(2)))
+            self.bloom = multiprocessing.RawArray('B', self.bloom_bits // 8 + 1)
+        self.processed, self.in_flight = set(), set()
+        self.seen = set()  # Keys of the pages found by the crawler of this session, processed or not
+        self.offset = 0
+        self.thread_lock = threading.Lock()
+        if not os.path.exists(self.path):
+            self.seed(os.path.join(directory, 'text_files'))
+        self.refresh()
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        del state['thread_lock']
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self.thread_lock = threading.Lock()
+
+    def seed(self, text_files_path):
+        """
+        Creates the journal from the text files (or the index of the JSONL shards) written by a session that did not
+        have the index yet
+        :param text_files_path: the text_files folder
+        """
+        names = os.listdir(text_files_path) if os.path.exists(text_files_path) else []
+        with open(self.path, 'a', encoding='utf-8') as f:
+            for file_name in names:
+                name, extension = os.path.splitext(file_name)
+                if extension == '.json':
+                    f.write(page_key(name) + '\n')
+            for title in load_index(text_files_path):
+                f.write(page_key(title) + '\n')
+
+    def bloom_positions(self, key):
+        digest = hashlib.blake2b(key.encode('utf-8'), digest_size=16).digest()
+        first, second = int.from_bytes(digest[:8], 'little'), int.from_bytes(digest[8:], 'little') | 1
+        return [(first + i * second) % self.bloom_bits for i in range(self.bloom_hashes)]
+
+    def bloom_add(self, key):
+        if self.bloom is not None:
+            for position in self.bloom_positions(key):
+                self.bloom[position >> 3] |= 1 << (position & 7)
+
+    def bloom_contains(self, key):
+        if self.bloom is None:
+            return True
+        return all(self.bloom[position >> 3] & (1 << (position & 7)) for position in self.bloom_positions(key))
+
+    def refresh(self):
+        """
+        Reads the keys appended to the journal (by any process) since the last refresh of this process
+        """
+        with self.thread_lock:
+            with open(self.path, 'rb') as f:
+                f.seek(self.offset)
+                tail = f.read()
+            end = tail.rfind(b'\n') + 1
+            self.offset += end
+        keys = []
+        for line in tail[:end].decode('utf-8').splitlines():
+            key, _, revision = line.partition('\t')
+            if revision == '-':
+                self.processed.discard(key)
+            else:
+                self.processed.add(key)
+                keys.append(key)
+        with self.lock:
+            for key in keys:
+                self.bloom_add(key)
+
+    def is_processed(self, name):
+        key = page_key(name)
+        if not self.bloom_contains(key):
+            return False
+        if key not in self.processed:
+            self.refresh()
+        return key in self.processed
+
+    def claim(self, name):
+        """
+        Marks a page as in flight unless it has been processed or claimed already
+        :param name: page name
+        :return: True if the page was claimed i.e. it has to be downloaded
+        """
+        key = page_key(name)
+        with self.thread_lock:
+            self.seen.add(key)
+            if key in self.processed or key in self.in_flight:
+                return False
+            self.in_flight.add(key)
+            return True
+
+    def add_processed(self, name, revid=None, timestamp=None):
+        """
+        Records a page whose text file has been written
+        :param name: title of the page
+        :param revid: id of the revision of the page that was written
+        :param timestamp: timestamp of that revision
+        """
+        key = page_key(name)
+        line = f'{key}\t{revid}\t{timestamp or ""}\t{clean_title(name)}\n' if revid else key + '\n'
+        with self.lock:
+            with open(self.path, 'a', encoding='utf-8') as f:
+                f.write(line)
+            self.bloom_add(key)
+        self.processed.add(key)
+        self.in_flight.discard(key)
+
+    def invalidate(self, name):
+        """
+        Forgets a processed page so that it is downloaded and written again when the crawler finds it. Processes that
+        were started before see the change only if they have not looked the page up yet, so pages should be invalidated
+        before the download processes are started
+        """
+        key = page_key(name)
+        with self.lock:
+            with open(self.path, 'a', encoding='utf-8') as f:
+                f.write(key + '\t-\n')
+        self.processed.discard(key)
+        self.in_flight.discard(key)
+
+    def __contains__(self, name):
+        key = page_key(name)
+        return key in self.processed or key in self.in_flight or self.is_processed(name)
+
+    def __len__(self):
+        return len(self.processed)
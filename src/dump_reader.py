@@ -0,0 +1,204 @@
+import bz2
+import html
+import os
+import queue
+import re
+import sqlite3
+import sys
+import time
+from dedup_index import page_key
+from pipeline import STOP_TOKENS
+from wiki_explore import WikiReader, ArticleBatcher, parse_chunks
+from xml_archive import TITLE
+
+OFFSETS_SUFFIX = '.offsets.sqlite'
+PAGE = re.compile(rb'<page>.*?</page>', flags=re.DOTALL)
+
+
+def default_index_path(dump_path):
+    """
+    :return: path of the offset index published with a dump, e.g.
+    enwiki-20240601-pages-articles-multistream-index.txt.bz2 for enwiki-20240601-pages-articles-multistream.xml.bz2
+    """
+    return re.sub(r'\.xml\.bz2$', '-index.txt.bz2', dump_path)
+
+
+def build_offsets(dump_path, index_path=None):
+    """
+    Converts the offset index of a multistream dump (bz2 compressed lines "stream offset:page id:title") into an SQLite
+    database next to the dump, keyed by page_key(). Every stream of the dump holds about 100 pages, its length is the
+    distance to the next stream. Done once per dump, later calls return right away
+    :param dump_path: pages-articles-multistream.xml.bz2 dump
+    :param index_path: offset index of the dump. Default is the name it is published with (default_index_path())
+    :return: path of the database
+    """
+    db_path = dump_path + OFFSETS_SUFFIX
+    if os.path.exists(db_path):
+        return db_path
+    index_path = index_path or default_index_path(dump_path)
+    print(f'Building the offsets of {dump_path} from {index_path}. This is done once per dump')
+    if os.path.exists(db_path + '.tmp'):
+        os.remove(db_path + '.tmp')
+    conn = sqlite3.connect(db_path + '.tmp')
+    conn.execute('PRAGMA journal_mode=OFF')
+    conn.execute('PRAGMA synchronous=OFF')
+    conn.execute('CREATE TABLE pages (key TEXT PRIMARY KEY, offset INTEGER NOT NULL) WITHOUT ROWID')
+    conn.execute('CREATE TABLE streams (offset INTEGER PRIMARY KEY, length INTEGER NOT NULL)')
+    offsets = set()
+
+    def entries():
+        with bz2.open(index_path, 'rt', encoding='utf-8') as f:
+            for line in f:
+                offset, _, rest = line.rstrip('\n').partition(':')
+                title = rest.partition(':')[2]
+                offsets.add(int(offset))
+                yield page_key(title), int(offset)
+
+    conn.executemany('INSERT OR IGNORE INTO pages (key, offset) VALUES (?, ?)', entries())
+    ends = sorted(offsets)[1:] + [os.path.getsize(dump_path)]
+    conn.executemany('INSERT INTO streams (offset, length) VALUES (?, ?)',
+                     ((offset, end - offset) for offset, end in zip(sorted(offsets), ends)))
+    conn.commit()
+    conn.close()
+    os.replace(db_path + '.tmp', db_path)
+    return db_path
+
+
+def page_key_of(page):
+    """
+    :param page: raw XML of a <page> element
+    :return: page_key() of its title, None if it has none
+    """
+    title = TITLE.search(page)
+    return page_key(html.unescape(title.group(1).decode('utf-8'))) if title else None
+
+
+class DumpReader:
+    """
+    Reads pages from a pages-articles multistream dump by their title instead of downloading them. The offset index
+    tells which bz2 stream of the dump holds a page, so only the streams holding wanted pages are read and
+    decompressed, each once however many wanted pages it holds. The offsets database must have been built with
+    build_offsets(). The reader can be passed to other processes, each opens its own connection to the database
+    """
+    def __init__(self, dump_path):
+        self.dump_path = dump_path
+        self.db_path = dump_path + OFFSETS_SUFFIX
+        self.conn = None
+        self.conn_pid = None
+
+    def __getstate__(self):
+        return {'dump_path': self.dump_path, 'db_path': self.db_path, 'conn': None, 'conn_pid': None}
+
+    def connection(self):
+        if self.conn is None or self.conn_pid != os.getpid():
+            self.conn, self.conn_pid = sqlite3.connect(self.db_path), os.getpid()
+        return self.conn
+
+    def locate(self, names):
+        """
+        :param names: page names
+        :return: dict of {stream offset: (stream length, set of page keys)}, list of the names not in the dump
+        """
+        streams, missing = {}, []
+        conn = self.connection()
+        for name in names:
+            row = conn.execute('SELECT pages.offset, streams.length FROM pages JOIN streams ON pages.offset = '
+                               'streams.offset WHERE key = ?', (page_key(name),)).fetchone()
+            if row is None:
+                missing.append(name)
+            else:
+                streams.setdefault(row[0], (row[1], set()))[1].add(page_key(name))
+        return streams, missing
+
+    def read_pages(self, offset, length, keys):
+        """
+        Decompresses one stream and cuts the <page> elements of the wanted pages out of it
+        :param keys: page keys of the wanted pages
+        :return: list of the raw XML of the wanted pages in the stream, number of compressed bytes read
+        """
+        with open(self.dump_path, 'rb') as f:
+            f.seek(offset)
+            compressed = f.read(length)
+        pages = []
+        for match in PAGE.finditer(bz2.decompress(compressed)):
+            if page_key_of(match.group()) in keys:
+                pages.append(match.group())
+        return pages, len(compressed)
+
+
+def read_batch(batch, dump, ctq, clean_batch, metrics):
+    """
+    Reads a batch of pages from the dump and parses them with a WikiReader whose articles go to the cleaning in batches
+    of up to clean_batch articles
+    :param batch: list of (page name, page url)
+    """
+    urls = {page_key(name): page_url for name, page_url in batch}
+    names = {page_key(name): name for name, _ in batch}
+    batcher = ArticleBatcher(ctq, clean_batch, 0)
+    start = time.perf_counter()
+    streams, missing = dump.locate(name for name, _ in batch)
+    for name in missing:
+        metrics.count('fetch', 'errors')
+        print(f'{name} not in the dump')
+    for offset, (length, keys) in sorted(streams.items()):
+        try:
+            pages, compressed_bytes = dump.read_pages(offset, length, keys)
+        except Exception as e:
+            metrics.count('fetch', 'errors', len(keys))
+            print(f'Reading the stream at {offset} of {dump.dump_path} failed. Exception: {e}')
+            continue
+        metrics.count('fetch', 'bytes', compressed_bytes)
+        metrics.count('fetch', 'out', len(pages))
+        metrics.count('parse', 'in', len(pages))
+        # The articles are passed on once the stream is parsed, so that a broken stream passes on nothing
+        articles = []
+        reader = WikiReader(lambda ns: ns == 0, articles.append, None)
+        try:
+            with metrics.time('parse'):
+                parse_chunks([b'<mediawiki>'] + pages + [b'</mediawiki>'], reader)
+        except Exception as e:
+            # Counted as an error of the stage by metrics.time(). The pages stay in the work ledger
+            print(f'Parsing the stream at {offset} of {dump.dump_path} failed. Exception: {e}')
+            continue
+        for title, text, _, revision in articles:
+            batcher.add((title, text, urls.get(page_key(title)), revision))
+        # Pages without an article (outside the main namespace) are only acknowledged
+        for key in {page_key_of(page) for page in pages} - {page_key(article[0]) for article in articles}:
+            batcher.add((names[key], None, urls[key], None))
+        metrics.count('parse', 'out', reader.status_count)
+    batcher.flush()
+    metrics.observe('fetch', time.perf_counter() - start)
+
+
+def get_content_from_dump(epnq, ctq, dump, batch_size, batch_timeout, clean_batch, dedup, metrics):
+    """
+    Takes the place of the download, the xml writers and the parsing when the pages are read from a dump: collects up
+    to batch_size page names from epnq (or whatever arrived within batch_timeout seconds), reads them from the dump
+    and puts the articles into the queue of the cleaning processes
+    :param dump: DumpReader
+    :param clean_batch: max number of articles per batch put into ctq
+    """
+    batch = []
+    batch_start = time.time()
+    while True:
+        try:
+            page = epnq.get(timeout=max(batch_start + batch_timeout - time.time(), 0.01)) if batch else epnq.get()
+        except queue.Empty:
+            page = None
+        if page in STOP_TOKENS:
+            if batch:
+                read_batch(batch, dump, ctq, clean_batch, metrics)
+            return
+        if page and not dedup.is_processed(page[0]):
+            if not batch:
+                batch_start = time.time()
+            batch.append(page)
+            metrics.count('fetch', 'in')
+        if batch and (len(batch) >= batch_size or time.time() - batch_start >= batch_timeout):
+            read_batch(batch, dump, ctq, clean_batch, metrics)
+            batch = []
+
+
+if __name__ == '__main__':
+    # Build the offsets of a dump ahead of a session: python dump_reader.py <dump> [offset index]
+    print(build_offsets(sys.argv[1], sys.argv[2] if len(sys.argv) > 2 else None))
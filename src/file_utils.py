@@ -1,5 +1,7 @@
 import os
 import settings
+from state_store import StateStore, STATE_FILE
+from category_graph import CategoryGraph, GRAPH_FILE
 
 parent_dir = 'data'
 
@@ -38,54 +40,24 @@ def open_files(primary_url, output_dir):
     if not os.path.exists(os.path.join(output_dir, 'text_files')):
         os.makedirs(os.path.join(output_dir, 'text_files'))
 
-    if os.path.exists(os.path.join(output_dir, 'category_names.txt')):
-        settings.fcn = open(os.path.join(output_dir, 'category_names.txt'), 'r+', encoding='utf-8')
-        settings.cat_names = set([t.replace('\n', '') for t in settings.fcn.readlines() if t != '\n'])
-        print(f'Categories file exists. Opening....\n{len(settings.cat_names)} categories included')
-
-    else:
-        settings.fcn = open(os.path.join(output_dir, 'category_names.txt'), 'a+', encoding='utf-8')
-        print('Categories file does not exist. Creating.....')
-        settings.cat_names = set()
-
-    if os.path.exists(os.path.join(output_dir, 'category_links.txt')):
-        settings.fcl = open(os.path.join(output_dir, 'category_links.txt'), 'r+', encoding='utf-8')
-        settings.cat_links = set([t.replace('\n', '') for t in settings.fcl.readlines() if t != '\n'])
-        print(f'Category links file exists. Opening....\n{len(settings.cat_links)} category links included')
-
+    state_path = os.path.join(output_dir, STATE_FILE)
+    state_exists = os.path.exists(state_path)
+    settings.state = StateStore(state_path)
+    if state_exists:
+        print('Crawl state exists. Opening....')
     else:
-        settings.fcl = open(os.path.join(output_dir, 'category_links.txt'), 'a+', encoding='utf-8')
-        print('Category links file does not exist. Creating.....')
-        settings.cat_links = set()
+        imported = settings.state.import_txt(output_dir)
+        print(f'Crawl state does not exist. Creating.....\n{len(imported)} text files from an earlier session imported')
+    settings.cat_names, settings.cat_links, settings.done_links, settings.page_links, settings.page_names = \
+        [settings.state.sets[table] for table in ['cat_names', 'cat_links', 'done_links', 'page_links', 'page_names']]
+    if len(settings.cat_links) == 0 and primary_url:
         settings.cat_links.add(primary_url)
-
-    if os.path.exists(os.path.join(output_dir, 'done_links.txt')):
-        settings.fdl = open(os.path.join(output_dir, 'done_links.txt'), 'r+', encoding='utf-8')
-        settings.done_links = set([t.replace('\n', '') for t in settings.fdl.readlines() if t != '\n'])
-        print(f'Done links file exists. Opening....\n{len(settings.done_links)} links processing completed')
-
-    else:
-        settings.fdl = open(os.path.join(output_dir, 'done_links.txt'), 'a+', encoding='utf-8')
-        print('Done links file does not exist. Creating.....')
-        settings.done_links = set()
-
-    if os.path.exists(os.path.join(output_dir, 'page_links.txt')):
-        settings.fpl = open(os.path.join(output_dir, 'page_links.txt'), 'r+', encoding='utf-8')
-        settings.page_links = set([t.replace('\n', '') for t in settings.fpl.readlines() if t != '\n'])
-        print(f'Page links file exists. Opening....\n{len(settings.page_links)} page links included')
-    else:
-        settings.fpl = open(os.path.join(output_dir, 'page_links.txt'), 'a+', encoding='utf-8')
-        print('Page links file does not exist. Creating.....')
-        settings.page_links = set()
-
-    if os.path.exists(os.path.join(output_dir, 'page_names.txt')):
-        settings.fpn = open(os.path.join(output_dir, 'page_names.txt'), 'r+', encoding='utf-8')
-        settings.page_names = set([t.replace('\n', '') for t in settings.fpn.readlines() if t != '\n'])
-        print(f'Page names file exists. Opening....\n{len(settings.page_names)} pages included')
-    else:
-        settings.fpn = open(os.path.join(output_dir, 'page_names.txt'), 'a+', encoding='utf-8')
-        print('Page name file does not exist. Creating.....')
-        settings.page_names = set()
+    graph_path = os.path.join(output_dir, GRAPH_FILE)
+    settings.category_graph = CategoryGraph.load(graph_path) if os.path.exists(graph_path) else CategoryGraph()
+    print(f'{len(settings.cat_names)} categories included\n{len(settings.cat_links)} category links included\n'
+          f'{len(settings.done_links)} links processing completed\n{len(settings.page_links)} page links included\n'
+          f'{len(settings.page_names)} pages included\n{len(settings.category_graph)} categories and '
+          f'{settings.category_graph.edge_count()} subcategory links in the category graph')
 
     print('\n\n\n')
     return output_dir
@@ -98,22 +70,23 @@ def initiate_file_opens(output_dir, primary_url):
 
 
 def write_files():
-    settings.fcn.seek(0)
-    settings.fcn.truncate()
-    settings.fcn.write('\n'.join(settings.cat_names))
-
-    settings.fcl.seek(0)
-    settings.fcl.truncate()
-    settings.fcl.write('\n'.join(settings.cat_links))
-
-    settings.fdl.seek(0)
-    settings.fdl.truncate()
-    settings.fdl.write('\n'.join(settings.done_links))
-
-    settings.fpl.seek(0)
-    settings.fpl.truncate()
-    settings.fpl.write('\n'.join(settings.page_links))
-
-    settings.fpn.seek(0)
-    settings.fpn.truncate()
-    settings.fpn.write('\n'.join(settings.page_names))
+    """
+    Checkpoint of the crawl state: only the values added since the previous checkpoint are written. The pages queued
+    are committed to the work ledger first, so that no category is done before its pages are in the ledger
+    """
+    if settings.ledger is not None:
+        settings.ledger.commit()
+    settings.state.commit()
+
+
+def close_files():
+    """
+    Commits the crawl state, exports it to the text files in the output folder and closes it. The category graph is
+    saved next to it
+    """
+    if settings.ledger is not None:
+        settings.ledger.commit()
+    settings.state.commit()
+    settings.category_graph.save(os.path.join(os.path.dirname(settings.state.path), GRAPH_FILE))
+    settings.state.export_txt(os.path.dirname(settings.state.path))
+    settings.state.close()
@@ -0,0 +1,180 @@
+import hashlib
+import json
+import os
+import sqlite3
+import sys
+import threading
+import time
+import zlib
+import http_client
+
+CACHE_DIR = 'http_cache'
+INDEX_FILE = 'index.sqlite'
+
+
+class CachedResponse:
+    """
+    Response served from the cache after the server answered a conditional request with 304 Not Modified. Has the
+    parts of the requests.Response interface used by the crawler
+    """
+    def __init__(self, url, content, listing):
+        self.url = url
+        self.status_code = 200
+        self.content = content
+        self.listing = listing
+        self.from_cache = True
+
+    @property
+    def text(self):
+        return self.content.decode('utf-8')
+
+
+class HTTPCache:
+    """
+    On-disk cache of the category pages. The bodies are stored zlib compressed under the SHA-256 of their content
+    (bodies/<2 hex>/<sha256>), so that a page that did not change is stored once however often it is downloaded. An
+    SQLite index maps every url to its body, its ETag / Last-Modified validators and the listing extracted from it.
+    A cached url is revalidated with If-None-Match / If-Modified-Since: on 304 Not Modified the body and the listing
+    are taken from the cache, so the page is neither transferred nor parsed again. Once the bodies take more than
+    max_bytes, the least recently used urls are evicted down to 90 % of it
+    """
+    def __init__(self, directory, max_bytes):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        os.makedirs(os.path.join(directory, 'bodies'), exist_ok=True)
+        self.lock = threading.Lock()
+        # Used by the threads of the crawler pool, every access holds self.lock
+        self.conn = sqlite3.connect(os.path.join(directory, INDEX_FILE), check_same_thread=False)
+        self.conn.execute('PRAGMA journal_mode=WAL')
+        self.conn.execute('PRAGMA synchronous=NORMAL')
+        self.conn.execute('CREATE TABLE IF NOT EXISTS entries (url TEXT PRIMARY KEY, etag TEXT, last_modified TEXT, '
+                          'body TEXT NOT NULL, size INTEGER NOT NULL, listing TEXT, last_used REAL NOT NULL)')
+        self.conn.execute('CREATE INDEX IF NOT EXISTS entries_last_used ON entries (last_used)')
+        self.conn.commit()
+        self.size = self.conn.execute('SELECT COALESCE(SUM(size), 0) FROM (SELECT DISTINCT body, size FROM entries)'
+                                      ).fetchone()[0]
+        self.stats = {'not_modified': 0, 'modified': 0, 'uncached': 0, 'bytes_saved': 0, 'evicted': 0}
+
+    def body_path(self, digest):
+        return os.path.join(self.directory, 'bodies', digest[:2], digest)
+
+    def get(self, url, **kwargs):
+        """
+        GET through the cache. Raises the exceptions of http_client.get()
+        :return: CachedResponse if the cached copy is still valid, else the requests.Response of the server (which is
+        cached if it is a 200 with an ETag or Last-Modified)
+        """
+        with self.lock:
+            entry = self.conn.execute('SELECT etag, last_modified, body, listing FROM entries WHERE url = ?',
+                                      (url,)).fetchone()
+        extra_headers = kwargs.pop('headers', None)
+        headers = dict(extra_headers or {})
+        if entry:
+            etag, last_modified, digest, listing = entry
+            if etag:
+                headers['If-None-Match'] = etag
+            if last_modified:
+                headers['If-Modified-Since'] = last_modified
+        response = http_client.get(url, headers=headers, **kwargs)
+        if entry and response.status_code == 304:
+            try:
+                with open(self.body_path(digest), 'rb') as f:
+                    content = zlib.decompress(f.read())
+            except (OSError, zlib.error):
+                # The body is gone (e.g. deleted by hand): download the page again without the validators
+                self.forget(url)
+                return self.get(url, headers=extra_headers, **kwargs)
+            with self.lock:
+                self.conn.execute('UPDATE entries SET last_used = ? WHERE url = ?', (time.time(), url))
+                self.conn.commit()
+                self.stats['not_modified'] += 1
+                self.stats['bytes_saved'] += len(content)
+            return CachedResponse(url, content, json.loads(listing) if listing else None)
+        etag, last_modified = response.headers.get('ETag'), response.headers.get('Last-Modified')
+        if response.status_code == 200 and (etag or last_modified):
+            self.store(url, response.content, etag, last_modified)
+        elif entry:
+            self.forget(url)
+        with self.lock:
+            self.stats['modified' if entry else 'uncached'] += 1
+        return response
+
+    def store(self, url, content, etag, last_modified):
+        digest = hashlib.sha256(content).hexdigest()
+        path = self.body_path(digest)
+        with self.lock:
+            if not os.path.exists(path):
+                os.makedirs(os.path.dirname(path), exist_ok=True)
+                compressed = zlib.compress(content)
+                with open(path + '.tmp', 'wb') as f:
+                    f.write(compressed)
+                os.replace(path + '.tmp', path)
+                self.size += len(compressed)
+            previous = self.conn.execute('SELECT body FROM entries WHERE url = ?', (url,)).fetchone()
+            self.conn.execute('INSERT OR REPLACE INTO entries (url, etag, last_modified, body, size, listing, '
+                              'last_used) VALUES (?, ?, ?, ?, ?, NULL, ?)',
+                              (url, etag, last_modified, digest, os.path.getsize(path), time.time()))
+            if previous and previous[0] != digest:
+                self.delete_body(previous[0])
+            self.evict()
+            self.conn.commit()
+
+    def set_listing(self, url, listing):
+        """
+        Stores what was extracted from the cached body of url, so that it does not have to be parsed again while the
+        page does not change
+        :param listing: JSON serializable
+        """
+        with self.lock:
+            self.conn.execute('UPDATE entries SET listing = ? WHERE url = ?', (json.dumps(listing), url))
+            self.conn.commit()
+
+    def forget(self, url):
+        with self.lock:
+            entry = self.conn.execute('SELECT body FROM entries WHERE url = ?', (url,)).fetchone()
+            if entry:
+                self.conn.execute('DELETE FROM entries WHERE url = ?', (url,))
+                self.delete_body(entry[0])
+                self.conn.commit()
+
+    def delete_body(self, digest):
+        """
+        Deletes a body once no url refers to it anymore. Must be called while holding self.lock
+        """
+        if self.conn.execute('SELECT 1 FROM entries WHERE body = ?', (digest,)).fetchone() is None:
+            path = self.body_path(digest)
+            if os.path.exists(path):
+                self.size -= os.path.getsize(path)
+                os.remove(path)
+
+    def evict(self):
+        """
+        Evicts the least recently used urls while the bodies take more than max_bytes. Must be called while holding
+        self.lock
+        """
+        if self.size <= self.max_bytes:
+            return
+        for url, digest in self.conn.execute('SELECT url, body FROM entries ORDER BY last_used').fetchall():
+            if self.size <= 0.9 * self.max_bytes:
+                break
+            self.conn.execute('DELETE FROM entries WHERE url = ?', (url,))
+            self.stats['evicted'] += 1
+            self.delete_body(digest)
+
+    def summary(self):
+        return (f'HTTP cache: {self.stats["not_modified"]} pages not modified '
+                f'({self.stats["bytes_saved"] / 1e6:.1f} MB not transferred), {self.stats["modified"]} modified, '
+                f'{self.stats["uncached"]} not cached before, '
+                f'{self.stats["evicted"]} evicted, {self.size / 1e6:.1f} MB on disk')
+
+    def close(self):
+        with self.lock:
+            self.conn.close()
+
+
+if __name__ == '__main__':
+    # Size of the cache of an output: python http_cache.py <output folder>/data/http_cache
+    conn = sqlite3.connect(os.path.join(sys.argv[1], INDEX_FILE))
+    urls = conn.execute('SELECT COUNT(*) FROM entries').fetchone()[0]
+    size = conn.execute('SELECT COALESCE(SUM(size), 0) FROM (SELECT DISTINCT body, size FROM entries)').fetchone()[0]
+    print(f'{urls} urls, {size / 1e6:.1f} MB')
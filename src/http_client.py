@@ -0,0 +1,213 @@
+import os
+import sys
+import threading
+import time
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.connectionpool import HTTPConnectionPool, HTTPSConnectionPool
+
+USER_AGENT = 'Wikiscrapes/1.0 (https://github.com/SwamiKannan/Wiki-3-End-to-end-automation---Wikiscrapes) ' \
+             'python-requests/' + requests.__version__
+
+config = {'pool_size': 10, 'connect_timeout': 10, 'read_timeout': 60, 'timings_dir': None}
+stats = {'requests': 0, 'new_connections': 0, 'bytes': 0, 'wait_seconds': 0.0, 'transfer_seconds': 0.0}
+
+_rate_limiter = None
+_metrics = None
+_session = None
+_session_pid = None
+_session_lock = threading.Lock()
+_local = threading.local()
+_timings_file = None
+_timings_lock = threading.Lock()
+
+
+class CountingHTTPConnectionPool(HTTPConnectionPool):
+    def _new_conn(self):
+        _local.new_connections = getattr(_local, 'new_connections', 0) + 1
+        return super()._new_conn()
+
+
+class CountingHTTPSConnectionPool(HTTPSConnectionPool):
+    def _new_conn(self):
+        _local.new_connections = getattr(_local, 'new_connections', 0) + 1
+        return super()._new_conn()
+
+
+class PooledAdapter(HTTPAdapter):
+    """
+    HTTPAdapter that keeps track of the connections opened by each thread so that every request can be tagged with
+    whether it had to set up a new TCP+TLS connection or reused a kept-alive one
+    """
+    def init_poolmanager(self, connections, maxsize, block=False, **pool_kwargs):
+        super().init_poolmanager(connections, maxsize, block, **pool_kwargs)
+        self.poolmanager.pool_classes_by_scheme = {'http': CountingHTTPConnectionPool,
+                                                   'https': CountingHTTPSConnectionPool}
+
+
+def configure(pool_size=None, connect_timeout=None, read_timeout=None, timings_dir=None):
+    """
+    Sets the options of the sessions created by get_session(). Must be called before the first request of the process
+    :param pool_size: max number of kept-alive connections per host. This should be at least the number of threads of
+    the process that make requests at the same time
+    :param connect_timeout: seconds to wait for the connection to be set up
+    :param read_timeout: seconds to wait between bytes received from the server
+    :param timings_dir: if provided, the timing of every request is appended to http_timings_<pid>.csv in this folder
+    :return: None
+    """
+    if pool_size:
+        config['pool_size'] = pool_size
+    if connect_timeout:
+        config['connect_timeout'] = connect_timeout
+    if read_timeout:
+        config['read_timeout'] = read_timeout
+    if timings_dir:
+        config['timings_dir'] = timings_dir
+
+
+def set_rate_limiter(rate_limiter):
+    """
+    Makes every request of the current process wait for the shared rate limiter and report its response to it
+    :param rate_limiter: rate_limiter.RateLimiter created in the main process
+    :return: None
+    """
+    global _rate_limiter
+    _rate_limiter = rate_limiter
+
+
+def set_metrics(metrics):
+    """
+    Makes every request of the current process count into the 'http' stage of the shared metrics
+    :param metrics: metrics.Metrics created in the main process
+    :return: None
+    """
+    global _metrics
+    _metrics = metrics
+
+
+def get_session():
+    """
+    Returns the persistent session of the current process. Sessions are not shared across processes (the sockets of a
+    forked parent cannot be reused) so a new one is created the first time a process asks for it
+    :return: requests.Session
+    """
+    global _session, _session_pid
+    if _session is None or _session_pid != os.getpid():
+        with _session_lock:
+            if _session is None or _session_pid != os.getpid():
+                session = requests.Session()
+                adapter = PooledAdapter(pool_connections=config['pool_size'], pool_maxsize=config['pool_size'])
+                session.mount('https://', adapter)
+                session.mount('http://', adapter)
+                session.headers.update({'User-Agent': USER_AGENT, 'Accept-Encoding': 'gzip, deflate'})
+                _session, _session_pid = session, os.getpid()
+    return _session
+
+
+def record_timing(method, url, response, new_connection, wait_seconds, transfer_seconds):
+    global _timings_file
+    with _timings_lock:
+        stats['requests'] += 1
+        stats['new_connections'] += 1 if new_connection else 0
+        stats['bytes'] += len(response.content)
+        stats['wait_seconds'] += wait_seconds
+        stats['transfer_seconds'] += transfer_seconds
+        if config['timings_dir']:
+            if _timings_file is None:
+                os.makedirs(config['timings_dir'], exist_ok=True)
+                _timings_file = open(os.path.join(config['timings_dir'], f'http_timings_{os.getpid()}.csv'), 'a',
+                                     encoding='utf-8')
+            _timings_file.write(f'{time.time():.3f},{method},{response.status_code},{len(response.content)},'
+                                f'{int(new_connection)},{wait_seconds:.6f},{transfer_seconds:.6f},{url}\n')
+            _timings_file.flush()
+
+
+def request(method, url, **kwargs):
+    """
+    Sends the request through the persistent session of the process (after waiting for the rate limiter, if one is
+    set) and records its timing:
+    wait_seconds - time from sending the request till the response headers are received. For requests that open a new
+    connection this includes the TCP+TLS setup
+    transfer_seconds - time to download (and decompress) the response body
+    :return: requests.Response
+    """
+    session = get_session()
+    kwargs.setdefault('timeout', (config['connect_timeout'], config['read_timeout']))
+    if _rate_limiter:
+        _rate_limiter.acquire()
+    new_connections = getattr(_local, 'new_connections', 0)
+    start = time.perf_counter()
+    if _metrics:
+        _metrics.count('http', 'in')
+    try:
+        response = session.request(method, url, **kwargs)
+    except Exception:
+        if _metrics:
+            _metrics.count('http', 'errors')
+            _metrics.observe('http', time.perf_counter() - start)
+        raise
+    if _rate_limiter:
+        _rate_limiter.report(response.status_code, response.headers.get('Retry-After'))
+    total_seconds = time.perf_counter() - start
+    if _metrics:
+        _metrics.observe('http', total_seconds)
+        _metrics.count('http', 'out')
+        _metrics.count('http', 'bytes', len(response.content))
+        if response.status_code == 429:
+            _metrics.count('http', 'responses_429')
+        elif response.status_code >= 400:
+            _metrics.count('http', 'errors')
+    wait_seconds = min(response.elapsed.total_seconds(), total_seconds)
+    new_connection = getattr(_local, 'new_connections', 0) > new_connections
+    record_timing(method, url, response, new_connection, wait_seconds, total_seconds - wait_seconds)
+    return response
+
+
+def get(url, **kwargs):
+    return request('GET', url, **kwargs)
+
+
+def post(url, **kwargs):
+    return request('POST', url, **kwargs)
+
+
+def summarize_timings(timings_dir):
+    """
+    Summarizes the http_timings_<pid>.csv files of all the processes. The connection setup time is estimated as the
+    difference between the mean wait time of requests on new connections and the mean wait time of requests on reused
+    connections
+    :param timings_dir: timings_dir passed to configure()
+    :return: dict of the summary
+    """
+    summary = {'requests': 0, 'new_connections': 0, 'bytes': 0, 'wait_seconds': 0.0, 'transfer_seconds': 0.0}
+    wait_by_connection = {0: [0, 0.0], 1: [0, 0.0]}
+    for file_name in os.listdir(timings_dir):
+        if not (file_name.startswith('http_timings_') and file_name.endswith('.csv')):
+            continue
+        with open(os.path.join(timings_dir, file_name), encoding='utf-8') as f:
+            for line in f:
+                fields = line.split(',', 7)
+                if len(fields) < 8:
+                    continue
+                new_connection, wait_seconds, transfer_seconds = int(fields[4]), float(fields[5]), float(fields[6])
+                summary['requests'] += 1
+                summary['new_connections'] += new_connection
+                summary['bytes'] += int(fields[3])
+                summary['wait_seconds'] += wait_seconds
+                summary['transfer_seconds'] += transfer_seconds
+                wait_by_connection[new_connection][0] += 1
+                wait_by_connection[new_connection][1] += wait_seconds
+    mean_wait = {k: (v[1] / v[0] if v[0] else 0.0) for k, v in wait_by_connection.items()}
+    setup_seconds = max(mean_wait[1] - mean_wait[0], 0.0) if wait_by_connection[0][0] else 0.0
+    summary['mean_wait_new_connection'] = mean_wait[1]
+    summary['mean_wait_reused_connection'] = mean_wait[0]
+    summary['estimated_setup_seconds'] = setup_seconds * summary['new_connections']
+    return summary
+
+
+if __name__ == '__main__':
+    if len(sys.argv) != 2:
+        print('Usage: python http_client.py <timings_dir>')
+        sys.exit(1)
+    for key, value in summarize_timings(sys.argv[1]).items():
+        print(f'{key}: {value}')
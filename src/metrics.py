@@ -0,0 +1,179 @@
+import json
+import multiprocessing
+import os
+import threading
+import time
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+# Stages of the pipeline: crawl - category pages processed by the crawler, http - every request to Wikipedia,
+# fetch - pages downloaded through Special:Export, write_xml - raw xml written to disk, parse - SAX parsing of a page,
+# clean - clean_text() and process_text() of a page, write - pages written to text_files
+STAGES = ['crawl', 'http', 'fetch', 'write_xml', 'parse', 'clean', 'write']
+COUNTERS = ['in', 'out', 'errors', 'responses_429', 'bytes']
+# Upper bounds (seconds) of the latency histogram buckets. The last bucket (+Inf) is implicit
+BUCKETS = [0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0]
+# Positions in the block of every stage: the counters, the bucket counts (+Inf included), sum and count of latencies
+STAGE_SIZE = len(COUNTERS) + len(BUCKETS) + 1 + 2
+PREFIX = 'wikiscrape'
+PROMETHEUS_COUNTERS = {'in': 'items_in_total', 'out': 'items_out_total', 'errors': 'errors_total',
+                       'responses_429': 'responses_429_total', 'bytes': 'bytes_total'}
+
+
+class Metrics:
+    """
+    Counters and latency histograms of every stage of the pipeline. The values live in shared memory so that the
+    increments of all the processes add up: like the RateLimiter, the Metrics must be created in the main process and
+    passed to the worker processes as an argument
+    """
+    def __init__(self):
+        self.lock = multiprocessing.Lock()
+        self.values = multiprocessing.RawArray('d', STAGE_SIZE * len(STAGES))
+        self.start_time = time.time()
+
+    def count(self, stage, counter, value=1):
+        """
+        :param stage: one of STAGES
+        :param counter: one of COUNTERS
+        :param value: increment
+        """
+        position = STAGES.index(stage) * STAGE_SIZE + COUNTERS.index(counter)
+        with self.lock:
+            self.values[position] += value
+
+    def observe(self, stage, seconds):
+        """
+        Adds a latency to the histogram of the stage
+        """
+        base = STAGES.index(stage) * STAGE_SIZE + len(COUNTERS)
+        bucket = next((i for i, bound in enumerate(BUCKETS) if seconds <= bound), len(BUCKETS))
+        with self.lock:
+            self.values[base + bucket] += 1
+            self.values[base + len(BUCKETS) + 1] += seconds
+            self.values[base + len(BUCKETS) + 2] += 1
+
+    @contextmanager
+    def time(self, stage):
+        """
+        Observes the time spent in the with block. Exceptions are counted as errors of the stage
+        """
+        start = time.perf_counter()
+        try:
+            yield
+        except Exception:
+            self.count(stage, 'errors')
+            raise
+        finally:
+            self.observe(stage, time.perf_counter() - start)
+
+    def snapshot(self):
+        """
+        :return: dict of {stage: {counter: value, 'buckets': [...], 'latency_sum': .., 'latency_count': ..}}
+        """
+        with self.lock:
+            values = self.values[:]
+        stages = {}
+        for i, stage in enumerate(STAGES):
+            block = values[i * STAGE_SIZE:(i + 1) * STAGE_SIZE]
+            stages[stage] = {counter: block[j] for j, counter in enumerate(COUNTERS)}
+            stages[stage]['buckets'] = block[len(COUNTERS):len(COUNTERS) + len(BUCKETS) + 1]
+            stages[stage]['latency_sum'] = block[-2]
+            stages[stage]['latency_count'] = block[-1]
+        return stages
+
+
+def quantile(buckets, q):
+    """
+    Estimates a quantile of the latencies from the histogram (upper bound of the bucket it falls into). Latencies above
+    the last bound are reported as the last bound
+    """
+    total = sum(buckets)
+    if not total:
+        return 0.0
+    seen = 0
+    for i, count in enumerate(buckets):
+        seen += count
+        if seen >= q * total:
+            return BUCKETS[min(i, len(BUCKETS) - 1)]
+    return BUCKETS[-1]
+
+
+def prometheus_text(metrics, gauges=None):
+    """
+    :param metrics: Metrics
+    :param gauges: dict of {name: value} e.g. the queue sizes, exported as wikiscrape_<name>
+    :return: the metrics in the Prometheus text exposition format
+    """
+    stages = metrics.snapshot()
+    lines = []
+    for counter in COUNTERS:
+        name = f'{PREFIX}_{PROMETHEUS_COUNTERS[counter]}'
+        lines.append(f'# TYPE {name} counter')
+        lines.extend(f'{name}{{stage="{stage}"}} {values[counter]:.0f}' for stage, values in stages.items())
+    name = f'{PREFIX}_stage_seconds'
+    lines.append(f'# TYPE {name} histogram')
+    for stage, values in stages.items():
+        cumulative = 0
+        for bound, count in zip(BUCKETS + ['+Inf'], values['buckets']):
+            cumulative += count
+            lines.append(f'{name}_bucket{{stage="{stage}",le="{bound}"}} {cumulative:.0f}')
+        lines.append(f'{name}_sum{{stage="{stage}"}} {values["latency_sum"]}')
+        lines.append(f'{name}_count{{stage="{stage}"}} {values["latency_count"]:.0f}')
+    for gauge, value in (gauges or {}).items():
+        lines.append(f'# TYPE {PREFIX}_{gauge} gauge')
+        lines.append(f'{PREFIX}_{gauge} {value}')
+    return '\n'.join(lines) + '\n'
+
+
+def json_snapshot(metrics, gauges=None, previous=None):
+    """
+    :param previous: the snapshot returned by the previous call. Used for the throughput since then
+    :return: dict with the counters, throughput and latency quantiles of every stage and the gauges
+    """
+    now = time.time()
+    snapshot = {'time': now, 'uptime_seconds': now - metrics.start_time, 'stages': {}, 'gauges': gauges or {}}
+    for stage, values in metrics.snapshot().items():
+        stage_snapshot = {counter: values[counter] for counter in COUNTERS}
+        elapsed = now - previous['time'] if previous else snapshot['uptime_seconds']
+        out_before = previous['stages'][stage]['out'] if previous else 0
+        bytes_before = previous['stages'][stage]['bytes'] if previous else 0
+        stage_snapshot['out_per_second'] = (values['out'] - out_before) / elapsed if elapsed > 0 else 0.0
+        stage_snapshot['bytes_per_second'] = (values['bytes'] - bytes_before) / elapsed if elapsed > 0 else 0.0
+        count = values['latency_count']
+        stage_snapshot['latency'] = {'count': count, 'mean': values['latency_sum'] / count if count else 0.0,
+                                     'p50': quantile(values['buckets'], 0.5), 'p90': quantile(values['buckets'], 0.9),
+                                     'p99': quantile(values['buckets'], 0.99)}
+        snapshot['stages'][stage] = stage_snapshot
+    return snapshot
+
+
+def write_json(path, snapshot):
+    with open(path + '.tmp', 'w', encoding='utf-8') as f:
+        json.dump(snapshot, f, indent=2)
+    os.replace(path + '.tmp', path)
+
+
+def serve(metrics, port, gauges=None):
+    """
+    Serves the metrics in the Prometheus text format on http://localhost:<port>/metrics from a daemon thread
+    :param gauges: function returning the dict of gauges at the time of the request
+    :return: ThreadingHTTPServer
+    """
+    class MetricsHandler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            if self.path.split('?')[0] not in ('/', '/metrics'):
+                self.send_error(404)
+                return
+            body = prometheus_text(metrics, gauges() if gauges else None).encode('utf-8')
+            self.send_response(200)
+            self.send_header('Content-Type', 'text/plain; version=0.0.4; charset=utf-8')
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, *args):
+            pass
+
+    server = ThreadingHTTPServer(('127.0.0.1', port), MetricsHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
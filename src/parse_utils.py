@@ -1,8 +1,11 @@
-import requests
-from bs4 import BeautifulSoup
-from file_utils import write_files
+import asyncio
 import time
-from wiki_explore import clean_name
+from concurrent.futures import ThreadPoolExecutor
+import http_client
+from bs4 import BeautifulSoup
+from file_utils import write_files, close_files
+from category_api import process_api_page, get_category_title, wiki_link
+from category_graph import UNKNOWN
 import settings
 
 
@@ -18,17 +21,24 @@ def check_link_format(link):
 
 def process_page(url, parent_url, epnq):
     """
-    Process the entire page. Extract four different sets of data: 1. Extract all subcategory names and add it to
-    category_list 2. Extract all subcategory links and add it to category_link_list 3. Extract all page names and add
-    it to pages_list 4. Extract all page links and add it to pages_link_list
+    Process a single listing of a category page. Extract four different sets of data: 1. Extract all subcategory names
+    and add it to category_list 2. Extract all subcategory links and add it to category_link_list 3. Extract all page
+    names and add it to pages_list 4. Extract all page links and add it to pages_link_list. If the list of pages is
+    paginated, the link to the "next page" is returned so that it can be processed as a separate listing. If
+    settings.category_source is 'api', the listing is retrieved through process_api_page() instead
     :param epnq: Queue into which the name and the url is added for downstream processing
     :param url: URL of the page that is to be processed
     :param parent_url: The original URL from where the script was run. This is used because only the
     original url is of the format "en.wikipedia.org/wiki/....." while all other urls are of the form "/wiki/..."
-    :return: category_list, category_link_list, pages_list, pages_link_list
+    :return: category_list, category_link_list, pages_list, pages_link_list, done_list, next_page_link
     """
-    done_list = set()
     url = check_link_format(url)
+    if settings.category_source == 'api':
+        return process_api_page(url, parent_url, epnq)
+    if settings.http_cache:
+        return process_cached_page(url, parent_url, epnq)
+    done_list = set()
+    next_page_link = None
     subcat_section, pages_section, next_page_flag, url_retrieved = get_sections_and_next_flag(url)
     if subcat_section:
         category_list, category_link_list = get_categories(subcat_section)
@@ -37,32 +47,56 @@ def process_page(url, parent_url, epnq):
     if pages_section:
         pages_list, pages_link_list = get_pages(pages_section, epnq)
         if next_page_flag:
-            category_list1, category_link_list1, pages_list1, pages_link_list1, done_list1 = get_next_page(
-                pages_section, parent_url, epnq)
-            if category_list and category_list1:
-                category_list.update(category_list1)
-                category_link_list.update(category_link_list1)
-            elif not category_list and category_list1:
-                category_list, category_link_list = set(), set()
-                category_list.update(category_list1)
-                category_link_list.update(category_link_list1)
-            pages_list.update(pages_list1)
-            pages_link_list.update(pages_link_list1)
-            done_list.update(done_list1)
+            next_page_link = get_next_page_link(pages_section)
     else:
         pages_list, pages_link_list = None, None
 
     if url_retrieved:
-        if url == parent_url:
-            done_list.add(url)
-        else:
-            done_list.add(url.replace('https://en.wikipedia.org', ''))
+        done_list.add(done_link(url, parent_url))
     else:
         print('URL not retrieved: ', url)
-    return category_list, category_link_list, pages_list, pages_link_list, done_list
+    return category_list, category_link_list, pages_list, pages_link_list, done_list, next_page_link
 
 
-def get_sections_and_next_flag(url):
+def process_cached_page(url, parent_url, epnq):
+    """
+    Same as process_page() but the category page is downloaded through settings.http_cache. The listing extracted from
+    the page (subcategories, pages and the "next page" link) is cached with the page: if the page has not changed since
+    (304 Not Modified), the listing is taken from the cache and the page is not parsed again
+    :return: category_list, category_link_list, pages_list, pages_link_list, done_list, next_page_link
+    """
+    try:
+        response = settings.http_cache.get(url)
+    except Exception as e:
+        print(url)
+        print('Exception', e)
+        print('URL not retrieved: ', url)
+        return None, None, None, None, set(), None
+    listing = getattr(response, 'listing', None)
+    if listing is None:
+        subcat_section, pages_section, next_page_flag, url_retrieved = get_sections_and_next_flag(url, response)
+        if not url_retrieved:
+            print('URL not retrieved: ', url)
+            return None, None, None, None, set(), None
+        category_list, category_link_list = get_categories(subcat_section) if subcat_section else (set(), set())
+        listing = {'category_names': sorted(category_list), 'category_links': sorted(category_link_list),
+                   'pages': get_page_entries(pages_section) if pages_section else [],
+                   'next_page_link': get_next_page_link(pages_section) if pages_section and next_page_flag else None}
+        if response.status_code == 200:
+            settings.http_cache.set_listing(url, listing)
+    pages_list, pages_link_list = queue_pages(listing['pages'], epnq)
+    return (set(listing['category_names']) or None, set(listing['category_links']) or None, pages_list or None,
+            pages_link_list or None, {done_link(url, parent_url)}, listing['next_page_link'])
+
+
+def done_link(url, parent_url):
+    """
+    :return: url as it is recorded in done_links
+    """
+    return url if url == parent_url else url.replace('https://en.wikipedia.org', '')
+
+
+def get_sections_and_next_flag(url, response=None):
     """
     Every url provided is a category page e.g. https://en.wikipedia.org/wiki/Category:Physics_stubs which has two
     required subsections: Sub-category for to go deeper down the category hierarchy and pages which are the main
@@ -71,6 +105,7 @@ def get_sections_and_next_flag(url):
     more webpages to list the pages within the category. Specifically, it checks if there is a "Next Page" link in
     the "Pages in the category..." section
     :param url: url of the category page
+    :param response: response of the category page if it has already been downloaded
     :return: subcat_section - div pertaining to the subcategory section
     pages_section - div pertaining to the pages section
     next_page_flag - True if the list of pages in the page_section is paginated or not (multiple_pages)
@@ -82,18 +117,20 @@ def get_sections_and_next_flag(url):
     page = None
     url_retrieved = False
     try:
-        response = requests.get(url)
+        response = http_client.get(url) if response is None else response
         if response.status_code == 200:
             page = response.text
             url_retrieved = True
         elif response.status_code == 429:
             print('Overloaded response from Wikipedia. Pausing requests...')
             url_retrieved = False
-            time.sleep(30)
         else:
             print(response.status_code)
             page = None
             url_retrieved = True
+            if response.status_code >= 500:
+                # Not retried, but the members of the category are unknown
+                settings.failed_categories.add(url)
         if page:
             parser = BeautifulSoup(page, 'html.parser')
             subcat_section = parser.find('div', id='mw-subcategories')
@@ -146,36 +183,49 @@ def get_pages(pages_section, epnq):
     :param pages_section: pages_section from the get_sections_and_next_flag
     :return: list of pages under the category, ist of links of pages under the category
     """
+    return queue_pages(get_page_entries(pages_section), epnq)
+
+
+def get_page_entries(pages_section):
+    """
+    :param pages_section: pages_section from the get_sections_and_next_flag
+    :return: list of [page name, page link] of the pages in the section
+    """
+    entries = []
+    for page in pages_section.find_all('li'):
+        entries.append([str(page.find('a').contents[0]), (page.find('a'))['href']])
+    return entries
+
+
+def queue_pages(page_entries, epnq):
+    """
+    Adds the pages that are not processed or queued yet to epnq
+    :param page_entries: list of (page name, page link)
+    :param epnq: Queue into which the name and the url is added for downstream processing
+    :return: set of page names, set of page links
+    """
     pages_list, pages_link_list = set(), set()
-    pages = pages_section.find_all('li')
-    for page in pages:
-        page_name, page_url = page.find('a').contents[0], (page.find('a'))['href']
+    for page_name, page_url in page_entries:
         pages_list.add(page_name)
         pages_link_list.add(page_url)
-        page_name_clean = clean_name(page_name)
-        if page_name_clean not in settings.text_files:
+        if settings.dedup.claim(page_name):
+            if settings.ledger is not None:
+                settings.ledger.enqueue(str(page_name), page_url)
             epnq.put((str(page_name), page_url))
-
     return pages_list, pages_link_list
 
 
-def get_next_page(pages_section, parent_url, epnq):
+def get_next_page_link(pages_section):
     """
-    Extracts url of the "Next page" text. Runs process_page() for the next page and returns requisite categories,
-    categories, page names and page links on the "Next Page: get_pages_and_next_flag() get_categories get_pages
+    Extracts url of the "Next page" text in the pages section of a category page
     :param pages_section: Section of the main page which is titled "Pages in category <category>
-    :param parent_url: parent_url is just the root url from where the code starts. This is added only to pass this
-    argument to the process_page() function
-    :param epnq: Queue for storing (page names and page urls) for downstream processing
-    :param pages_section as obtained from get_sections_and_next_flag() parent_url: the original url from
-    where the scraping started. This is required for calling the process_page() function
-    :return:category_list, category_link_list, pages_list, pages_link_list of the "Next Page"
+    :return: url of the "Next Page" or None if the pages section is not paginated
     """
     a_tags = pages_section.find_all('a')
     for a_tag in a_tags:
         if a_tag.contents[0] == 'next page':
-            next_page_link = check_link_format(a_tag['href'])
-            return process_page(next_page_link, parent_url, epnq)
+            return check_link_format(a_tag['href'])
+    return None
 
 
 def update_settings(child_cat, child_cat_links, child_page, child_page_links, child_done_links):
@@ -186,32 +236,8 @@ def update_settings(child_cat, child_cat_links, child_page, child_page_links, ch
     if child_done_links: settings.done_links.update(child_done_links)
 
 
-def process_all_pages(child_depth_links, max_category_limit, max_page_limit, parent_url, i, epnq):
-    if epnq.qsize() > 0.8 * settings.MAXSIZE_EPNQ:  # to ensure that the epnq queue does not get jammed
-        time.sleep(10)
-    print('Depth:', i)
+def check_limits(max_category_limit, max_page_limit):
     file_limit = False
-    child_cat_depth, child_cat_links_depth, child_page_depth, child_page_links_depth, child_done_links_depth = set(), \
-        set(), set(), set(), set()
-    for url_index in range(len(list(child_depth_links))):
-        url = list(child_depth_links)[url_index]
-        child_cat, child_cat_links, child_page, child_page_links, child_done_links = process_page(url, parent_url, epnq)
-        if child_cat: child_cat_depth.update(child_cat)
-        if child_cat_links: child_cat_links_depth.update(child_cat_links)
-        if child_page: child_page_depth.update(child_page)
-        if child_page_links: child_page_links_depth.update(child_page_links)
-        if child_done_links: child_done_links_depth.update(child_done_links)
-        #time.sleep(len(child_depth_links) * 0.005)
-    child_depth_links.update(child_cat_links_depth)
-    child_depth_links -= child_done_links_depth
-    update_settings(child_cat_depth, child_cat_links_depth, child_page_depth, child_page_links_depth,
-                    child_done_links_depth)
-    write_files()
-    i += 1
-    if i % 1000 == 0:
-        print(
-            f'{i}th scraping session: Category links collected: {len(settings.cat_links)}\tDone Links:'
-            f'{len(settings.done_links)}')
     if max_category_limit > 0 or max_page_limit > 0:
         if 0 < max_category_limit <= len(settings.cat_names):
             print(
@@ -220,53 +246,119 @@ def process_all_pages(child_depth_links, max_category_limit, max_page_limit, par
             file_limit = True
         if 0 < max_page_limit <= len(settings.page_names):
             print(
-                f'Max category length of {max_page_limit} reached. Total category names extracted:'
-                f' {len(settings.cat_names)}')
+                f'Max page length of {max_page_limit} reached. Total page names extracted:'
+                f' {len(settings.page_names)}')
             file_limit = True
-    #time.sleep((i + 1) * 5)  # wait for the downstream processes to execute their queues the current depth level
-    return file_limit, i
+    return file_limit
 
 
-def process_depth_page(url, depth, parent_url, max_page_limit, max_category_limit, epnq):
-    file_limit = False
-    child_cat, child_cat_links, child_page, child_page_links, child_done_links = process_page(url, parent_url, epnq)
-    if child_cat is None:
-        print('Child cat is None')
-    if child_cat_links is None:
-        print('Child cat links is None')
-    if child_page is None:
-        print('child_page is None')
-    if child_page_links is None:
-        print('child_page_links is None')
-    if child_done_links is None:
-        print('child_done_links is None')
-    update_settings(child_cat, child_cat_links, child_page, child_page_links, child_done_links)
-    i = 0
-    child_depth_links = (child_cat_links - child_done_links)
-    while i < depth and len(settings.cat_links - settings.done_links) > 0 and not file_limit:
-        file_limit, i = process_all_pages(child_depth_links, max_category_limit, max_page_limit,
-                                          parent_url, i, epnq)
-    write_files()
-    return None
+async def crawl_categories(parent_url, depth, max_page_limit, max_category_limit, epnq, concurrency):
+    """
+    Crawls the category tree starting from parent_url with up to `concurrency` category pages being downloaded at the
+    same time. Each category page is processed by process_page() in a thread pool so that the pages found are put into
+    epnq while the other category pages are still being downloaded. The subcategories found are added to
+    settings.category_graph, which keeps the min depth of every category below the parent. A category is only
+    processed if its min depth is within the depth limit. If a shorter path to a category is found after it was
+    processed, the subcategories it led to that are now within the limit are processed too. "Next page" listings belong
+    to the category of the first listing
+    :param parent_url: the original url from where the scraping started
+    :param depth: max depth of the category tree to be crawled. If None, the crawl continues till all subcategories
+    are exhausted
+    :param max_page_limit: max number of page names to be collected
+    :param max_category_limit: max number of category names to be collected
+    :param epnq: Queue for storing (page names and page urls) for downstream processing
+    :param concurrency: max number of category pages being downloaded at the same time
+    :return: None. The listings that could not be retrieved are added to settings.failed_categories
+    """
+    loop = asyncio.get_running_loop()
+    executor = ThreadPoolExecutor(max_workers=concurrency, thread_name_prefix='crawl')
+    # With --profile cprofile the calls on the threads of the pool are profiled too
+    crawl_page = settings.thread_profiler.wrap(process_page) if settings.thread_profiler else process_page
+    graph = settings.category_graph
+    pending = asyncio.Queue()
+    scheduled, scheduled_categories = set(), set()
+    state = {'file_limit': False, 'processed': 0, 'level': 0}
+    retries = {}
 
+    def schedule(link, node):
+        if check_link_format(link) not in scheduled:
+            scheduled.add(check_link_format(link))
+            pending.put_nowait((link, node))
 
-def process_no_depth_page(url, parent_url, max_page_limit, max_category_limit, epnq):
-    file_limit = False
-    child_cat, child_cat_links, child_page, child_page_links, child_done_links = process_page(url, parent_url, epnq)
-    update_settings(child_cat, child_cat_links, child_page, child_page_links, child_done_links)
-    i = 0
-    child_depth_links = set()
-    while len(settings.cat_links - settings.done_links) > 0 and not file_limit:
-        file_limit, i = process_all_pages(child_depth_links, max_category_limit, max_page_limit, parent_url, i, epnq)
-    write_files()
-    return None
+    def schedule_category(node, link=None):
+        if node in scheduled_categories or (depth is not None and graph.depth[node] > depth):
+            return
+        link = link or wiki_link(graph.titles[node])
+        if depth is None and link in settings.done_links and not settings.update_mode:
+            return
+        scheduled_categories.add(node)
+        schedule(link, node)
 
+    root = graph.node(get_category_title(parent_url)[0])
+    graph.set_root(graph.titles[root])
+    scheduled_categories.add(root)
+    schedule(parent_url, root)
+    # Resume the categories that were identified but not traversed in an earlier session. An update goes through the
+    # whole tree again to find the pages that were added to or left it
+    if depth is None and not settings.update_mode:
+        for link in settings.cat_links - settings.done_links:
+            schedule_category(graph.node(get_category_title(link)[0]), link)
 
-def get_page_names(url, parent_url, mpl, mcl, depth, epnq):
-    if not depth:
-        process_no_depth_page(url, parent_url, mpl, mcl, epnq)
-    else:
-        process_depth_page(parent_url, depth, parent_url, mpl, mcl, epnq)
-    write_files()
-    for f in [settings.fcn, settings.fcl, settings.fdl, settings.fpl, settings.fpn]:
-        f.close()
+    async def crawl_worker():
+        while True:
+            url, node = await pending.get()
+            try:
+                if not state['file_limit']:
+                    # epnq is bounded: while it is full, process_page() blocks on put() in its thread of the pool
+                    settings.metrics.count('crawl', 'in')
+                    start = time.perf_counter()
+                    child_cat, child_cat_links, child_page, child_page_links, child_done_links, next_page_link = \
+                        await loop.run_in_executor(executor, crawl_page, url, parent_url, epnq)
+                    settings.metrics.observe('crawl', time.perf_counter() - start)
+                    settings.metrics.count('crawl', 'out' if child_done_links else 'errors')
+                    update_settings(child_cat, child_cat_links, child_page, child_page_links, child_done_links)
+                    level = graph.depth[node]
+                    if state['level'] < level < UNKNOWN:
+                        state['level'] = level
+                        print('Depth:', level)
+                    if not child_done_links and retries.get(url, 0) < 3:
+                        # Not retrieved (e.g. Wikipedia overloaded). The rate limiter holds back the retry
+                        retries[url] = retries.get(url, 0) + 1
+                        pending.put_nowait((url, node))
+                    elif not child_done_links:
+                        settings.failed_categories.add(url)
+                        print(f'Crawling failed for {url} after {retries[url]} retries')
+                    if next_page_link:
+                        schedule(next_page_link, node)
+                    if child_cat_links:
+                        links = {get_category_title(link)[0]: link for link in child_cat_links}
+                        # The edges are kept even beyond the depth limit, a shorter path found later brings them in
+                        improved = graph.add_children(graph.titles[node], links)
+                        for title, link in links.items():
+                            schedule_category(graph.ids[title], link)
+                        for child in improved:
+                            schedule_category(child)
+                    state['processed'] += 1
+                    if state['processed'] % 100 == 0:
+                        write_files()
+                        print(f'{state["processed"]} category pages scraped: Category links collected: '
+                              f'{len(settings.cat_links)}\tDone Links: {len(settings.done_links)}')
+                    state['file_limit'] = check_limits(max_category_limit, max_page_limit)
+            except Exception as e:
+                settings.metrics.count('crawl', 'errors')
+                settings.failed_categories.add(url)
+                print(f'Crawling failed for {url}. Exception: {e}')
+            finally:
+                pending.task_done()
+
+    workers = [asyncio.create_task(crawl_worker()) for _ in range(concurrency)]
+    await pending.join()
+    for worker in workers:
+        worker.cancel()
+    await asyncio.gather(*workers, return_exceptions=True)
+    executor.shutdown()
+
+
+def get_page_names(url, parent_url, mpl, mcl, depth, epnq, concurrency=8):
+    asyncio.run(crawl_categories(parent_url, depth, mpl, mcl, epnq, concurrency))
+    close_files()
@@ -0,0 +1,119 @@
+import threading
+import time
+
+# Control tokens that travel through the queues of the pipeline next to the pages. A worker that gets one finishes its
+# current batch and returns. EOS (end of stream) is sent to every worker of a stage once the stages before it have
+# ended, RETIRE to a single worker the autoscaler no longer needs
+EOS = 'EOS'
+RETIRE = 'RETIRE'
+STOP_TOKENS = (EOS, RETIRE)
+STAGE_ORDER = ['fetch', 'write_xml', 'parse', 'clean', 'write']
+DEFAULT_WORKERS = {'fetch': 12, 'write_xml': 5, 'parse': 1, 'clean': 2, 'write': 5}
+
+
+def queue_size(q):
+    """
+    :return: approximate number of items in the queue, -1 if it is not known: multiprocessing.Queue.qsize() raises
+    NotImplementedError on macOS, where sem_getvalue() is not implemented
+    """
+    try:
+        return q.qsize()
+    except NotImplementedError:
+        return -1
+
+
+class StagePool:
+    """
+    The workers (processes or threads) of one stage of the pipeline, which all read from the same input queue with
+    blocking gets. Workers are added by starting another one and removed by putting a RETIRE token into the input queue,
+    so a worker is never stopped in the middle of a page. Adding, retiring and draining hold a lock so that the
+    autoscaler thread never changes the workers while their tokens are counted
+    """
+    def __init__(self, name, start_worker, input_queue, workers, min_workers, max_workers, output_queue=None,
+                 output_maxsize=0):
+        """
+        :param name: one of STAGE_ORDER
+        :param start_worker: function returning a new (not started) Process or Thread of the stage
+        :param input_queue: queue the workers read from
+        :param workers: number of workers started right away
+        :param output_queue: queue the workers write to. The stage is not scaled up while it is nearly full
+        :param output_maxsize: maxsize of the output queue
+        """
+        self.name = name
+        self.start_worker = start_worker
+        self.input_queue = input_queue
+        self.output_queue = output_queue
+        self.output_maxsize = output_maxsize
+        self.min_workers = min_workers
+        self.max_workers = max_workers
+        self.workers = []
+        self.retiring = 0
+        self.lock = threading.RLock()
+        for _ in range(workers):
+            self.add()
+
+    def add(self):
+        with self.lock:
+            worker = self.start_worker()
+            worker.start()
+            self.workers.append(worker)
+
+    def retire(self):
+        with self.lock:
+            self.input_queue.put(RETIRE)
+            self.retiring += 1
+
+    def size(self):
+        """
+        :return: number of running workers that have not been asked to retire
+        """
+        with self.lock:
+            alive = [worker for worker in self.workers if worker.is_alive()]
+            self.retiring = max(self.retiring - (len(self.workers) - len(alive)), 0)
+            self.workers = alive
+            return len(alive) - self.retiring
+
+    def output_full(self):
+        return bool(self.output_queue is not None and self.output_maxsize and
+                    queue_size(self.output_queue) > 0.8 * self.output_maxsize)
+
+    def drain(self, rounds=3):
+        """
+        Ends the stage once all the pages in its input queue are handled: one EOS per worker is put behind the pages
+        and the workers are joined. Pages that the workers put back into their own input queue after the EOS (downloads
+        to be retried) are handled by workers started for another round
+        :param rounds: max number of rounds
+        :return: number of items left in the input queue, -1 if some are left but their number is not known
+        """
+        with self.lock:
+            for _ in range(rounds):
+                for _ in range(self.size()):
+                    self.input_queue.put(EOS)
+                for worker in self.workers:
+                    worker.join()
+                self.size()
+                if self.input_queue.empty():
+                    return 0
+                left = queue_size(self.input_queue)
+                print(f'{left if left >= 0 else "Some"} pages were put back into the queue of {self.name}. Draining '
+                      f'again')
+                for _ in range(max(self.min_workers, 1)):
+                    self.add()
+            return 0 if self.input_queue.empty() else queue_size(self.input_queue)
+
+
+def drain_pipeline(pools):
+    """
+    Shuts the pipeline down stage by stage in the order of the pools. A stage is drained once the stages before it
+    have ended, so no page is left in a queue and every worker has returned when this returns
+    :param pools: StagePools in the order of STAGE_ORDER
+    :return: dict of {stage: seconds its drain took}
+    """
+    durations = {}
+    for pool in pools:
+        start = time.time()
+        left = pool.drain()
+        durations[pool.name] = time.time() - start
+        if left:
+            print(f'{left if left > 0 else "Some"} pages left in the queue of {pool.name}')
+    return durations
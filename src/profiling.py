@@ -0,0 +1,273 @@
+import cProfile
+import collections
+import multiprocessing
+import os
+import pstats
+import signal
+import sys
+import threading
+import time
+import tracemalloc
+
+# Where the time of a function is attributed to in the report. Matched against "<file>:<function>" of the profile
+# entries (built-in functions have no file but their name tells the module)
+CATEGORIES = [('network', ('requests', 'urllib3', 'socket', 'ssl', 'http/client', 'http_client')),
+              ('BeautifulSoup', ('bs4', 'html/parser', 'soupsieve')),
+              ('SAX', ('xml/sax', 'expat')),
+              ('clean_text', ('wikitext_cleaner', 'cleaner.py', 're/__init__', "'re.Pattern'", '_sre')),
+              ('compression', ('bz2', 'gzip', 'lzma', 'zlib')),
+              ('json', ('json',)),
+              ('sqlite', ('sqlite3',)),
+              ('sleep', ('time.sleep',)),
+              ('waiting (queues, locks, polls)', ('multiprocessing', 'queue', 'threading', 'lock', 'Lock', 'select',
+                                                  'poll', 'posix.read', 'concurrent/futures'))]
+
+# Before Python 3.12 a cProfile traces the thread it is enabled in, so every thread can have its own. Since 3.12 it
+# traces all the threads of the process and enabling a second one raises ValueError
+THREAD_CPROFILE = sys.version_info < (3, 12)
+
+_stages = {}  # Thread ident: stage name, for the sampling profiler
+_sampler = None
+_sampler_lock = threading.Lock()
+_sampling_note = threading.Event()
+
+
+def category(location):
+    for name, patterns in CATEGORIES:
+        if any(pattern in location for pattern in patterns):
+            return name
+    return 'other'
+
+
+def profile_target(target, stage, args, options):
+    """
+    :param target: function run by a Process or Thread of the pipeline
+    :param stage: name of the stage for the profile dumps
+    :param args: arguments of target
+    :param options: profiling options or None if profiling is off
+    :return: dict of the target and args keywords for Process() or Thread()
+    """
+    if not options:
+        return {'target': target, 'args': args}
+    return {'target': run_profiled, 'args': (target, stage, options) + tuple(args)}
+
+
+def run_profiled(target, stage, options, *args):
+    """
+    Runs target(*args) under the profiler selected in options and writes the dumps of the thread to
+    options['directory'], tagged with the stage, pid and thread:
+    cprofile - <stage>-<pid>-<thread>.prof (pstats format)
+    sample - the threads of the process are sampled every options['interval'] seconds and the stacks are written to
+    sample-<pid>.collapsed (one "stage;frame;frame... count" line per stack) every few seconds
+    On Python 3.12+ only a stage that has a worker process to itself is run under cProfile, the threads of the main
+    process are sampled instead (see THREAD_CPROFILE)
+    options['tracemalloc'] - number of frames kept by tracemalloc (0 to switch it off). The snapshot covers the whole
+    process, so it is written once per process: by a worker process to <stage>-<pid>.tracemalloc when its stage ends,
+    by the main process with dump_allocations() at the end of the session
+    The dumps are also written if the process is terminated with SIGTERM
+    """
+    directory = options['directory']
+    os.makedirs(directory, exist_ok=True)
+    tag = f'{stage}-{os.getpid()}-{threading.get_ident()}'
+    worker_process = multiprocessing.parent_process() is not None and threading.current_thread() is \
+        threading.main_thread()
+    if threading.current_thread() is threading.main_thread():
+        signal.signal(signal.SIGTERM, lambda *_: sys.exit(0))
+    if options.get('tracemalloc') and not tracemalloc.is_tracing():
+        tracemalloc.start(options['tracemalloc'])
+    profile = None
+    if options['mode'] == 'cprofile' and (THREAD_CPROFILE or worker_process):
+        profile = cProfile.Profile()
+        profile.enable()
+    else:
+        if options['mode'] == 'cprofile' and not _sampling_note.is_set():
+            _sampling_note.set()
+            print(f'Python {sys.version_info[0]}.{sys.version_info[1]} runs one cProfile per process, the threads of '
+                  f'the main process are sampled instead')
+        _stages[threading.get_ident()] = stage
+        start_sampler(directory, options.get('interval', 0.01))
+    try:
+        return target(*args)
+    finally:
+        if profile:
+            profile.disable()
+            profile.dump_stats(os.path.join(directory, tag + '.prof'))
+        if worker_process:
+            dump_allocations(directory, stage)
+        if _sampler:
+            _stages.pop(threading.get_ident(), None)
+            _sampler.write()
+
+
+class Sampler:
+    """
+    Sampling profiler of the threads of the process that run a stage. Unlike cProfile it also sees the threads of a
+    thread pool started by a stage if the pool is named after the stage (thread names "<stage>_<n>", e.g. the pool of
+    the crawler)
+    """
+    def __init__(self, path, interval):
+        self.path = path
+        self.interval = interval
+        self.stacks = collections.Counter()
+        self.lock = threading.Lock()
+        threading.Thread(target=self.run, daemon=True).start()
+
+    def run(self):
+        own_ident = threading.get_ident()
+        last_write = time.time()
+        while True:
+            stages = dict(_stages)
+            for thread in threading.enumerate():
+                if thread.ident not in stages and thread.name.rpartition('_')[0] in _stages.values():
+                    stages[thread.ident] = thread.name.rpartition('_')[0]
+            with self.lock:
+                for ident, frame in sys._current_frames().items():
+                    if ident == own_ident or ident not in stages:
+                        continue
+                    stack = []
+                    while frame is not None:
+                        stack.append(f'{frame.f_code.co_filename}:{frame.f_code.co_name}')
+                        frame = frame.f_back
+                    self.stacks[';'.join([stages[ident]] + stack[::-1])] += 1
+            if time.time() - last_write >= 5:
+                self.write()
+                last_write = time.time()
+            time.sleep(self.interval)
+
+    def write(self):
+        with self.lock:
+            lines = [f'{stack} {count}\n' for stack, count in self.stacks.items()]
+        with open(self.path + '.tmp', 'w', encoding='utf-8') as f:
+            f.writelines(lines)
+        os.replace(self.path + '.tmp', self.path)
+
+
+def dump_allocations(directory, label):
+    """
+    Writes the tracemalloc snapshot of the process to <label>-<pid>.tracemalloc, if tracemalloc is on
+    """
+    if tracemalloc.is_tracing():
+        tracemalloc.take_snapshot().dump(os.path.join(directory, f'{label}-{os.getpid()}.tracemalloc'))
+
+
+def start_sampler(directory, interval):
+    global _sampler
+    with _sampler_lock:
+        if _sampler is None:
+            _sampler = Sampler(os.path.join(directory, f'sample-{os.getpid()}.collapsed'), interval)
+
+
+class ThreadCallProfiler:
+    """
+    cProfile for the calls that are run on the threads of a thread pool: every thread of the pool gets its own profile
+    which is only enabled while a wrapped call is running on it. Needs THREAD_CPROFILE
+    """
+    def __init__(self):
+        self.local = threading.local()
+        self.profiles = []
+
+    def wrap(self, function):
+        def profiled_call(*args):
+            profile = getattr(self.local, 'profile', None)
+            if profile is None:
+                profile = self.local.profile = cProfile.Profile()
+                self.profiles.append(profile)
+            profile.enable()
+            try:
+                return function(*args)
+            finally:
+                profile.disable()
+        return profiled_call
+
+    def dump(self, path):
+        """
+        Writes the merged profile of all threads. Must be called once the calls have finished
+        """
+        if self.profiles:
+            pstats.Stats(*self.profiles).dump_stats(path)
+
+
+def merge(directory, top=15):
+    """
+    Merges the dumps of all the processes and threads in the profile folder into one report: per stage, the share of
+    time spent on the network, BeautifulSoup, SAX, clean_text etc. and the functions with the highest own time.
+    Merged dumps per stage (<stage>.merged.prof, all.collapsed) are written next to the report for other tools
+    :param directory: profile folder
+    :return: the report as text (also written to profile_report.txt)
+    """
+    lines = []
+    prof_files = collections.defaultdict(list)
+    for file_name in sorted(os.listdir(directory)):
+        if file_name.endswith('.prof') and not file_name.endswith('.merged.prof'):
+            prof_files[file_name.split('-')[0]].append(os.path.join(directory, file_name))
+    for stage, files in prof_files.items():
+        stats = pstats.Stats(*files)
+        stats.dump_stats(os.path.join(directory, f'{stage}.merged.prof'))
+        own_time = collections.Counter()
+        for (file_name, line, function), (_, calls, total_time, cumulative_time, _) in stats.stats.items():
+            own_time[category(f'{file_name}:{function}')] += total_time
+        lines.append(f'== {stage}: {len(files)} processes/threads, {stats.total_tt:.2f} s profiled ==')
+        lines.extend(f'  {name:<32}{seconds:>10.2f} s{100 * seconds / (stats.total_tt or 1):>7.1f} %'
+                     for name, seconds in own_time.most_common())
+        lines.append(f'  Top {top} functions by own time:')
+        ranked = sorted(stats.stats.items(), key=lambda item: item[1][2], reverse=True)[:top]
+        lines.extend(f'  {total_time:>10.3f} s {calls:>9} calls  {file_name}:{line}({function})'
+                     for (file_name, line, function), (_, calls, total_time, _, _) in ranked)
+        lines.append('')
+
+    samples = collections.Counter()
+    for file_name in sorted(os.listdir(directory)):
+        if file_name.startswith('sample-') and file_name.endswith('.collapsed'):
+            with open(os.path.join(directory, file_name), encoding='utf-8') as f:
+                for line in f:
+                    stack, _, count = line.rstrip('\n').rpartition(' ')
+                    samples[stack] += int(count)
+    if samples:
+        with open(os.path.join(directory, 'all.collapsed'), 'w', encoding='utf-8') as f:
+            f.writelines(f'{stack} {count}\n' for stack, count in samples.items())
+        by_stage = collections.defaultdict(collections.Counter)
+        own_frames = collections.defaultdict(collections.Counter)
+        for stack, count in samples.items():
+            frames = stack.split(';')
+            by_stage[frames[0]][category(frames[-1])] += count
+            own_frames[frames[0]][frames[-1]] += count
+        for stage, categories in sorted(by_stage.items()):
+            total = sum(categories.values())
+            lines.append(f'== {stage}: {total} samples ==')
+            lines.extend(f'  {name:<32}{count:>10}{100 * count / total:>7.1f} %' for name, count in
+                         categories.most_common())
+            lines.append(f'  Top {top} frames by own samples:')
+            lines.extend(f'  {count:>10}  {frame}' for frame, count in own_frames[stage].most_common(top))
+            lines.append('')
+
+    # Allocations of the profilers themselves are left out
+    ignored = [tracemalloc.Filter(False, module.__file__) for module in (cProfile, tracemalloc, sys.modules[__name__])]
+    allocations = collections.defaultdict(lambda: collections.defaultdict(lambda: [0, 0]))
+    snapshot_counts = collections.Counter()
+    # A snapshot is labelled with the stage of its worker process or 'main' for the main process
+    for file_name in sorted(os.listdir(directory)):
+        if file_name.endswith('.tracemalloc'):
+            stage = file_name.split('-')[0]
+            snapshot_counts[stage] += 1
+            snapshot = tracemalloc.Snapshot.load(os.path.join(directory, file_name)).filter_traces(ignored)
+            for statistic in snapshot.statistics('lineno'):
+                allocation = allocations[stage][str(statistic.traceback)]
+                allocation[0] += statistic.size
+                allocation[1] += statistic.count
+    for stage, lines_allocated in sorted(allocations.items()):
+        size = sum(allocated for allocated, _ in lines_allocated.values())
+        lines.append(f'== {stage} memory: {size / 1e6:.1f} MB held at the end of {snapshot_counts[stage]} processes ==')
+        ranked = sorted(lines_allocated.items(), key=lambda item: item[1][0], reverse=True)[:top]
+        lines.extend(f'  {allocated / 1e6:>8.2f} MB {blocks:>9} blocks  {location}'
+                     for location, (allocated, blocks) in ranked)
+        lines.append('')
+
+    report = '\n'.join(lines)
+    with open(os.path.join(directory, 'profile_report.txt'), 'w', encoding='utf-8') as f:
+        f.write(report)
+    return report
+
+
+if __name__ == '__main__':
+    # Merge the dumps of a run into profile_report.txt: python profiling.py <profile folder>
+    print(merge(sys.argv[1]))
@@ -0,0 +1,111 @@
+import multiprocessing
+import time
+from email.utils import parsedate_to_datetime
+
+# Positions of the shared state in RateLimiter.state
+RATE, TOKENS, LAST_REFILL, BLOCKED_UNTIL, WINDOW_START, WINDOW_REQUESTS, WINDOW_429, TOTAL_REQUESTS, TOTAL_429, \
+    LAST_RATIO = range(10)
+
+
+def parse_retry_after(retry_after):
+    """
+    Retry-After can either be a number of seconds or an HTTP date
+    :param retry_after: value of the Retry-After header
+    :return: number of seconds to wait or None if the header is missing or invalid
+    """
+    if not retry_after:
+        return None
+    try:
+        return max(float(retry_after), 0.0)
+    except ValueError:
+        pass
+    try:
+        return max(parsedate_to_datetime(retry_after).timestamp() - time.time(), 0.0)
+    except (TypeError, ValueError):
+        return None
+
+
+class RateLimiter:
+    """
+    Token bucket shared by all the processes that make requests to Wikipedia. The state lives in shared memory so the
+    limiter must be created in the main process and passed to the worker processes as an argument.
+    The rate is adjusted with AIMD once every `window` seconds from the ratio of 429 responses seen in the window:
+    if the ratio is above `max_429_ratio` the rate is multiplied by `decrease`, if there were no 429 responses the
+    rate is increased by `increase` requests/second. A 429 response additionally blocks every process till the time
+    given in its Retry-After header (or `default_backoff` seconds if there is none)
+    """
+    def __init__(self, rate=10.0, min_rate=0.5, max_rate=50.0, burst=None, increase=0.5, decrease=0.5,
+                 max_429_ratio=0.01, window=5.0, default_backoff=5.0):
+        self.min_rate, self.max_rate = min_rate, max_rate
+        self.burst = burst if burst else max(rate, 1.0)
+        self.increase, self.decrease = increase, decrease
+        self.max_429_ratio = max_429_ratio
+        self.window = window
+        self.default_backoff = default_backoff
+        self.lock = multiprocessing.Lock()
+        self.state = multiprocessing.RawArray('d', 10)
+        now = time.time()
+        self.state[RATE] = rate
+        self.state[TOKENS] = self.burst
+        self.state[LAST_REFILL] = now
+        self.state[WINDOW_START] = now
+
+    def acquire(self):
+        """
+        Blocks till a request can be made
+        """
+        while True:
+            with self.lock:
+                now = time.time()
+                state = self.state
+                if now < state[BLOCKED_UNTIL]:
+                    wait = state[BLOCKED_UNTIL] - now
+                else:
+                    state[TOKENS] = min(self.burst, state[TOKENS] + (now - state[LAST_REFILL]) * state[RATE])
+                    state[LAST_REFILL] = now
+                    if state[TOKENS] >= 1:
+                        state[TOKENS] -= 1
+                        return
+                    wait = (1 - state[TOKENS]) / state[RATE]
+            time.sleep(min(wait, 1.0))
+
+    def report(self, status_code, retry_after=None):
+        """
+        Updates the limiter with the response of a request
+        :param status_code: status code of the response
+        :param retry_after: value of the Retry-After header of the response, if any
+        """
+        with self.lock:
+            now = time.time()
+            state = self.state
+            state[WINDOW_REQUESTS] += 1
+            state[TOTAL_REQUESTS] += 1
+            if status_code == 429:
+                state[WINDOW_429] += 1
+                state[TOTAL_429] += 1
+                backoff = parse_retry_after(retry_after)
+                backoff = self.default_backoff if backoff is None else backoff
+                state[BLOCKED_UNTIL] = max(state[BLOCKED_UNTIL], now + backoff)
+                state[TOKENS] = 0
+                state[LAST_REFILL] = max(state[LAST_REFILL], state[BLOCKED_UNTIL])
+            if now - state[WINDOW_START] >= self.window:
+                ratio = state[WINDOW_429] / state[WINDOW_REQUESTS]
+                if ratio > self.max_429_ratio:
+                    state[RATE] = max(self.min_rate, state[RATE] * self.decrease)
+                elif ratio == 0:
+                    state[RATE] = min(self.max_rate, state[RATE] + self.increase)
+                state[LAST_RATIO] = ratio
+                state[WINDOW_START] = now
+                state[WINDOW_REQUESTS] = 0
+                state[WINDOW_429] = 0
+
+    def snapshot(self):
+        """
+        :return: dict with the current rate and backoff state of the limiter for monitoring
+        """
+        with self.lock:
+            now = time.time()
+            return {'rate': self.state[RATE], 'tokens': self.state[TOKENS],
+                    'blocked_for': max(self.state[BLOCKED_UNTIL] - now, 0.0),
+                    'requests': int(self.state[TOTAL_REQUESTS]), 'responses_429': int(self.state[TOTAL_429]),
+                    'last_window_429_ratio': self.state[LAST_RATIO]}
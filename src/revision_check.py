@@ -0,0 +1,162 @@
+import os
+import http_client
+from corpus_reader import CorpusReader
+from dedup_index import JOURNAL_FILE, page_key
+from shard_writer import INDEX_FILE, REMOVED, clean_title, load_index
+from wiki_explore import clean_name
+import xml_archive
+
+API_URL = 'https://en.wikipedia.org/w/api.php'
+TITLES_PER_REQUEST = 50  # Max number of titles per query for clients without the apihighlimits right
+
+
+def load_revisions(directory):
+    """
+    :param directory: data folder of the output
+    :return: dict of {page key: (title, revision id, revision timestamp)} of the processed pages, as recorded in the
+    journal of the DedupIndex. Pages journaled by earlier versions (key only) are looked up in text_files, their
+    revision id is None if their record does not have one
+    """
+    revisions, legacy = {}, set()
+    path = os.path.join(directory, JOURNAL_FILE)
+    if os.path.exists(path):
+        with open(path, encoding='utf-8') as f:
+            for line in f:
+                key, *fields = line.rstrip('\n').split('\t')
+                if fields == ['-']:
+                    revisions.pop(key, None)
+                    legacy.discard(key)
+                elif fields:
+                    revid, timestamp, title = fields
+                    revisions[key] = (title, int(revid), timestamp)
+                    legacy.discard(key)
+                elif key not in revisions:
+                    legacy.add(key)
+    text_files_path = os.path.join(directory, 'text_files')
+    if legacy and os.path.exists(text_files_path):
+        for record in CorpusReader(text_files_path):
+            key = page_key(record['page'])
+            if key in legacy:
+                revisions[key] = (record['page'], record.get('revid'), record.get('timestamp'))
+    return revisions
+
+
+def query_revisions(titles, retries=3):
+    """
+    Asks the API for the latest revision of up to TITLES_PER_REQUEST pages with one request
+    :param titles: list of page titles
+    :return: dict of {title: (revision id, timestamp)}. Pages that do not exist (anymore) are None. None if the request
+    failed
+    """
+    params = {'action': 'query', 'prop': 'revisions', 'rvprop': 'ids|timestamp', 'titles': '|'.join(titles),
+              'format': 'json', 'formatversion': 2}
+    for _ in range(retries):
+        try:
+            response = http_client.post(API_URL, data=params)
+        except Exception as e:
+            print(f'Revision check failed for {len(titles)} pages. Exception: {e}')
+            continue
+        if response.status_code == 429:
+            print('Overloaded response from Wikipedia. Pausing requests...')
+            continue
+        if response.status_code != 200:
+            print(f'Revision check failed for {len(titles)} pages. Status: {response.status_code}')
+            return None
+        data = response.json().get('query', {})
+        # The API answers with the canonical titles, e.g. "Quantum field theory" for "Quantum_field_theory"
+        requested = {item['to']: item['from'] for item in data.get('normalized', [])}
+        pages = {}
+        for page in data.get('pages', []):
+            title = requested.get(page['title'], page['title'])
+            if page.get('missing') or page.get('invalid') or not page.get('revisions'):
+                pages[title] = None
+            else:
+                pages[title] = (page['revisions'][0]['revid'], page['revisions'][0]['timestamp'])
+        return pages
+    return None
+
+
+def current_revisions(titles):
+    """
+    :param titles: iterable of page titles
+    :return: dict of {title: (revision id, timestamp) or None}. Titles whose request failed are left out
+    """
+    titles = list(titles)
+    revisions = {}
+    for start in range(0, len(titles), TITLES_PER_REQUEST):
+        pages = query_revisions(titles[start:start + TITLES_PER_REQUEST])
+        if pages:
+            revisions.update(pages)
+    return revisions
+
+
+def remove_pages(directory, titles, dedup):
+    """
+    Removes pages from the output: their .json and .xml files are deleted, the shards and the xml archive get an index
+    line that removes them (the records stay in the compressed batches) and the DedupIndex forgets them
+    :param directory: data folder of the output
+    :param titles: titles of the pages
+    :param dedup: DedupIndex of the output
+    """
+    text_files_path, xml_files_path = os.path.join(directory, 'text_files'), os.path.join(directory, 'xml_files')
+    shard_index, archive_index = load_index(text_files_path), xml_archive.load_index(xml_files_path)
+    shard_removals, archive_removals = [], []
+    for title in titles:
+        for path in (os.path.join(text_files_path, clean_name(title) + '.json'),
+                     os.path.join(xml_files_path, clean_name(title) + '.xml')):
+            if os.path.exists(path):
+                os.remove(path)
+        removal = f'{clean_title(title)}\t{REMOVED}\n'
+        if clean_title(title) in shard_index:
+            shard_removals.append(removal)
+        if clean_title(title) in archive_index:
+            archive_removals.append(removal)
+        dedup.invalidate(title)
+    for index_path, removals in ((os.path.join(text_files_path, INDEX_FILE), shard_removals),
+                                 (os.path.join(xml_files_path, xml_archive.INDEX_FILE), archive_removals)):
+        if removals:
+            with open(index_path, 'a', encoding='utf-8') as f:
+                f.writelines(removals)
+
+
+def check_revisions(directory, dedup):
+    """
+    First step of an update (--update), before the pipeline is started: the revision of every processed page is
+    compared with its latest revision on Wikipedia, TITLES_PER_REQUEST pages per request. Pages that changed (or whose
+    revision is not known) are forgotten by the DedupIndex so that they are downloaded and cleaned again when the
+    crawler finds them, pages that were deleted from Wikipedia are removed
+    :param directory: data folder of the output
+    :param dedup: DedupIndex of the output
+    :return: dict of {page key: (title, revision id, timestamp)} of the pages known before the update that were not
+    deleted (for remove_unseen_pages()), list of titles changed, list of titles deleted
+    """
+    known = load_revisions(directory)
+    current = current_revisions(title for title, _, _ in known.values())
+    changed, deleted, checked = [], [], len(known)
+    for key, (title, revid, _) in list(known.items()):
+        if title not in current:
+            continue  # Not checked, the page is kept as it is
+        if current[title] is None:
+            deleted.append(title)
+            del known[key]
+        elif current[title][0] != revid:
+            changed.append(title)
+    for title in changed:
+        dedup.invalidate(title)
+    remove_pages(directory, deleted, dedup)
+    print(f'Update: {len(current)} of {checked} pages checked, {len(changed)} changed, {len(deleted)} deleted '
+          f'from Wikipedia')
+    return known, changed, deleted
+
+
+def remove_unseen_pages(directory, known, dedup):
+    """
+    Last step of an update, once the crawl has gone through the whole category tree and the pipeline is drained: pages
+    of the earlier sessions that the crawler did not find anymore have left the category tree and are removed
+    :param known: pages returned by check_revisions()
+    :return: list of titles removed
+    """
+    titles = [title for key, (title, _, _) in known.items() if key not in dedup.seen]
+    remove_pages(directory, titles, dedup)
+    print(f'Update: {len(titles)} pages that left the category tree removed')
+    return titles
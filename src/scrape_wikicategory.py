@@ -1,18 +1,36 @@
 from multiprocessing import Process
 import multiprocessing
 import logging
-from threading import Thread
-from wiki_explore import process_article, write_out, display, get_content, extract_content, write_xml_data
-from parse_utils import check_link_format, get_page_names
+from threading import Thread, Event
+import time
+from wiki_explore import process_article, write_out, write_out_shards, display, pipeline_gauges, get_content, \
+    get_content_batched, extract_content, write_xml_data, write_xml_archive
+from parse_utils import check_link_format, get_page_names, queue_pages, update_settings
 import argparse
 import settings
 import os
-from file_utils import initiate_file_opens
+import http_client
+from rate_limiter import RateLimiter
+from dedup_index import DedupIndex
+from shard_writer import ShardWriter
+from xml_archive import XmlArchive
+from metrics import Metrics, serve
+from profiling import profile_target, run_profiled, merge, dump_allocations, ThreadCallProfiler, THREAD_CPROFILE
+from file_utils import initiate_file_opens, close_files
+from autoscaler import Autoscaler, DEFAULT_BOUNDS, parse_bounds
+from pipeline import StagePool, DEFAULT_WORKERS, STAGE_ORDER, drain_pipeline
+from revision_check import check_revisions, remove_unseen_pages
+from http_cache import HTTPCache, CACHE_DIR
+from category_graph import CategoryGraph
+from work_ledger import WorkLedger, LEDGER_FILE
+from dump_reader import DumpReader, build_offsets, get_content_from_dump
+from category_api import wiki_link
 
 args_parser = argparse.ArgumentParser()
-args_parser.add_argument('parent_link', help='The parent category page from where the crawling will begin. Such urls '
-                                             'should be in the format "https://en.wikipedia.org/wiki/Category:". Refer '
-                                             'to the README.md for more details')
+args_parser.add_argument('parent_link', nargs='?',
+                         help='The parent category page from where the crawling will begin. Such urls should be in the '
+                              'format "https://en.wikipedia.org/wiki/Category:". Refer to the README.md for more '
+                              'details. Not needed with --titles')
 args_parser.add_argument('-o', '--output_dir', help='The output directory where the output will be stored.If not '
                                                     'provided, the current directory will be considered the output '
                                                     'directory')
@@ -33,67 +51,379 @@ args_parser.add_argument('-d', '--depth',
                               'before crawling is halted.e.g. if we want 15 levels of category crawling from the root '
                               'url, we say -d 15 or  --depth 15')
 
+args_parser.add_argument('-bs', '--batch_size',
+                         help='Number of pages to be downloaded in a single Special:Export request. If not provided or '
+                              '1, every page is downloaded with its own request. With --dump, number of pages looked '
+                              'up in the dump at a time (default 1000)')
+
+args_parser.add_argument('-bt', '--batch_timeout',
+                         help='Max number of seconds to wait for a batch of pages to fill up before it is downloaded '
+                              'anyway. Only used if batch_size is more than 1. Default is 5 seconds')
+
+args_parser.add_argument('-c', '--concurrency',
+                         help='Max number of category pages that are downloaded at the same time while crawling the '
+                              'category tree. Default is 8')
+
+args_parser.add_argument('-s', '--source', choices=['html', 'api'], default='html',
+                         help='Backend used to list the subcategories and pages of a category. "html" scrapes the '
+                              'category pages (200 entries per request) while "api" uses the MediaWiki '
+                              'categorymembers API (500 entries per request). Default is html')
+
+args_parser.add_argument('-ps', '--pool_size',
+                         help='Max number of kept-alive connections to Wikipedia per process. Default is 10')
+
+args_parser.add_argument('-t', '--timeout',
+                         help='Max number of seconds to wait for a response from Wikipedia. Default is 60 seconds')
+
+args_parser.add_argument('--http_timings',
+                         help='Directory where the timing of every request is logged (one csv file per process). Run '
+                              '"python http_client.py <directory>" to see how much time went into connection setup '
+                              'and how much into downloading')
+
+args_parser.add_argument('-r', '--rate',
+                         help='Initial number of requests per second to Wikipedia across all processes. The rate is '
+                              'lowered when Wikipedia responds with 429 (overloaded) and raised again when it does '
+                              'not. Default is 10')
+
+args_parser.add_argument('-mr', '--max_rate',
+                         help='Max number of requests per second to Wikipedia across all processes. Default is 50')
+
+args_parser.add_argument('-of', '--output_format', choices=['files', 'jsonl'], default='files',
+                         help='"files" writes every page into its own .json file in text_files. "jsonl" appends the '
+                              'pages to rotating JSON lines shards (corpus-00000.jsonl.gz, ...) in text_files with an '
+                              'index.tsv to look up single pages. Default is files')
+
+args_parser.add_argument('--shard_max_mb',
+                         help='Max size of a shard in MB before a new shard is started. Only used with -of jsonl. '
+                              'Default is 256')
+
+args_parser.add_argument('--shard_max_records',
+                         help='Max number of pages in a shard before a new shard is started. Only used with -of jsonl. '
+                              'Default is 100000')
+
+args_parser.add_argument('--compression', choices=['none', 'gzip', 'xz'], default='gzip',
+                         help='Compression of the shards. Only used with -of jsonl. Default is gzip')
+
+args_parser.add_argument('-xf', '--xml_format', choices=['files', 'archive'], default='files',
+                         help='"files" writes the raw XML of every page into its own .xml file in xml_files. "archive" '
+                              'packs the pages into blocks of bz2 compressed XML (pages-00000.xml.bz2, ...) in '
+                              'xml_files with an archive.index.tsv to extract single pages. Default is files')
+
+args_parser.add_argument('--metrics_port',
+                         help='Port on which the counters and latency histograms of every stage are served in the '
+                              'Prometheus text format (http://localhost:<port>/metrics). A JSON snapshot of the same '
+                              'metrics is written to metrics.json in the output folder every 10 seconds either way')
+
+args_parser.add_argument('--profile', choices=['cprofile', 'sample'],
+                         help='Profile every process and thread of the pipeline. "cprofile" traces every function call '
+                              '(exact but slower), "sample" records the stacks of all threads every 10 ms. The dumps '
+                              'of every process are tagged with the name of its stage and merged into '
+                              'profile_report.txt, which shows the share of time spent on the network, BeautifulSoup, '
+                              'SAX parsing, clean_text etc. per stage')
+
+args_parser.add_argument('--profile_dir',
+                         help='Directory where the profile dumps and the report are written. Default is the profiles '
+                              'folder in the output folder')
+
+args_parser.add_argument('--tracemalloc',
+                         help='Number of frames kept per memory allocation by tracemalloc. If given with --profile, a '
+                              'snapshot of the allocations of every process is added to the profile dumps')
+
+args_parser.add_argument('--fetchers', type=int,
+                         help='Number of processes downloading the pages (reading them from the dump with --dump). '
+                              'Default is 12 (the number of CPUs with --dump)')
+
+args_parser.add_argument('--xml_writers', type=int, default=DEFAULT_WORKERS['write_xml'],
+                         help='Number of threads writing the raw XML to disk. Default is 5')
+
+args_parser.add_argument('--parsers', type=int, default=DEFAULT_WORKERS['parse'],
+                         help='Number of processes parsing the XML of the pages. Default is 1')
+
+args_parser.add_argument('--cleaners', type=int, default=DEFAULT_WORKERS['clean'],
+                         help='Number of processes cleaning the text of the pages. Default is 2')
+
+args_parser.add_argument('--clean_batch', type=int, default=20,
+                         help='Max number of articles passed to a cleaning process in one message (at most 1 MB of '
+                              'wikitext). Batches save the cost of a message per article, which is more than the '
+                              'cleaning of a stub article. Default is 20')
+
+args_parser.add_argument('--clean_batch_timeout', type=float, default=0.5,
+                         help='Max number of seconds an article waits for its batch to fill up before the batch is '
+                              'passed to the cleaning anyway. Default is 0.5 seconds')
+
+args_parser.add_argument('--writers', type=int, default=DEFAULT_WORKERS['write'],
+                         help='Number of threads writing the processed pages to text_files. Default is 5')
+
+args_parser.add_argument('--autoscale', action='store_true',
+                         help='Start and stop workers of every stage while crawling: a stage gets another worker while '
+                              'its input queue keeps growing and its workers are busy, and loses one while its input '
+                              'queue stays empty. The numbers above are the initial worker counts then')
+
+args_parser.add_argument('--worker_bounds', type=parse_bounds,
+                         help='Min and max number of workers per stage for --autoscale, e.g. "fetch=4:24,clean=1:8". '
+                              'Stages are fetch, write_xml, parse, clean and write. Default is fetch=2:32, '
+                              'write_xml=1:8, parse=1:<CPUs>, clean=1:<CPUs> and write=1:8')
+
+args_parser.add_argument('--cpu_budget', type=float,
+                         help='Max number of CPUs the workers are expected to use with --autoscale. A parsing or '
+                              'cleaning worker counts as 1 CPU, a downloading or writing worker as 0.1 CPU. Default '
+                              'is the number of CPUs')
+
+args_parser.add_argument('--autoscale_interval', type=float, default=5,
+                         help='Seconds between two scaling decisions with --autoscale. Default is 5')
+
+args_parser.add_argument('-u', '--update', action='store_true',
+                         help='Update the output of an earlier session: the latest revision of every page written is '
+                              'asked from Wikipedia (50 pages per request) and only the pages that changed are '
+                              'downloaded and cleaned again. The whole category tree is crawled again to download the '
+                              'pages added to it, and pages that left it (or were deleted from Wikipedia) are removed '
+                              'from the output. Pages are only removed if neither -pl nor -cl is given')
+
+args_parser.add_argument('--http_cache_mb', type=float, default=200,
+                         help='Max size in MB of the cache of the category pages in the output folder (http_cache). '
+                              'Cached pages are revalidated with conditional requests, so a category page that did '
+                              'not change since an earlier session is neither downloaded nor parsed again. The least '
+                              'recently used pages are evicted. 0 switches the cache off. Default is 200')
+
+args_parser.add_argument('--dump',
+                         help='pages-articles-multistream.xml.bz2 dump of Wikipedia from which the pages are read '
+                              'instead of being downloaded with Special:Export. The category tree is still crawled to '
+                              'find the pages, unless --titles is given')
+
+args_parser.add_argument('--dump_index',
+                         help='Offset index of the dump (pages-articles-multistream-index.txt.bz2). Default is the '
+                              'index named after the dump in the same folder')
+
+args_parser.add_argument('--titles',
+                         help='Text file with one page title per line. These pages are processed instead of crawling '
+                              'a category tree. With --dump no network access is needed')
+
 args = args_parser.parse_args()
+if not args.parent_link and not args.titles:
+    args_parser.error('a parent category page or --titles is required')
 url = args.parent_link
-parent_url = check_link_format(url)
+parent_url = check_link_format(url) if url else None
 output_dir = args.output_dir if args.output_dir else None
 mpl = int(args.max_page_limit) if args.max_page_limit else -1
 mcl = int(args.max_cat_limit) if args.max_cat_limit else -1
 depth = int(args.depth) if args.depth else None
+concurrency = int(args.concurrency) if args.concurrency else 8
+batch_size = int(args.batch_size) if args.batch_size else 1
+batch_timeout = float(args.batch_timeout) if args.batch_timeout else 5
+clean_batch = max(args.clean_batch, 1)
+fetchers = args.fetchers or (os.cpu_count() or 1 if args.dump else DEFAULT_WORKERS['fetch'])
+http_client.configure(pool_size=max(int(args.pool_size) if args.pool_size else 10, concurrency),
+                      read_timeout=float(args.timeout) if args.timeout else None,
+                      timings_dir=os.path.abspath(args.http_timings) if args.http_timings else None)
 
 logger = logging.getLogger(__name__)
 
 if __name__ == "__main__":
-    shutdown = False
-    manager = multiprocessing.Manager()
+    start_time = time.time()
     settings.init()
+    rate_limiter = RateLimiter(rate=float(args.rate) if args.rate else 10.0,
+                               max_rate=float(args.max_rate) if args.max_rate else 50.0)
+    http_client.set_rate_limiter(rate_limiter)
+    # Counters and histograms in shared memory so that the numbers of all the processes add up
+    metrics = Metrics()
+    settings.metrics = metrics
+    http_client.set_metrics(metrics)
+    settings.category_source = args.source
     updated_output_dir = initiate_file_opens(output_dir, parent_url)
     XML_DATA_PATH = os.path.join(updated_output_dir, 'xml_files')
     PROCESSED_DATA_PATH = os.path.join(updated_output_dir, 'text_files')
     settings.MAXSIZE_EPNQ = 100000
     settings.MAXSIZE_EOQ = 5000
-    settings.text_files = [x[:-4] for x in os.listdir(PROCESSED_DATA_PATH)] # Remove XML file extension from file name.
+    # Pages processed in earlier sessions (and pages queued in this one) are not downloaded again
+    settings.dedup = DedupIndex(updated_output_dir)
+    if args.http_cache_mb > 0:
+        settings.http_cache = HTTPCache(os.path.join(updated_output_dir, CACHE_DIR), args.http_cache_mb * 1e6)
+    if args.update:
+        # Before the download processes are started, so that they do not know the changed pages as processed
+        settings.update_mode = True
+        # The graph is built again from the crawl since categories may have been moved
+        settings.category_graph = CategoryGraph()
+        known_pages, _, _ = check_revisions(updated_output_dir, settings.dedup)
+    # Pages left in the pipeline by a session that did not finish are resumed at the last stage they completed
+    settings.ledger = WorkLedger(os.path.join(updated_output_dir, LEDGER_FILE))
+    resumed_fetch, resumed_parse = settings.ledger.resume(settings.dedup)
+    profile_options = None
+    if args.profile:
+        profile_options = {'mode': args.profile, 'interval': 0.01,
+                           'directory': os.path.abspath(args.profile_dir) if args.profile_dir else
+                           os.path.join(updated_output_dir, 'profiles'),
+                           'tracemalloc': int(args.tracemalloc) if args.tracemalloc else 0}
+        if args.profile == 'cprofile' and THREAD_CPROFILE:
+            settings.thread_profiler = ThreadCallProfiler()
 
-    extracted_page_name_queue = manager.Queue(maxsize=settings.MAXSIZE_EPNQ)
-    xml_content_queue = manager.Queue(maxsize=settings.MAXSIZE_EOQ)
-    content_text_queue = manager.Queue(maxsize=settings.MAXSIZE_EOQ)
-    cleaned_text_queue = manager.Queue(maxsize=settings.MAXSIZE_EOQ)
-    raw_xml_queue = manager.Queue(maxsize=settings.MAXSIZE_EOQ)
+    # Queues connect the processes directly through pipes so that every message is pickled once by the sender instead
+    # of being routed through a Manager server process. The queues are bounded: a stage that is faster than the next
+    # one blocks on put() until there is room again
+    extracted_page_name_queue = multiprocessing.Queue(maxsize=settings.MAXSIZE_EPNQ)
+    xml_content_queue = multiprocessing.Queue(maxsize=settings.MAXSIZE_EOQ)
+    # Holds batches of up to clean_batch articles
+    ctq_maxsize = max(settings.MAXSIZE_EOQ // clean_batch, 10)
+    content_text_queue = multiprocessing.Queue(maxsize=ctq_maxsize)
+    cleaned_text_queue = multiprocessing.Queue(maxsize=settings.MAXSIZE_EOQ)
+    raw_xml_queue = multiprocessing.Queue(maxsize=settings.MAXSIZE_EOQ)
 
+    stop_display, stop_autoscaler = Event(), Event()
     status = Thread(target=display, args=(extracted_page_name_queue, xml_content_queue, content_text_queue,
-                                          cleaned_text_queue, raw_xml_queue,shutdown))
+                                          cleaned_text_queue, raw_xml_queue, rate_limiter, metrics,
+                                          os.path.join(updated_output_dir, 'metrics.json'), stop_display))
     status.start()
+    if args.metrics_port:
+        serve(metrics, int(args.metrics_port),
+              lambda: pipeline_gauges(extracted_page_name_queue, xml_content_queue, content_text_queue,
+                                      cleaned_text_queue, raw_xml_queue, rate_limiter))
+
+    if args.dump:
+        # The pages are read from the dump and parsed by the same processes, the xml writers and the parsing
+        # processes are not needed
+        build_offsets(args.dump, args.dump_index)
+        dump_reader = DumpReader(args.dump)
+
+        def start_fetcher():
+            return Process(**profile_target(get_content_from_dump, 'fetch',
+                                            (extracted_page_name_queue, content_text_queue, dump_reader,
+                                             batch_size if batch_size > 1 else 1000, batch_timeout, clean_batch,
+                                             settings.dedup, metrics), profile_options))
+    # Download the XML file from the net
+    elif batch_size > 1:
+        def start_fetcher():
+            return Process(**profile_target(get_content_batched, 'fetch',
+                                            (extracted_page_name_queue, raw_xml_queue, batch_size, batch_timeout,
+                                             settings.dedup, rate_limiter, metrics), profile_options))
+    else:
+        def start_fetcher():
+            return Process(**profile_target(get_content, 'fetch',
+                                            (extracted_page_name_queue, raw_xml_queue, settings.dedup, rate_limiter,
+                                             metrics), profile_options))
 
-    get_pages = {}  # Download the XML file from the net
-    for i in range(12):
-        get_pages[i] = Process(target=get_content,
-                               args=(extracted_page_name_queue, xml_content_queue, raw_xml_queue, shutdown))
-        get_pages[i].start()
+    # Threads to write xml to disk. Only the path of the file written is passed on to the parsing process
+    xml_archive = XmlArchive(XML_DATA_PATH) if args.xml_format == 'archive' else None
+    if xml_archive:
+        def start_xml_writer():
+            return Thread(**profile_target(write_xml_archive, 'write_xml',
+                                           (raw_xml_queue, xml_content_queue, xml_archive, settings.ledger, 100, 1,
+                                            metrics),
+                                           profile_options))
+    else:
+        def start_xml_writer():
+            return Thread(**profile_target(write_xml_data, 'write_xml',
+                                           (raw_xml_queue, xml_content_queue, XML_DATA_PATH, settings.ledger, metrics),
+                                           profile_options))
 
-    retrieval_processes = {}  # Threads to get the content from the xml file
-    for i in range(1):
-        retrieval_processes[i] = Process(target=extract_content, args=(xml_content_queue, content_text_queue, shutdown))
-        retrieval_processes[i].start()
+    # Processes to get the content from the xml file
+    def start_parser():
+        return Process(**profile_target(extract_content, 'parse',
+                                        (xml_content_queue, content_text_queue, clean_batch,
+                                         args.clean_batch_timeout, metrics), profile_options))
 
-    processing_processes = {}  # Threads to clean the data
-    for i in range(2):
-        processing_processes[i] = Process(target=process_article,
-                                          args=(content_text_queue, cleaned_text_queue, shutdown))
-        processing_processes[i].start()
+    # Processes to clean the data
+    def start_cleaner():
+        return Process(**profile_target(process_article, 'clean', (content_text_queue, cleaned_text_queue, metrics),
+                                        profile_options))
 
     # Threads to write data to disk
-    writing_final_process = {}
-    for i in range(5):
-        writing_final_process[i] = Thread(target=write_out, args=(cleaned_text_queue, PROCESSED_DATA_PATH, shutdown))
-        writing_final_process[i].start()
-
-    # Threads to write xml to disk
-    writing_xml_processes = {}
-    for i in range(5):
-        writing_xml_processes[i] = Thread(target=write_xml_data, args=(raw_xml_queue, XML_DATA_PATH, shutdown))
-        writing_xml_processes[i].start()
-
-    parent_url = check_link_format(url)
-    get_page_names(url, parent_url, mcl, mpl, depth, extracted_page_name_queue)
-    shutdown = True if [extracted_page_name_queue.qsize(), xml_content_queue.qsize(), content_text_queue.qsize(),
-                        cleaned_text_queue.qsize(), raw_xml_queue.qsize()] == [0, 0, 0, 0, 0] else False
+    shard_writer = None
+    if args.output_format == 'jsonl':
+        shard_max_records = int(args.shard_max_records) if args.shard_max_records else 100000
+        shard_writer = ShardWriter(PROCESSED_DATA_PATH, max_mb=float(args.shard_max_mb) if args.shard_max_mb else 256,
+                                   max_records=shard_max_records, compression=args.compression)
+
+        def start_writer():
+            return Thread(**profile_target(write_out_shards, 'write',
+                                           (cleaned_text_queue, shard_writer, settings.dedup, settings.ledger,
+                                            min(100, shard_max_records), 1, metrics), profile_options))
+    else:
+        def start_writer():
+            return Thread(**profile_target(write_out, 'write',
+                                           (cleaned_text_queue, PROCESSED_DATA_PATH, settings.dedup, settings.ledger,
+                                            metrics),
+                                           profile_options))
+
+    # Input queue, output queue and its maxsize, function starting a worker and initial count of every stage
+    stages = {'fetch': (extracted_page_name_queue, content_text_queue if args.dump else raw_xml_queue,
+                        ctq_maxsize if args.dump else settings.MAXSIZE_EOQ, start_fetcher, fetchers),
+              'write_xml': (raw_xml_queue, xml_content_queue, settings.MAXSIZE_EOQ, start_xml_writer,
+                            0 if args.dump else args.xml_writers),
+              # With --dump only the pages whose XML was written by an earlier session are parsed
+              'parse': (xml_content_queue, content_text_queue, ctq_maxsize, start_parser,
+                        args.parsers if not args.dump or resumed_parse else 0),
+              'clean': (content_text_queue, cleaned_text_queue, settings.MAXSIZE_EOQ, start_cleaner, args.cleaners),
+              'write': (cleaned_text_queue, None, 0, start_writer, args.writers)}
+    bounds = {**DEFAULT_BOUNDS, **(args.worker_bounds or {})}
+    stage_pools = []
+    autoscaler_thread = None
+    for stage in STAGE_ORDER:
+        input_queue, output_queue, output_maxsize, start_worker, workers = stages[stage]
+        min_workers, max_workers = bounds[stage] if args.autoscale else (workers, workers)
+        stage_pools.append(StagePool(stage, start_worker, input_queue, workers, min(min_workers, workers),
+                                     max(max_workers, workers), output_queue, output_maxsize))
+    if args.autoscale:
+        autoscaler = Autoscaler(stage_pools, metrics, cpu_budget=args.cpu_budget, interval=args.autoscale_interval,
+                                rate_limiter=rate_limiter)
+        autoscaler_thread = Thread(target=autoscaler.run, args=(stop_autoscaler,), daemon=True)
+        autoscaler_thread.start()
+
+    for page_name, page_url in resumed_fetch:
+        if settings.dedup.claim(page_name):
+            extracted_page_name_queue.put((page_name, page_url))
+    for page_name, page_url, xml_handle in resumed_parse:
+        if settings.dedup.claim(page_name):
+            xml_content_queue.put((page_name, page_url, xml_handle))
+
+    if args.titles:
+        # No crawl: the pages of the list are queued right away
+        with open(args.titles, encoding='utf-8') as f:
+            titles = [line.strip() for line in f if line.strip()]
+        pages, page_links = queue_pages([(title, wiki_link(title)) for title in titles], extracted_page_name_queue)
+        update_settings(None, None, pages, page_links, None)
+        close_files()
+        print(f'{len(titles)} pages queued from {args.titles}')
+    elif profile_options:
+        run_profiled(get_page_names, 'crawl', profile_options, url, parent_url, mpl, mcl, depth,
+                     extracted_page_name_queue, concurrency)
+        if settings.thread_profiler:
+            settings.thread_profiler.dump(os.path.join(profile_options['directory'], f'crawl-{os.getpid()}-pool.prof'))
+    else:
+        get_page_names(url, parent_url, mpl, mcl, depth, extracted_page_name_queue, concurrency)
+    if settings.http_cache:
+        print(settings.http_cache.summary())
+        settings.http_cache.close()
+
+    # All pages are in the queue of the downloads: every stage is ended once the stages before it have ended and all
+    # the pages in its queue are handled
+    stop_autoscaler.set()
+    if autoscaler_thread:
+        # A scaling round still running could add or retire workers while the stages are drained
+        autoscaler_thread.join()
+    drain_times = drain_pipeline(stage_pools)
+    if xml_archive:
+        xml_archive.close()
+    if shard_writer:
+        shard_writer.close()
+    # Redirects and pages without an article are acknowledged when they are left out, what is left failed
+    failed_pages = len(settings.ledger)
+    if failed_pages:
+        print(f'{failed_pages} pages failed to download or parse and are retried by the next session')
+    settings.ledger.close()
+    if args.update:
+        if mpl != -1 or mcl != -1:
+            print('Update: pages that left the category tree are not removed since the crawl was limited')
+        elif settings.failed_categories:
+            # The pages of a category that was not listed were not seen although they may still be in the tree
+            print(f'Update: pages that left the category tree are not removed since {len(settings.failed_categories)} '
+                  f'category pages could not be retrieved. Run the update again')
+        else:
+            remove_unseen_pages(updated_output_dir, known_pages, settings.dedup)
+    stop_display.set()
+    status.join()
+    print('Draining took', ', '.join(f'{stage} {seconds:.1f}s' for stage, seconds in drain_times.items()))
+    if profile_options:
+        # The crawl and the writer threads share the memory of the main process
+        dump_allocations(profile_options['directory'], 'main')
+        merge(profile_options['directory'])
+        print('Profile report written to', os.path.join(profile_options['directory'], 'profile_report.txt'))
+    print(f'Finished in {time.time() - start_time:.0f} seconds')
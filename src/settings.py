@@ -1,8 +1,16 @@
 def init():
-    global fcn, fcl, fdl, fpl, fpn, cat_names, cat_links, done_links, page_links, page_names
-    fcn, fcl, fdl, fpl, fpn, cat_names, cat_links, done_links, page_links, page_names = None, None, None, None, None, None, None, None, None, None
-    global MAXSIZE_EPNQ, EOQ_COUNT, text_files, count_files
+    global state, cat_names, cat_links, done_links, page_links, page_names, category_graph, ledger
+    state, cat_names, cat_links, done_links, page_links, page_names = None, None, None, None, None, None
+    global MAXSIZE_EPNQ, EOQ_COUNT, dedup, metrics, category_source, thread_profiler, update_mode, http_cache
+    global failed_categories
     MAXSIZE_EPNQ = 0
     EOQ_COUNT = 0
-    text_files = []
-    count_files = 0
+    dedup = None
+    metrics = None
+    category_source = 'html'
+    thread_profiler = None
+    update_mode = False
+    http_cache = None
+    category_graph = None
+    ledger = None
+    failed_categories = set()  # Category listings that could not be retrieved by the crawl
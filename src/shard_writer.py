@@ -0,0 +1,139 @@
+import gzip
+import json
+import lzma
+import os
+import re
+import sys
+import threading
+
+INDEX_FILE = 'index.tsv'
+SHARD_NAME = re.compile(r'^corpus-(\d{5})\.jsonl(\.gz|\.xz)?$')
+# Extension of the shards and the functions that (de)compress a batch of records for every --compression option
+COMPRESSIONS = {'none': ('', None, None), 'gzip': ('.gz', gzip.compress, gzip.decompress),
+                'xz': ('.xz', lzma.compress, lzma.decompress)}
+EXTENSIONS = {extension: decompress for extension, _, decompress in COMPRESSIONS.values()}
+# Shard of an index line that removes a page (e.g. a page that left the category tree, see revision_check.py)
+REMOVED = '-'
+
+
+class ShardWriter:
+    """
+    Writes the processed pages as JSON lines into rotating shards (corpus-00000.jsonl.gz, corpus-00001.jsonl.gz, ...)
+    instead of one file per page. Every batch of records is compressed on its own and appended as an independent
+    gzip member / xz stream, so a shard can be read line by line with gzip.open() or lzma.open() like a single
+    compressed file while a single page can be read by decompressing only its batch.
+    Every record gets a line in index.tsv: title, shard, offset and length of its batch in the shard, offset and length
+    of its line in the decompressed batch. A new session always starts a new shard so that a shard left incomplete by
+    an interrupted session is never appended to
+    """
+    def __init__(self, directory, max_mb=256, max_records=100000, compression='gzip'):
+        self.directory = directory
+        self.max_bytes = max_mb * 1024 * 1024
+        self.max_records = max_records
+        self.extension, self.compress, _ = COMPRESSIONS[compression]
+        self.lock = threading.Lock()
+        shard_numbers = [int(SHARD_NAME.match(name).group(1)) for name in os.listdir(directory)
+                         if SHARD_NAME.match(name)]
+        self.shard_number = max(shard_numbers, default=-1)
+        self.shard, self.shard_name, self.shard_bytes, self.shard_records = None, None, 0, 0
+        self.index = open(os.path.join(directory, INDEX_FILE), 'a', encoding='utf-8')
+
+    def open_shard(self):
+        if self.shard:
+            self.shard.close()
+        self.shard_number += 1
+        self.shard_name = f'corpus-{self.shard_number:05d}.jsonl{self.extension}'
+        self.shard = open(os.path.join(self.directory, self.shard_name), 'ab')
+        self.shard_bytes, self.shard_records = 0, 0
+
+    def write_batch(self, records):
+        """
+        Appends a batch of records to the current shard (and starts a new shard if the batch does not fit into the
+        current one) and adds them to the index
+        :param records: list of dicts with at least a 'page' key
+        :return: number of bytes written to the shard
+        """
+        lines = [(json.dumps(record, ensure_ascii=False) + '\n').encode('utf-8') for record in records]
+        data = b''.join(lines)
+        member = self.compress(data) if self.compress else data
+        with self.lock:
+            if self.shard is None or (self.shard_records and (self.shard_bytes + len(member) > self.max_bytes or
+                                                              self.shard_records + len(records) > self.max_records)):
+                self.open_shard()
+            offset = self.shard_bytes
+            self.shard.write(member)
+            self.shard.flush()
+            self.shard_bytes += len(member)
+            self.shard_records += len(records)
+            record_offset = 0
+            index_lines = []
+            for record, line in zip(records, lines):
+                index_lines.append(f"{clean_title(record['page'])}\t{self.shard_name}\t{offset}\t{len(member)}\t"
+                                   f"{record_offset}\t{len(line)}\n")
+                record_offset += len(line)
+            self.index.write(''.join(index_lines))
+            self.index.flush()
+        return len(member)
+
+    def close(self):
+        with self.lock:
+            if self.shard:
+                self.shard.close()
+            self.index.close()
+
+
+def clean_title(title):
+    return title.replace('\t', ' ').replace('\n', ' ')
+
+
+def load_index(directory):
+    """
+    :param directory: text_files folder with the shards
+    :return: dict of {title: (shard, batch offset, batch length, record offset, record length)}. A page written more
+    than once (updated) points to its last record
+    """
+    index = {}
+    path = os.path.join(directory, INDEX_FILE)
+    if os.path.exists(path):
+        with open(path, encoding='utf-8') as f:
+            for line in f:
+                title, shard, *offsets = line.rstrip('\n').split('\t')
+                if shard == REMOVED:
+                    index.pop(title, None)
+                else:
+                    index[title] = (shard, *map(int, offsets))
+    return index
+
+
+def read_record(directory, entry):
+    """
+    Reads a single page from the shards by decompressing only the batch it was written in
+    :param directory: text_files folder with the shards
+    :param entry: value of the index returned by load_index()
+    :return: dict of the page as written by write_out_shards()
+    """
+    shard, offset, length, record_offset, record_length = entry
+    with open(os.path.join(directory, shard), 'rb') as f:
+        f.seek(offset)
+        member = f.read(length)
+    decompress = EXTENSIONS[SHARD_NAME.match(shard).group(2) or '']
+    data = decompress(member) if decompress else member
+    return json.loads(data[record_offset:record_offset + record_length])
+
+
+def read_shards(directory):
+    """
+    Iterates over all the pages in the shards of a text_files folder
+    """
+    for name in sorted(os.listdir(directory)):
+        match = SHARD_NAME.match(name)
+        if match:
+            opener = {'.gz': gzip.open, '.xz': lzma.open}.get(match.group(2), open)
+            with opener(os.path.join(directory, name), 'rt', encoding='utf-8') as f:
+                for line in f:
+                    yield json.loads(line)
+
+
+if __name__ == '__main__':
+    # Print a single page: python shard_writer.py <output folder>/data/text_files "<page title>"
+    print(json.dumps(read_record(sys.argv[1], load_index(sys.argv[1])[sys.argv[2]]), ensure_ascii=False, indent=2))
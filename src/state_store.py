@@ -0,0 +1,130 @@
+import os
+import sqlite3
+import sys
+import threading
+
+# Table of every set of the crawl state and the text file it is exported to
+TABLES = {'cat_names': 'category_names.txt', 'cat_links': 'category_links.txt', 'done_links': 'done_links.txt',
+          'page_links': 'page_links.txt', 'page_names': 'page_names.txt'}
+STATE_FILE = 'crawl_state.sqlite'
+
+
+class StateSet:
+    """
+    Set of strings stored in a table of the StateStore. Supports the parts of the set interface used by the crawler
+    (update, add, in, len, iteration and "-") without holding the values in memory. Values added are written to the
+    database right away but only become durable when the store is committed
+    """
+    def __init__(self, store, table):
+        self.store = store
+        self.table = table
+        self.count = store.conn.execute(f'SELECT COUNT(*) FROM {table}').fetchone()[0]
+
+    def update(self, values):
+        changes = self.store.conn.total_changes
+        self.store.conn.executemany(f'INSERT OR IGNORE INTO {self.table} (value) VALUES (?)',
+                                    ((value,) for value in values))
+        self.count += self.store.conn.total_changes - changes
+
+    def add(self, value):
+        self.update([value])
+
+    def __contains__(self, value):
+        return self.store.conn.execute(f'SELECT 1 FROM {self.table} WHERE value = ?', (value,)).fetchone() is not None
+
+    def __len__(self):
+        return self.count
+
+    def __iter__(self):
+        for (value,) in self.store.conn.execute(f'SELECT value FROM {self.table} ORDER BY rowid'):
+            yield value
+
+    def __sub__(self, other):
+        if isinstance(other, StateSet) and other.store is self.store:
+            return {value for (value,) in self.store.conn.execute(
+                f'SELECT value FROM {self.table} EXCEPT SELECT value FROM {other.table}')}
+        return {value for value in self if value not in other}
+
+
+class StateStore:
+    """
+    Crawl state (category names and links, done links, page names and links) kept in a SQLite database in WAL mode.
+    A checkpoint (commit) only appends the values added since the previous checkpoint to the write ahead log instead of
+    rewriting every file. The log is merged back into the database (compacted) by a background thread every
+    `compact_interval` seconds. The state can be exported to the text files used by earlier versions at any time
+    """
+    def __init__(self, path, compact_interval=30.0):
+        self.path = path
+        self.conn = sqlite3.connect(path)
+        if path != ':memory:':
+            self.conn.execute('PRAGMA journal_mode=WAL')
+            self.conn.execute('PRAGMA synchronous=NORMAL')
+        for table in TABLES:
+            self.conn.execute(f'CREATE TABLE IF NOT EXISTS {table} (value TEXT NOT NULL UNIQUE)')
+        self.conn.commit()
+        self.sets = {table: StateSet(self, table) for table in TABLES}
+        self.stop_compaction = threading.Event()
+        self.compaction_thread = None
+        if path != ':memory:':
+            self.compaction_thread = threading.Thread(target=self.compact, args=(compact_interval,), daemon=True)
+            self.compaction_thread.start()
+
+    def import_txt(self, directory):
+        """
+        Loads the text files written by earlier versions into the tables that are still empty. The files are streamed
+        line by line into the database
+        :param directory: folder with category_names.txt etc.
+        :return: dict of {table: number of values imported}
+        """
+        imported = {}
+        for table, file_name in TABLES.items():
+            file_path = os.path.join(directory, file_name)
+            if len(self.sets[table]) == 0 and os.path.exists(file_path):
+                with open(file_path, encoding='utf-8') as f:
+                    self.sets[table].update(line.rstrip('\n') for line in f if line != '\n')
+                imported[table] = len(self.sets[table])
+        self.commit()
+        return imported
+
+    def export_txt(self, directory):
+        """
+        Writes every table to its text file (one value per line) in the same format as earlier versions
+        :param directory: folder where category_names.txt etc. are written
+        """
+        for table, file_name in TABLES.items():
+            file_path = os.path.join(directory, file_name)
+            with open(file_path + '.tmp', 'w', encoding='utf-8') as f:
+                separator = ''
+                for value in self.sets[table]:
+                    f.write(separator + value)
+                    separator = '\n'
+            os.replace(file_path + '.tmp', file_path)
+
+    def commit(self):
+        self.conn.commit()
+
+    def compact(self, interval):
+        conn = sqlite3.connect(self.path)
+        while not self.stop_compaction.wait(interval):
+            try:
+                conn.execute('PRAGMA wal_checkpoint(PASSIVE)')
+            except sqlite3.OperationalError as e:
+                print('Compaction of the crawl state failed:', e)
+        conn.close()
+
+    def close(self):
+        self.commit()
+        self.stop_compaction.set()
+        if self.compaction_thread:
+            self.compaction_thread.join()
+            self.conn.execute('PRAGMA wal_checkpoint(TRUNCATE)')
+        self.conn.close()
+
+
+if __name__ == '__main__':
+    # Export the crawl state of an output folder to the text files: python state_store.py <output folder>/data
+    directory = sys.argv[1]
+    store = StateStore(os.path.join(directory, STATE_FILE))
+    store.export_txt(directory)
+    store.close()
+    print({table: len(state_set) for table, state_set in store.sets.items()})
@@ -1,16 +1,25 @@
 import xml.sax
 import logging
-import requests
+import html
+import queue
+import http_client
 import time
+import threading
 import os
 import json
 import re
-from cleaner import clean_text
-import settings
+from wikitext_cleaner import clean_text
+from xml_archive import page_chunks
+from metrics import json_snapshot, write_json
+from pipeline import STOP_TOKENS, queue_size
 
 logger = logging.getLogger(__name__)
 re_mode = 0
 replacements = {'[[': '', ']]': '', '==': ''}
+REPLACEMENTS = re.compile('|'.join(re.escape(k) for k in replacements))
+CATEGORY = re.compile(r"\[Category:(.*?)\]")
+CHUNK_SIZE = 64 * 1024  # Bytes of XML fed to the SAX parser at a time
+CLEAN_BATCH_BYTES = 1024 * 1024  # Max bytes of wikitext in a batch of articles for the cleaning, whatever its size
 
 
 # cleaner.py from https://github.com/CyberZHG Git repo:
@@ -19,15 +28,22 @@ replacements = {'[[': '', ']]': '', '==': ''}
 
 # Implementation of the WikiReader class from https://jamesthorne.com/blog/processing-wikipedia-in-a-couple-of-hours/
 class WikiReader(xml.sax.ContentHandler):
+    """
+    SAX handler that calls callback((title, text, link, revision)) for every page whose namespace passes ns_filter.
+    revision is a dict with the revid, timestamp and sha1 of the exported revision. The text of an element arrives in
+    many characters() calls, so the chunks are collected in a list and joined once at the end of the element
+    """
     def __init__(self, ns_filter, callback, link):
         super().__init__()
 
         self.filter = ns_filter
         self.link = link
         self.read_stack = []
+        self.chunks = []
         self.read_text = ''
         self.read_title = ''
         self.read_namespace = ''
+        self.revision = {}
 
         self.status_count = 0
         self.callback = callback
@@ -39,62 +55,148 @@ class WikiReader(xml.sax.ContentHandler):
         elif tag_name == "page":
             self.read_text = None
             self.read_title = None
+            self.revision = {'revid': None, 'timestamp': None, 'sha1': None}
 
-        elif tag_name == "title":
-            self.read_title = ""
+        elif tag_name in ("title", "text", "id", "timestamp", "sha1"):
+            pass
 
-        elif tag_name == "text":
-            self.read_text = ""
-
-        else:
+        elif tag_name not in ("revision", "contributor"):
             return
 
+        self.chunks = []
         self.read_stack.append(tag_name)
 
     def endElement(self, tag_name):
         if len(self.read_stack) > 0:
             if tag_name == self.read_stack[-1]:
+                value = ''.join(self.chunks)
+                if tag_name == "text":
+                    self.read_text = value
+                elif tag_name == "title":
+                    self.read_title = value
+                elif tag_name == "ns":
+                    self.read_namespace = int(value)
+                elif tag_name in ("id", "timestamp", "sha1") and self.read_stack[-2:-1] == ["revision"]:
+                    self.revision['revid' if tag_name == "id" else tag_name] = int(value) if tag_name == "id" else value
                 del self.read_stack[-1]
+                self.chunks = []
 
         if self.filter(self.read_namespace):
             if tag_name == "page" and self.read_text is not None:
                 self.status_count += 1
-                self.callback((self.read_title, self.read_text, self.link))
+                self.callback((self.read_title, self.read_text, self.link, self.revision))
 
     def characters(self, content):
         if len(self.read_stack) == 0:
             return None
 
-        if self.read_stack[-1] == "text":
-            self.read_text += content
+        if self.read_stack[-1] in ("text", "title", "ns", "id", "timestamp", "sha1"):
+            self.chunks.append(content)
+
 
-        if self.read_stack[-1] == "title":
-            self.read_title += content
+def parse_chunks(chunks, reader):
+    """
+    Feeds the XML of a page to an incremental SAX parser chunk by chunk so that the raw XML is never held in memory as
+    a whole
+    :param chunks: iterable of bytes
+    :param reader: WikiReader
+    """
+    parser = xml.sax.make_parser()
+    parser.setContentHandler(reader)
+    for chunk in chunks:
+        parser.feed(chunk)
+    parser.close()
 
-        if self.read_stack[-1] == "ns":
-            self.read_namespace = int(content)
+
+def file_chunks(path, chunk_size=CHUNK_SIZE):
+    with open(path, 'rb') as f:
+        while True:
+            chunk = f.read(chunk_size)
+            if not chunk:
+                break
+            yield chunk
 
 
 def process_text(text):
-    rep = dict((re.escape(k), v) for k, v in replacements.items())
-    pattern = re.compile("|".join(rep.keys()))
-    result_cat = re.findall(r"\[Category:(.*?)\]", text)
-    text = pattern.sub(lambda m: rep[re.escape(m.group(0))], text)
+    result_cat = CATEGORY.findall(text)
+    text = REPLACEMENTS.sub(lambda m: replacements[m.group(0)], text)
     text = text.split('See also')[0]
 
     return text, result_cat
 
 
-def process_article(ctq, c1tq, arg_shutdown):
-    while not (arg_shutdown and ctq.empty()):
-        page_title, doc, link = ctq.get()
-        text = clean_text(doc)
-        text, categories = process_text(text)
-        if "REDIRECT ".upper() not in text:
+class ArticleBatcher:
+    """
+    Collects the articles parsed for the cleaning processes, which get them in lists of up to batch_size articles (or
+    CLEAN_BATCH_BYTES of wikitext) so that the queue and the pickling cost one message per batch instead of one per
+    article. A batch that is not full is sent anyway once it is batch_timeout seconds old
+    """
+    def __init__(self, ctq, batch_size, batch_timeout):
+        self.ctq = ctq
+        self.batch_size = batch_size
+        self.batch_timeout = batch_timeout
+        self.articles = []
+        self.size = 0
+        self.start = time.time()
+
+    def add(self, article):
+        """
+        :param article: (title, text, link, revision) as passed to the callback of a WikiReader. (page name, None, link,
+        None) for a page without an article (e.g. not in the main namespace) that is only to be acknowledged
+        """
+        if not self.articles:
+            self.start = time.time()
+        self.articles.append(article)
+        self.size += len(article[1] or '')
+        if len(self.articles) >= self.batch_size or self.size >= CLEAN_BATCH_BYTES:
+            self.flush()
+
+    def timeout(self):
+        """
+        :return: seconds left until the batch is sent anyway, None if there is no batch
+        """
+        return max(self.start + self.batch_timeout - time.time(), 0.01) if self.articles else None
+
+    def flush(self, due_only=False):
+        """
+        :param due_only: only send the batch if it is batch_timeout seconds old
+        """
+        if self.articles and (not due_only or time.time() - self.start >= self.batch_timeout):
+            self.ctq.put(self.articles)
+            self.articles = []
+            self.size = 0
+
+
+def process_article(ctq, c1tq, metrics):
+    while True:
+        articles = ctq.get()
+        if articles in STOP_TOKENS:
+            return
+        for page_title, doc, link, revision in articles:
+            if doc is None:
+                c1tq.put({'page': page_title, 'skipped': 'no article'})
+                continue
+            metrics.count('clean', 'in')
+            metrics.count('clean', 'bytes', len(doc))
             try:
-                c1tq.put({"page": page_title, "sentences": text, 'categories': categories})
+                with metrics.time('clean'):
+                    text = clean_text(doc)
+                    text, categories = process_text(text)
             except Exception as e:
-                print(f'Exception while processing article {page_title}; Exception: {e}')
+                # Counted as an error of the stage by metrics.time(). The rest of the batch is cleaned, the page stays
+                # in the work ledger
+                print(f'Cleaning of {page_title} failed. Exception: {e}')
+                continue
+            if "REDIRECT ".upper() not in text:
+                try:
+                    c1tq.put({"page": page_title, "sentences": text, 'categories': categories, **revision})
+                    metrics.count('clean', 'out')
+                except Exception as e:
+                    metrics.count('clean', 'errors')
+                    print(f'Exception while processing article {page_title}; Exception: {e}')
+            else:
+                # Redirects are left out on purpose. The writers acknowledge them in the work ledger
+                c1tq.put({'page': page_title, 'skipped': 'redirect'})
 
 
 def clean_name(name):
@@ -105,68 +207,364 @@ def clean_name(name):
     return name
 
 
-def display(epnq, xcq, ctq, c1tq, rxq, arg_shutdown):
-    while not arg_shutdown:
+def pipeline_gauges(epnq, xcq, ctq, c1tq, rxq, rate_limiter):
+    """
+    :return: dict of the current queue sizes (-1 where they are not known) and rate limiter state, exported as gauges
+    next to the Metrics
+    """
+    limiter_state = rate_limiter.snapshot()
+    return {'pages_queue_size': queue_size(epnq), 'xml_queue_size': queue_size(xcq),
+            'content_queue_size': queue_size(ctq), 'cleaned_queue_size': queue_size(c1tq),
+            'raw_xml_queue_size': queue_size(rxq),
+            'request_rate': limiter_state['rate'], 'backoff_seconds': limiter_state['blocked_for']}
+
+
+def display(epnq, xcq, ctq, c1tq, rxq, rate_limiter, metrics, snapshot_path, stop, snapshot_interval=10):
+    """
+    Prints the queue sizes and the number of pages through every stage once a second and writes a JSON snapshot of the
+    metrics (see metrics.json_snapshot()) to snapshot_path every snapshot_interval seconds and once more at the end
+    :param stop: threading.Event that ends the display
+    """
+    previous, last_snapshot = None, time.time()
+    while True:
+        gauges = pipeline_gauges(epnq, xcq, ctq, c1tq, rxq, rate_limiter)
+        stages = metrics.snapshot()
         print(
-            "Queue sizes: pages_queue={0} xml_queue={1} content_queue={2} cleaned_queue={3} raw_xml_queue={4} files "
-            "created={5}".format(
-                epnq.qsize(),
-                xcq.qsize(),
-                ctq.qsize(),
-                c1tq.qsize(),
-                rxq.qsize(),
-                settings.count_files
+            "Queue sizes: pages_queue={0} xml_queue={1} content_queue={2} cleaned_queue={3} raw_xml_queue={4} pages "
+            "fetched={5:.0f} parsed={6:.0f} cleaned={7:.0f} files created={8:.0f} request_rate={9:.1f}/s "
+            "backoff={10:.0f}s 429s={11:.0f}/{12:.0f}".format(
+                gauges['pages_queue_size'],
+                gauges['xml_queue_size'],
+                gauges['content_queue_size'],
+                gauges['cleaned_queue_size'],
+                gauges['raw_xml_queue_size'],
+                stages['fetch']['out'],
+                stages['parse']['out'],
+                stages['clean']['out'],
+                stages['write']['out'],
+                gauges['request_rate'],
+                gauges['backoff_seconds'],
+                stages['http']['responses_429'],
+                stages['http']['out']
             ))
-        time.sleep(1)
+        stopped = stop.is_set()
+        if snapshot_path and (stopped or time.time() - last_snapshot >= snapshot_interval):
+            previous = json_snapshot(metrics, gauges, previous)
+            write_json(snapshot_path, previous)
+            last_snapshot = time.time()
+        if stopped:
+            return
+        stop.wait(1)
 
 
-def get_content(epnq, xcq, rxq, arg_shutdown):
-    while not (arg_shutdown and epnq.empty()):
-        if not epnq.empty():
-            page_name, page_url = epnq.get()
-            root_url = 'https://en.wikipedia.org/wiki/Special:Export/'
-            link = root_url + page_name
-            try:
-                response = requests.get(link)
-                if response.status_code == 200:
-                    xcq.put((page_name, page_url, response.content))
-                    rxq.put((page_name, response.content))
-                elif response.status_code == 429:
-                    print('Wikipedia overloaded with our request for pages. Pausing requests...')
-                    epnq.put((page_name, page_url))
-                    time.sleep(30)
+def get_content(epnq, rxq, dedup, rate_limiter, metrics):
+    http_client.set_rate_limiter(rate_limiter)
+    http_client.set_metrics(metrics)
+    while True:
+        page = epnq.get()
+        if page in STOP_TOKENS:
+            return
+        page_name, page_url = page
+        if dedup.is_processed(page_name):
+            continue
+        metrics.count('fetch', 'in')
+        fetch_single_page(page_name, page_url, epnq, rxq, metrics)
+
+
+def fetch_single_page(page_name, page_url, epnq, rxq, metrics):
+    root_url = 'https://en.wikipedia.org/wiki/Special:Export/'
+    link = root_url + page_name
+    start = time.perf_counter()
+    try:
+        response = http_client.get(link)
+        if response.status_code == 200:
+            rxq.put((page_name, page_url, response.content))
+            metrics.count('fetch', 'out')
+            metrics.count('fetch', 'bytes', len(response.content))
+        elif response.status_code == 429:
+            metrics.count('fetch', 'responses_429')
+            print('Wikipedia overloaded with our request for pages. Pausing requests...')
+            epnq.put((page_name, page_url))
+        else:
+            metrics.count('fetch', 'errors')
+            print(f'{link} not available')
+            print(response.status_code)
+    except Exception as e:
+        metrics.count('fetch', 'errors')
+        print(f'Requests.get failed for {link}. Exception: {e}')
+        epnq.put((page_name, page_url))
+    metrics.observe('fetch', time.perf_counter() - start)
+
+
+def normalize_title(title):
+    """
+    Special:Export returns canonical titles i.e. spaces instead of underscores and an upper case first letter. This
+    brings the page names from the category pages into the same form so that they can be matched against the export
+    :param title: page name as extracted from the category page
+    :return: normalized title
+    """
+    title = title.replace('_', ' ').strip()
+    return title[:1].upper() + title[1:]
+
+
+def split_export_pages(content):
+    """
+    Splits a multi page Special:Export response into one XML document per page. Each document keeps the <mediawiki>
+    header (including siteinfo) of the original response so that it can be parsed by WikiReader exactly like a single
+    page export
+    :param content: bytes of the Special:Export response
+    :return: dict of {normalized title: XML bytes of the single page document}
+    """
+    pages = {}
+    first_page = content.find(b'<page>')
+    if first_page == -1:
+        return pages
+    header = content[:first_page]
+    footer = b'</mediawiki>\n'
+    begin = first_page
+    while begin != -1:
+        end = content.find(b'</page>', begin)
+        if end == -1:
+            break
+        end += len(b'</page>')
+        page = content[begin:end]
+        title_match = re.search(rb'<title>(.*?)</title>', page, flags=re.DOTALL)
+        if title_match:
+            title = html.unescape(title_match.group(1).decode('utf-8'))
+            pages[normalize_title(title)] = header + page + b'\n' + footer
+        begin = content.find(b'<page>', end)
+    return pages
+
+
+def fetch_batch(batch, epnq, rxq, metrics):
+    """
+    Downloads all the pages in the batch through one Special:Export request. Pages that are missing from the response
+    are retried one at a time through fetch_single_page()
+    :param batch: list of (page_name, page_url)
+    :param epnq: Queue of page names and urls. Pages are put back here if Wikipedia is overloaded
+    :param rxq: Queue for the raw xml of each page to be written to disk (and then parsed)
+    :param metrics: Metrics. The latency of the 'fetch' stage is observed per batch
+    :return: None
+    """
+    export_url = 'https://en.wikipedia.org/w/index.php'
+    data = {'title': 'Special:Export', 'pages': '\n'.join([page_name for page_name, _ in batch]), 'curonly': '1',
+            'action': 'submit'}
+    start = time.perf_counter()
+    try:
+        response = http_client.post(export_url, data=data)
+    except Exception as e:
+        metrics.count('fetch', 'errors')
+        metrics.observe('fetch', time.perf_counter() - start)
+        print(f'Batch export failed for {len(batch)} pages. Exception: {e}')
+        for page in batch:
+            epnq.put(page)
+        return
+    metrics.observe('fetch', time.perf_counter() - start)
+    if response.status_code == 429:
+        metrics.count('fetch', 'responses_429')
+        print('Wikipedia overloaded with our request for pages. Pausing requests...')
+        for page in batch:
+            epnq.put(page)
+        return
+    pages = split_export_pages(response.content) if response.status_code == 200 else {}
+    for page_name, page_url in batch:
+        content = pages.get(normalize_title(page_name))
+        if content:
+            rxq.put((page_name, page_url, content))
+            metrics.count('fetch', 'out')
+            metrics.count('fetch', 'bytes', len(content))
+        else:
+            fetch_single_page(page_name, page_url, epnq, rxq, metrics)
+
+
+def get_content_batched(epnq, rxq, batch_size, batch_timeout, dedup, rate_limiter, metrics):
+    """
+    Same as get_content() but collects up to batch_size page names from epnq and downloads them with a single
+    Special:Export request. A batch that is not full is sent anyway once batch_timeout seconds have passed since its
+    first page was picked up
+    """
+    http_client.set_rate_limiter(rate_limiter)
+    http_client.set_metrics(metrics)
+    batch = []
+    batch_start = time.time()
+    while True:
+        try:
+            page = epnq.get(timeout=max(batch_start + batch_timeout - time.time(), 0.01)) if batch else epnq.get()
+        except queue.Empty:
+            page = None
+        if page in STOP_TOKENS:
+            if batch:
+                fetch_batch(batch, epnq, rxq, metrics)
+            return
+        if page and not dedup.is_processed(page[0]):
+            if not batch:
+                batch_start = time.time()
+            batch.append(page)
+            metrics.count('fetch', 'in')
+        if batch and (len(batch) >= batch_size or time.time() - batch_start >= batch_timeout):
+            fetch_batch(batch, epnq, rxq, metrics)
+            batch = []
+
+
+def extract_content(xcq, ctq, clean_batch, clean_batch_timeout, metrics):
+    """
+    Parses the XML of the pages and passes the articles on to the cleaning processes in batches
+    :param clean_batch: max number of articles per batch
+    :param clean_batch_timeout: max number of seconds an article waits for its batch to fill up
+    """
+    batcher = ArticleBatcher(ctq, clean_batch, clean_batch_timeout)
+    while True:
+        try:
+            page = xcq.get(timeout=batcher.timeout())
+        except queue.Empty:
+            batcher.flush()
+            continue
+        if page in STOP_TOKENS:
+            batcher.flush()
+            return
+        page_name, page_url, xml_handle = page
+        metrics.count('parse', 'in')
+        # The articles are passed on once the whole XML is parsed, so that a broken file passes on nothing
+        articles = []
+        reader = WikiReader(lambda ns: ns == 0, articles.append, page_url)
+        try:
+            with metrics.time('parse'):
+                if isinstance(xml_handle, tuple):
+                    chunks = page_chunks(xml_handle, CHUNK_SIZE)
+                    metrics.count('parse', 'bytes', xml_handle[-1])
                 else:
-                    print(f'{link} not available')
-                    print(response.status_code)
-            except Exception as e:
-                print(f'Requests.get failed for {link}. Exception: {e}')
-                epnq.put((page_name, page_url))
-
-
-def extract_content(xcq, ctq, arg_shutdown):
-    while not (arg_shutdown and xcq.empty()):
-        if not xcq.empty():
-            page_name, page_url, content = xcq.get()
-            sample_reader = WikiReader(lambda ns: ns == 0, ctq.put, page_url)
-            xml.sax.parseString(content, sample_reader)
-
-
-def write_xml_data(rxq, data_path, arg_shutdown):
-    while not (arg_shutdown and rxq.empty()):
-        name, content = rxq.get()
-        name = clean_name(name)
-        if not os.path.exists(os.path.join(data_path, name + '.xml')):
-            with open(os.path.join(data_path, name + '.xml'), 'wb') as f:
+                    chunks = file_chunks(xml_handle)
+                    metrics.count('parse', 'bytes', os.path.getsize(xml_handle))
+                parse_chunks(chunks, reader)
+        except Exception as e:
+            # Counted as an error of the stage by metrics.time(). The page stays in the work ledger
+            print(f'Parsing of {page_name} failed ({xml_handle}). Exception: {e}')
+            continue
+        for article in articles:
+            batcher.add(article)
+        if not articles:
+            # E.g. a page outside the main namespace or a page that does not exist anymore
+            batcher.add((page_name, None, page_url, None))
+        metrics.count('parse', 'out', reader.status_count)
+        batcher.flush(due_only=True)
+
+
+def write_xml_data(rxq, xcq, data_path, ledger, metrics):
+    """
+    Tee between the download and the parsing of the pages: the raw XML of every page is written to disk once and only
+    the path of the file is passed on to extract_content() which parses the page from the file. The file is written
+    under a temporary name and renamed so that the parser never sees a partially written file
+    :param rxq: Queue of (page name, page url, raw xml) from get_content()
+    :param xcq: Queue of (page name, page url, path of the xml file) for extract_content()
+    :param data_path: xml_files folder
+    :param ledger: WorkLedger in which the pages move on to the parsing once their file is written
+    """
+    while True:
+        page = rxq.get()
+        if page in STOP_TOKENS:
+            return
+        name, page_url, content = page
+        metrics.count('write_xml', 'in')
+        xml_path = os.path.join(data_path, clean_name(name) + '.xml')
+        temp_path = f'{xml_path}.{threading.get_ident()}.tmp'
+        with metrics.time('write_xml'):
+            with open(temp_path, 'wb') as f:
                 f.write(content)
+            os.replace(temp_path, xml_path)
+        ledger.advance(name, xml_path)
+        xcq.put((name, page_url, xml_path))
+        metrics.count('write_xml', 'out')
+        metrics.count('write_xml', 'bytes', len(content))
+
+
+def write_xml_archive(rxq, xcq, archive, ledger, block_pages, block_timeout, metrics):
+    """
+    Same as write_xml_data() but the pages are collected into blocks of up to block_pages pages (or whatever arrived
+    within block_timeout seconds) which are compressed and appended to the XmlArchive. The archive handle of every
+    page is passed on to extract_content() once its block is on disk
+    :param archive: XmlArchive of the xml_files folder
+    """
+    block = []
+    block_start = time.time()
+    while True:
+        try:
+            page = rxq.get(timeout=max(block_start + block_timeout - time.time(), 0.01)) if block else rxq.get()
+        except queue.Empty:
+            page = None
+        stop = page in STOP_TOKENS
+        if page and not stop:
+            if not block:
+                block_start = time.time()
+            block.append(page)
+            metrics.count('write_xml', 'in')
+        if block and (stop or len(block) >= block_pages or time.time() - block_start >= block_timeout):
+            with metrics.time('write_xml'):
+                handles = archive.append_block([(name, content) for name, _, content in block])
+            for (name, page_url, content), handle in zip(block, handles):
+                ledger.advance(name, handle)
+                xcq.put((name, page_url, handle))
+                metrics.count('write_xml', 'out')
+                metrics.count('write_xml', 'bytes', len(content))
+            block = []
+        if stop:
+            return
 
 
-def write_out(c1tq, data_path, arg_shutdown):
-    while not (arg_shutdown and c1tq.empty()):
+def write_out(c1tq, data_path, dedup, ledger, metrics):
+    while True:
         details = c1tq.get()
+        if details in STOP_TOKENS:
+            return
+        if details.get('skipped'):
+            ledger.ack([details['page']])
+            continue
+        metrics.count('write', 'in')
         outfile_name = details['page']
         name = clean_name(outfile_name)
         line = json.dumps(details, ensure_ascii=False)
-        if not os.path.exists(os.path.join(data_path, name + '.json')):
-            with open(os.path.join(data_path, name + '.json'), "w", encoding='utf-8') as f:
-                f.write(line + '\n')
-                settings.count_files += 1
+        if not dedup.is_processed(outfile_name):
+            with metrics.time('write'):
+                with open(os.path.join(data_path, name + '.json'), "w", encoding='utf-8') as f:
+                    f.write(line + '\n')
+            dedup.add_processed(outfile_name, details.get('revid'), details.get('timestamp'))
+            metrics.count('write', 'out')
+            metrics.count('write', 'bytes', len(line) + 1)
+        ledger.ack([outfile_name])
+
+
+def write_out_shards(c1tq, shard_writer, dedup, ledger, batch_size, batch_timeout, metrics):
+    """
+    Same as write_out() but the pages are collected into batches of up to batch_size records (or whatever arrived
+    within batch_timeout seconds) which are appended to the JSONL shards of shard_writer with a single write
+    :param shard_writer: ShardWriter of the text_files folder
+    """
+    batch = []
+    batch_start = time.time()
+    while True:
+        try:
+            details = c1tq.get(timeout=max(batch_start + batch_timeout - time.time(), 0.01)) if batch else c1tq.get()
+        except queue.Empty:
+            details = None
+        stop = details in STOP_TOKENS
+        if details and not stop and details.get('skipped'):
+            ledger.ack([details['page']])
+            details = None
+        if details and not stop:
+            metrics.count('write', 'in')
+        if details and not stop and dedup.is_processed(details['page']):
+            ledger.ack([details['page']])
+        elif details and not stop:
+            if not batch:
+                batch_start = time.time()
+            batch.append(details)
+        if batch and (stop or len(batch) >= batch_size or time.time() - batch_start >= batch_timeout):
+            with metrics.time('write'):
+                written = shard_writer.write_batch(batch)
+            metrics.count('write', 'bytes', written)
+            for details in batch:
+                dedup.add_processed(details['page'], details.get('revid'), details.get('timestamp'))
+            ledger.ack([details['page'] for details in batch])
+            metrics.count('write', 'out', len(batch))
+            batch = []
+        if stop:
+            return
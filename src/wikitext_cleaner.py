@@ -0,0 +1,245 @@
+# Linear time version of cleaner.py. The output of clean_text() and build_links() is identical to cleaner.py (which is
+# kept as the reference implementation) but:
+# 1. Nested [[...]] and {{...}} are matched by jumping from bracket to bracket with a compiled regex instead of looping
+#    over every character in python
+# 2. The output is collected in a list and joined once instead of growing a string with +=, which is quadratic on large
+#    articles such as lists and timelines
+# 3. All regular expressions are compiled once at import
+import re
+
+SQUARE_BRACKETS = re.compile(r'[\[\]]')
+CURLY_BRACKETS = re.compile(r'[{}]')
+
+FILE_LINE = re.compile(r'^File:.*$', flags=re.MULTILINE)
+EXTERNAL_LINK = re.compile(r'\[h[^ ]+ (.*?)\]')
+SELF_CLOSING_REF = re.compile(r'<ref[^/]*?/>', flags=re.IGNORECASE | re.DOTALL)
+REF = re.compile(r'<ref.*?</ref>', flags=re.IGNORECASE | re.DOTALL)
+BOLD = re.compile(r"'''(.*?)'''", flags=re.DOTALL)
+ITALIC = re.compile(r"''(.*?)''", flags=re.DOTALL)
+COMMENT = re.compile(r'<!--.*?-->', flags=re.DOTALL)
+LANG = re.compile(r'{{lang(-|\|).*?\|(.*?)}}', flags=re.IGNORECASE | re.DOTALL)
+TITLE = re.compile(r'(={2,6})\s*(.*?)\s*\1')
+ZH_CHOICE = re.compile(r'-{.{,100}?zh(-hans|-cn|-hk|):(.{,100}?)(;.{,100}?}-|}-)', flags=re.DOTALL)
+CHOICE = re.compile(r'-{.{,100}?:(.{,100}?)(;.{,100}?}-|}-)', flags=re.DOTALL)
+PLAIN_CHOICE = re.compile(r'-{(.{,100}?)}-', flags=re.DOTALL)
+HTML = re.compile(r'<(.*?)>', flags=re.DOTALL)
+LIST = re.compile(r'^\s*[\*#]\s*', flags=re.MULTILINE)
+INDENT = re.compile(r'^\s*[:;]\s*', flags=re.MULTILINE)
+STYLE = re.compile(r':?{\| (style|class)=.*?\|}', flags=re.IGNORECASE | re.DOTALL)
+NEWLINES = re.compile(r'\n{2,}')
+
+QUOTES_AND_SPACES = {'"', "'", ' '}
+
+
+def _find_closing(text, start, brackets, opening):
+    """
+    Finds the end of a [[...]] or {{...}} block whose two opening brackets end at `start`
+    :param text: text to be searched
+    :param start: position right after the two opening brackets
+    :param brackets: compiled regex matching the opening and the closing bracket
+    :param opening: the opening bracket character
+    :return: position right after the closing bracket that brings the depth back to 0, None if the block is not closed
+    """
+    depth = 2
+    for match in brackets.finditer(text, start):
+        if match.group() == opening:
+            depth += 1
+        else:
+            depth -= 1
+            if depth == 0:
+                return match.end()
+    return None
+
+
+def _remove_resource_links(text, resource):
+    """Remove links likes `[[*:*]]`"""
+    pattern = '[[' + resource + ':'
+    pattern_begin = text.find(pattern)
+    if pattern_begin == -1:
+        return text
+    begin, removed = 0, []
+    closing = {}
+    while begin < len(text):
+        if pattern_begin > begin:
+            removed.append(text[begin:pattern_begin])
+        if pattern_begin not in closing:
+            closing[pattern_begin] = _find_closing(text, pattern_begin + 2, SQUARE_BRACKETS, '[')
+        pattern_end = closing[pattern_begin]
+        if pattern_end is not None:
+            begin = pattern_end
+        else:
+            removed.append(text[begin])
+            begin += 1
+        pattern_begin = text.find(pattern, begin)
+        if pattern_begin == -1:
+            break
+    if len(text) > begin:
+        removed.append(text[begin:])
+    return ''.join(removed)
+
+
+def _remove_file_links(text):
+    """Remove links like `[[File:*]]`"""
+    text = _remove_resource_links(text, 'File')
+    return FILE_LINE.sub('', text)
+
+
+def _remove_image_links(text):
+    """Remove links like `[[File:*]]`"""
+    return _remove_resource_links(text, 'Image')
+
+
+def _remove_external_links(text):
+    """Remove links like [*]"""
+    return EXTERNAL_LINK.sub(r'\1', text)
+
+
+def _remove_refs(text):
+    """Remove patterns like <ref*>*</ref>"""
+    text = SELF_CLOSING_REF.sub('', text)
+    return REF.sub('', text)
+
+
+def _remove_emphasises(text):
+    """Remove patterns like '''*'''"""
+    text = BOLD.sub(r'\1', text)
+    return ITALIC.sub(r'\1', text)
+
+
+def _remove_comments(text):
+    """Remove patterns like <!--*-->"""
+    return COMMENT.sub('', text)
+
+
+def _remove_langs(text):
+    """Remove pattenrs like {{lang-*|*}}}"""
+    return LANG.sub(r'\2', text)
+
+
+def _remove_titles(text):
+    """Remove patterns like ==*=="""
+    return TITLE.sub(r'\2', text)
+
+
+def _remove_choices(text):
+    """Remove patterns like -{zh-hans:*; zh-hant:*}-"""
+    text = ZH_CHOICE.sub(r'\2', text)
+    text = CHOICE.sub(r'\1', text)
+    return PLAIN_CHOICE.sub(r'\1', text)
+
+
+def _remove_templates(text):
+    """Remove patterns like {{*}}"""
+    begin, removed = 0, []
+    while begin < len(text):
+        pattern_begin = text.find('{{', begin)
+        if pattern_begin == -1:
+            removed.append(text[begin:])
+            break
+        if pattern_begin > begin:
+            removed.append(text[begin:pattern_begin])
+        pattern_end = _find_closing(text, pattern_begin + 2, CURLY_BRACKETS, '{')
+        if pattern_end is None:
+            break
+        parts = text[pattern_begin + 2:pattern_end - 2].split('|')
+        template_type = parts[0].split(' ')[0].lower()
+        if len(parts) == 1:
+            if all(ch in QUOTES_AND_SPACES for ch in parts[0]):
+                removed.append(parts[0].replace(' ', ''))
+        elif len(parts) in [2, 3]:
+            if template_type in {'le'} or template_type.startswith('link-'):
+                removed.append(parts[1])
+        begin = pattern_end
+    return ''.join(removed)
+
+
+def _remove_htmls(text):
+    return HTML.sub('', text)
+
+
+def _remove_lists(text):
+    return LIST.sub('', text)
+
+
+def _remove_indents(text):
+    return INDENT.sub('', text)
+
+
+def _remove_styles(text):
+    return STYLE.sub('', text)
+
+
+def _remove_spaces(text):
+    return text.replace('\u200b', '')
+
+
+def _remove_continuous_newlines(text):
+    return NEWLINES.sub('\n', text)
+
+
+def build_links(text):
+    begin, removed, links = 0, [], []
+    removed_length = 0
+    while begin < len(text):
+        pattern_begin = text.find('[[', begin)
+        if pattern_begin == -1:
+            removed.append(text[begin:])
+            break
+        if pattern_begin > begin:
+            removed.append(text[begin:pattern_begin])
+            removed_length += pattern_begin - begin
+        pattern_end = _find_closing(text, pattern_begin + 2, SQUARE_BRACKETS, '[')
+        if pattern_end is None:
+            break
+        link = text[pattern_begin + 2:pattern_end - 2]
+        parts = link.split('|')
+        if len(parts) == 1:
+            if ':' in link:
+                pure = link.split(':')[-1]
+                links.append({
+                    'begin': removed_length,
+                    'end': removed_length + len(pure),
+                    'link': link,
+                    'text': pure
+                })
+                removed.append(pure)
+                removed_length += len(pure)
+            else:
+                links.append({
+                    'begin': removed_length,
+                    'end': removed_length + len(text),
+                    'link': link,
+                    'text': link
+                })
+                removed.append(link)
+                removed_length += len(link)
+        elif len(parts) == 2:
+            links.append({
+                'begin': removed_length,
+                'end': removed_length + len(parts[1]),
+                'link': parts[0],
+                'text': parts[1]
+            })
+            removed.append(parts[1])
+            removed_length += len(parts[1])
+        begin = pattern_end
+    return ''.join(removed).strip(), links
+
+
+def clean_text(text):
+    text = _remove_file_links(text)
+    text = _remove_image_links(text)
+    text = _remove_external_links(text)
+    text = _remove_refs(text)
+    text = _remove_emphasises(text)
+    text = _remove_comments(text)
+    text = _remove_langs(text)
+    text = _remove_choices(text)
+    text = _remove_templates(text)
+    text = _remove_htmls(text)
+    text = _remove_lists(text)
+    text = _remove_indents(text)
+    text = _remove_styles(text)
+    text = _remove_spaces(text)
+    text = _remove_continuous_newlines(text)
+    return text.strip()
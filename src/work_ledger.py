@@ -0,0 +1,143 @@
+import json
+import os
+import sqlite3
+import sys
+import threading
+import time
+from dedup_index import page_key
+
+LEDGER_FILE = 'work_ledger.sqlite'
+MAX_ATTEMPTS = 3  # Sessions a page is handed to before it is given up (e.g. a page that is not an article)
+
+
+class WorkLedger:
+    """
+    Durable record of the pages between the crawler and the text files, so that the pages in the queues of the
+    pipeline are not lost when a session crashes. A page is entered when the crawler queues it for download (stage
+    'fetch'), moves on to stage 'parse' with the location of its XML once the XML is on disk and is acknowledged
+    (deleted) once its text file is written. Parsing and cleaning are not recorded: they are redone from the XML.
+    Every page is leased to the session that queued it. Pages leased by an earlier session that did not acknowledge
+    them are taken over by the next session (resume()) and put back into the pipeline at their stage, a page is given up
+    after MAX_ATTEMPTS sessions.
+    The ledger lives in the main process where the crawler and the writer threads run. Changes are committed by a
+    background thread every commit_interval seconds and by commit(), which must be called before the crawl state is
+    committed so that a category is never recorded as done before the pages found in it are in the ledger
+    """
+    def __init__(self, path, commit_interval=1.0):
+        self.path = path
+        self.lock = threading.Lock()
+        # Used by the threads of the crawler pool and the writer threads, every access holds self.lock
+        self.conn = sqlite3.connect(path, check_same_thread=False)
+        self.conn.execute('PRAGMA journal_mode=WAL')
+        self.conn.execute('PRAGMA synchronous=NORMAL')
+        self.conn.execute('CREATE TABLE IF NOT EXISTS pages (key TEXT PRIMARY KEY, name TEXT NOT NULL, url TEXT NOT '
+                          'NULL, stage TEXT NOT NULL, location TEXT, session INTEGER NOT NULL, attempts INTEGER NOT '
+                          'NULL DEFAULT 1)')
+        self.conn.commit()
+        self.session = int(time.time() * 1000)
+        self.changes = 0
+        self.stop_commits = threading.Event()
+        self.commit_thread = threading.Thread(target=self.commit_periodically, args=(commit_interval,), daemon=True)
+        self.commit_thread.start()
+
+    def enqueue(self, name, url):
+        """
+        Records a page queued for download by this session
+        """
+        with self.lock:
+            self.conn.execute('INSERT OR REPLACE INTO pages (key, name, url, stage, location, session) VALUES '
+                              '(?, ?, ?, ?, NULL, ?)', (page_key(name), name, url, 'fetch', self.session))
+            self.changes += 1
+
+    def advance(self, name, location):
+        """
+        Records that the XML of a page is on disk
+        :param location: what the parser is given to read the XML (path of the xml file or XmlArchive handle)
+        """
+        with self.lock:
+            self.conn.execute("UPDATE pages SET stage = 'parse', location = ? WHERE key = ?",
+                              (json.dumps(location), page_key(name)))
+            self.changes += 1
+
+    def ack(self, names):
+        """
+        Removes pages whose text file is written
+        :param names: page names
+        """
+        with self.lock:
+            self.conn.executemany('DELETE FROM pages WHERE key = ?', ((page_key(name),) for name in names))
+            self.changes += 1
+
+    def resume(self, dedup):
+        """
+        Takes over the pages of the earlier sessions that were not acknowledged. Pages processed in the meantime are
+        removed, pages whose XML is gone are downloaded again and pages given to MAX_ATTEMPTS sessions are given up
+        :param dedup: DedupIndex of the output
+        :return: list of (page name, page url) to be downloaded, list of (page name, page url, location of the xml) to
+        be parsed
+        """
+        to_fetch, to_parse, done, given_up = [], [], [], []
+        with self.lock:
+            rows = self.conn.execute('SELECT key, name, url, stage, location, attempts FROM pages WHERE session != ?',
+                                     (self.session,)).fetchall()
+            for key, name, url, stage, location, attempts in rows:
+                if dedup.is_processed(name):
+                    done.append(key)
+                elif attempts >= MAX_ATTEMPTS:
+                    given_up.append(key)
+                elif stage == 'parse' and os.path.exists(self.xml_path(json.loads(location))):
+                    to_parse.append((name, url, self.xml_handle(json.loads(location))))
+                else:
+                    to_fetch.append((name, url))
+            self.conn.executemany('DELETE FROM pages WHERE key = ?', ((key,) for key in done + given_up))
+            self.conn.execute('UPDATE pages SET session = ?, attempts = attempts + 1 WHERE session != ?',
+                              (self.session, self.session))
+            self.conn.executemany("UPDATE pages SET stage = 'fetch', location = NULL WHERE key = ?",
+                                  ((page_key(name),) for name, _ in to_fetch))
+            self.conn.commit()
+        if rows:
+            print(f'Work ledger: {len(to_fetch)} pages to download and {len(to_parse)} pages to parse resumed from an '
+                  f'earlier session, {len(done)} already processed, {len(given_up)} given up after {MAX_ATTEMPTS} '
+                  f'sessions')
+        return to_fetch, to_parse
+
+    @staticmethod
+    def xml_path(location):
+        return location[0] if isinstance(location, list) else location
+
+    @staticmethod
+    def xml_handle(location):
+        # JSON turns the XmlArchive handle tuples into lists
+        return tuple(location) if isinstance(location, list) else location
+
+    def commit(self):
+        with self.lock:
+            if self.changes:
+                self.conn.commit()
+                self.changes = 0
+
+    def commit_periodically(self, interval):
+        while not self.stop_commits.wait(interval):
+            try:
+                self.commit()
+            except sqlite3.Error as e:
+                print('Commit of the work ledger failed:', e)
+
+    def __len__(self):
+        with self.lock:
+            return self.conn.execute('SELECT COUNT(*) FROM pages').fetchone()[0]
+
+    def close(self):
+        self.stop_commits.set()
+        self.commit_thread.join()
+        self.commit()
+        with self.lock:
+            self.conn.execute('PRAGMA wal_checkpoint(TRUNCATE)')
+            self.conn.close()
+
+
+if __name__ == '__main__':
+    # Pages left in the ledger of an output by stage: python work_ledger.py <output folder>/data
+    conn = sqlite3.connect(os.path.join(sys.argv[1], LEDGER_FILE))
+    for stage, count in conn.execute('SELECT stage, COUNT(*) FROM pages GROUP BY stage'):
+        print(f'{stage}: {count} pages')
@@ -0,0 +1,175 @@
+import argparse
+import bz2
+import html
+import os
+import re
+import threading
+from shard_writer import clean_title, REMOVED
+
+INDEX_FILE = 'archive.index.tsv'
+ARCHIVE_NAME = re.compile(r'^pages-(\d{5})\.xml\.bz2$')
+TITLE = re.compile(rb'<title>(.*?)</title>', flags=re.DOTALL)
+
+
+class XmlArchive:
+    """
+    Packed archive of the raw Special:Export XML of the pages, laid out like the multistream dumps of Wikipedia: the
+    pages are collected into blocks and every block is compressed as an independent bz2 stream appended to
+    pages-NNNNN.xml.bz2 (so the whole archive can still be decompressed with bz2.open()). Every page gets a line in
+    archive.index.tsv: title, archive, offset and length of its block in the archive, offset and length of its XML in
+    the decompressed block. A page is read back with one seek and the decompression of its block only.
+    Blocks are compressed by the calling threads and appended under a lock, so several writer threads can append to
+    the same archive. A new session always starts a new archive file
+    """
+    def __init__(self, directory):
+        self.directory = directory
+        self.lock = threading.Lock()
+        archive_numbers = [int(ARCHIVE_NAME.match(name).group(1)) for name in os.listdir(directory)
+                           if ARCHIVE_NAME.match(name)]
+        self.archive_name = f'pages-{max(archive_numbers, default=-1) + 1:05d}.xml.bz2'
+        self.archive_path = os.path.join(directory, self.archive_name)
+        self.archive = None
+        self.index = open(os.path.join(directory, INDEX_FILE), 'a', encoding='utf-8')
+
+    def append_block(self, pages):
+        """
+        Compresses a block of pages and appends it to the archive
+        :param pages: list of (title, raw xml of the page)
+        :return: list of handles (archive path, block offset, block length, page offset, page length), one per page,
+        for read_page()
+        """
+        block = bz2.compress(b''.join(content for _, content in pages))
+        with self.lock:
+            if self.archive is None:
+                self.archive = open(self.archive_path, 'ab')
+            offset = self.archive.tell()
+            self.archive.write(block)
+            self.archive.flush()
+            handles, index_lines = [], []
+            page_offset = 0
+            for title, content in pages:
+                handles.append((self.archive_path, offset, len(block), page_offset, len(content)))
+                index_lines.append(f'{clean_title(title)}\t{self.archive_name}\t{offset}\t{len(block)}\t{page_offset}\t'
+                                   f'{len(content)}\n')
+                page_offset += len(content)
+            self.index.write(''.join(index_lines))
+            self.index.flush()
+        return handles
+
+    def close(self):
+        with self.lock:
+            if self.archive:
+                self.archive.close()
+            self.index.close()
+
+
+def read_page(handle):
+    """
+    :param handle: handle returned by XmlArchive.append_block() or an entry of load_index()
+    :return: raw XML of the page
+    """
+    archive_path, offset, length, page_offset, page_length = handle
+    with open(archive_path, 'rb') as f:
+        f.seek(offset)
+        block = bz2.decompress(f.read(length))
+    return block[page_offset:page_offset + page_length]
+
+
+def page_chunks(handle, chunk_size):
+    """
+    Same as read_page() but the block is decompressed incrementally and the XML of the page is returned in chunks of at
+    most chunk_size bytes, so that neither the block nor the page has to be held in memory as a whole
+    :param handle: handle returned by XmlArchive.append_block() or an entry of load_index()
+    :param chunk_size: max number of bytes per chunk
+    :return: generator of bytes
+    """
+    archive_path, offset, length, page_offset, page_length = handle
+    decompressor = bz2.BZ2Decompressor()
+    position, end = 0, page_offset + page_length
+    with open(archive_path, 'rb') as f:
+        f.seek(offset)
+        remaining = length
+        while position < end:
+            if decompressor.needs_input:
+                data = f.read(min(chunk_size, remaining)) if remaining else b''
+                remaining -= len(data)
+                if not data:
+                    break
+            else:
+                data = b''
+            chunk = decompressor.decompress(data, max_length=chunk_size)
+            chunk_start, position = position, position + len(chunk)
+            if position > page_offset:
+                yield chunk[max(page_offset - chunk_start, 0):end - chunk_start]
+
+
+def load_index(directory):
+    """
+    :param directory: xml_files folder
+    :return: dict of {title: handle for read_page()}
+    """
+    index = {}
+    path = os.path.join(directory, INDEX_FILE)
+    if os.path.exists(path):
+        with open(path, encoding='utf-8') as f:
+            for line in f:
+                title, archive_name, *offsets = line.rstrip('\n').split('\t')
+                if archive_name == REMOVED:
+                    index.pop(title, None)
+                else:
+                    index[title] = (os.path.join(directory, archive_name), *map(int, offsets))
+    return index
+
+
+def page_title(content, default):
+    title_match = TITLE.search(content)
+    return html.unescape(title_match.group(1).decode('utf-8')) if title_match else default
+
+
+def migrate(directory, block_pages=100, delete=False):
+    """
+    Packs the .xml files of an xml_files folder written by earlier versions into an archive
+    :param directory: xml_files folder
+    :param block_pages: number of pages per compressed block
+    :param delete: remove the .xml files once they are in the archive
+    :return: number of pages migrated
+    """
+    archived = load_index(directory)
+    archive = XmlArchive(directory)
+    file_names = sorted(name for name in os.listdir(directory) if name.endswith('.xml'))
+    block, block_files, migrated = [], [], 0
+    for position, file_name in enumerate(file_names):
+        with open(os.path.join(directory, file_name), 'rb') as f:
+            content = f.read()
+        title = page_title(content, os.path.splitext(file_name)[0])
+        if title not in archived:
+            block.append((title, content))
+        block_files.append(file_name)
+        if len(block) >= block_pages or position == len(file_names) - 1:
+            if block:
+                archive.append_block(block)
+                migrated += len(block)
+            if delete:
+                for name in block_files:
+                    os.remove(os.path.join(directory, name))
+            block, block_files = [], []
+    archive.close()
+    return migrated
+
+
+if __name__ == '__main__':
+    args_parser = argparse.ArgumentParser()
+    sub_parsers = args_parser.add_subparsers(dest='mode', required=True)
+    migrate_parser = sub_parsers.add_parser('migrate',
+                                            help='Pack the .xml files of an xml_files folder into an archive')
+    migrate_parser.add_argument('directory', help='The xml_files folder')
+    migrate_parser.add_argument('--block_pages', type=int, default=100, help='Pages per compressed block')
+    migrate_parser.add_argument('--delete', action='store_true', help='Remove the .xml files once they are archived')
+    get_parser = sub_parsers.add_parser('get', help='Print the raw XML of a page')
+    get_parser.add_argument('directory', help='The xml_files folder')
+    get_parser.add_argument('title', help='Title of the page')
+    args = args_parser.parse_args()
+    if args.mode == 'migrate':
+        print(f'{migrate(args.directory, args.block_pages, args.delete)} pages archived')
+    else:
+        print(read_page(load_index(args.directory)[args.title]).decode('utf-8'))
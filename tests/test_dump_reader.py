@@ -0,0 +1,115 @@
+"""
+Reading pages from a pages-articles multistream dump (build_offsets, DumpReader, read_batch, get_content_from_dump)
+with a small synthetic dump and offset index built like the ones Wikimedia publishes
+"""
+import bz2
+import queue
+import sqlite3
+from xml.sax.saxutils import escape
+
+import pytest
+
+from dedup_index import DedupIndex, page_key
+from dump_reader import DumpReader, build_offsets, get_content_from_dump, read_batch
+from metrics import Metrics
+from pipeline import EOS
+
+# Streams of (title, namespace, page id), Talk:Photon is not an article
+STREAMS = [[('Photon', 0, 1), ('AT&T', 0, 2), ('Talk:Photon', 1, 3)],
+           [('Quark', 0, 4), ('Hydrogen line', 0, 5)]]
+
+
+def page_xml(title, ns, page_id):
+    return (f'  <page>\n    <title>{escape(title)}</title>\n    <ns>{ns}</ns>\n    <id>{page_id}</id>\n'
+            f'    <revision>\n      <id>{page_id + 1000}</id>\n      <timestamp>2024-06-01T00:00:00Z</timestamp>\n'
+            f'      <sha1>sha{page_id}</sha1>\n      <text bytes="20" xml:space="preserve">{escape(title)} text'
+            f'</text>\n    </revision>\n  </page>\n')
+
+
+def revision(page_id):
+    return {'revid': page_id + 1000, 'timestamp': '2024-06-01T00:00:00Z', 'sha1': f'sha{page_id}'}
+
+
+@pytest.fixture
+def dump(tmp_path):
+    """
+    :return: path of the dump, list of (offset, length) of its page streams. The closing stream is not in the index,
+    it is read with the last stream of pages
+    """
+    dump_path = str(tmp_path / 'testwiki-pages-articles-multistream.xml.bz2')
+    streams, index = [], []
+    with open(dump_path, 'wb') as f:
+        f.write(bz2.compress(b'<mediawiki>\n  <siteinfo>\n    <sitename>Testwiki</sitename>\n  </siteinfo>\n'))
+        for pages in STREAMS:
+            offset = f.tell()
+            f.write(bz2.compress(''.join(page_xml(*page) for page in pages).encode('utf-8')))
+            streams.append((offset, f.tell() - offset))
+            index.extend(f'{offset}:{page_id}:{title}\n' for title, _, page_id in pages)
+        f.write(bz2.compress(b'</mediawiki>\n'))
+        streams[-1] = (streams[-1][0], f.tell() - streams[-1][0])
+    with bz2.open(dump_path.replace('.xml.bz2', '-index.txt.bz2'), 'wt', encoding='utf-8') as f:
+        f.writelines(index)
+    build_offsets(dump_path)
+    return dump_path, streams
+
+
+def drain(ctq):
+    articles = []
+    while not ctq.empty():
+        articles.extend(ctq.get())
+    return articles
+
+
+def test_build_offsets(dump):
+    dump_path, streams = dump
+    conn = sqlite3.connect(build_offsets(dump_path))
+    assert conn.execute('SELECT offset, length FROM streams ORDER BY offset').fetchall() == streams
+    assert conn.execute('SELECT offset FROM pages WHERE key = ?', (page_key('AT&T'),)).fetchone() == (streams[0][0],)
+    assert conn.execute('SELECT offset FROM pages WHERE key = ?', (page_key('Quark'),)).fetchone() == (streams[1][0],)
+    conn.close()
+
+
+def test_locate(dump):
+    dump_path, streams = dump
+    located, missing = DumpReader(dump_path).locate(['Photon', 'hydrogen_line', 'Quark', 'Neutrino'])
+    assert sorted(located) == [streams[0][0], streams[1][0]]
+    assert located[streams[0][0]] == (streams[0][1], {page_key('Photon')})
+    assert located[streams[1][0]][1] == {page_key('Hydrogen line'), page_key('Quark')}
+    assert missing == ['Neutrino']
+
+
+def test_read_batch(dump):
+    dump_path, streams = dump
+    ctq, metrics = queue.Queue(), Metrics()
+    batch = [('Photon', '/wiki/Photon'), ('AT&T', '/wiki/AT%26T'), ('Talk:Photon', '/wiki/Talk:Photon'),
+             ('Neutrino', '/wiki/Neutrino')]
+    read_batch(batch, DumpReader(dump_path), ctq, 10, metrics)
+    articles = drain(ctq)
+    assert sorted(articles, key=lambda article: article[0]) == [
+        ('AT&T', 'AT&T text', '/wiki/AT%26T', revision(2)),
+        ('Photon', 'Photon text', '/wiki/Photon', revision(1)),
+        # Not an article, passed on without text so that it is acknowledged
+        ('Talk:Photon', None, '/wiki/Talk:Photon', None)]
+    fetch, parse = metrics.snapshot()['fetch'], metrics.snapshot()['parse']
+    # Only the first stream is read, Neutrino is not in the index
+    assert (fetch['out'], fetch['errors'], fetch['bytes']) == (3, 1, streams[0][1])
+    assert (parse['in'], parse['out']) == (3, 2)
+
+
+def test_get_content_from_dump(dump, tmp_path):
+    dump_path, streams = dump
+    dedup = DedupIndex(str(tmp_path))
+    dedup.add_processed('Photon')
+    epnq, ctq, metrics = queue.Queue(), queue.Queue(), Metrics()
+    for name in ['Photon', 'hydrogen_line', 'Quark', 'Neutrino', 'AT&T']:
+        epnq.put((name, '/wiki/' + name))
+    epnq.put(EOS)
+    get_content_from_dump(epnq, ctq, DumpReader(dump_path), 2, 5, 10, dedup, metrics)
+    articles = {article[0]: article for article in drain(ctq)}
+    # Photon is processed already. The articles keep the url they were queued with and come under their dump title
+    assert sorted(articles) == ['AT&T', 'Hydrogen line', 'Quark']
+    assert articles['Hydrogen line'] == ('Hydrogen line', 'Hydrogen line text', '/wiki/hydrogen_line', revision(5))
+    assert articles['Quark'][3] == revision(4)
+    fetch = metrics.snapshot()['fetch']
+    assert (fetch['in'], fetch['out'], fetch['errors']) == (4, 3, 1)
+    assert fetch['bytes'] == streams[0][1] + streams[1][1]
@@ -0,0 +1,138 @@
+"""
+Batched Special:Export downloads (get_content_batched, fetch_batch, split_export_pages) against a local HTTP server that
+stands in for Wikipedia
+"""
+import queue
+import threading
+import urllib.parse
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from xml.sax.saxutils import escape
+
+import pytest
+
+import http_client
+from dedup_index import DedupIndex
+from metrics import Metrics
+from pipeline import EOS
+from wiki_explore import WikiReader, get_content_batched, normalize_title, parse_chunks, split_export_pages
+
+HEADER = (b'<mediawiki xmlns="http://www.mediawiki.org/xml/export-0.10/" version="0.10" xml:lang="en">\n'
+          b'  <siteinfo>\n    <sitename>Wikipedia</sitename>\n  </siteinfo>\n')
+PAGES = {'Photon': 1001, 'Hydrogen line': 1002, 'AT&T': 1003, 'Quark': 1004}
+
+
+def page_xml(title, revid):
+    return (f'  <page>\n    <title>{escape(title)}</title>\n    <ns>0</ns>\n    <id>{revid - 1000}</id>\n'
+            f'    <revision>\n      <id>{revid}</id>\n      <timestamp>2024-01-01T00:00:00Z</timestamp>\n'
+            f'      <text bytes="20">{escape(title)} is an article.</text>\n      <sha1>sha{revid}</sha1>\n'
+            f'    </revision>\n  </page>\n').encode('utf-8')
+
+
+def export(titles):
+    # Like Wikipedia, the pages are exported under their canonical titles
+    titles = [normalize_title(title) for title in titles]
+    return HEADER + b''.join(page_xml(title, PAGES[title]) for title in titles if title in PAGES) + b'</mediawiki>\n'
+
+
+class ExportServer:
+    """
+    Serves multi page exports (POST /w/index.php) and single page exports (GET /wiki/Special:Export/<title>) of PAGES.
+    Titles in left_out are missing from multi page exports, like pages Wikipedia fails to export in a batch
+    """
+    def __init__(self):
+        self.posts = []
+        self.gets = []
+        self.left_out = set()
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_POST(self):
+                form = urllib.parse.parse_qs(self.rfile.read(int(self.headers['Content-Length'])).decode('utf-8'))
+                titles = form['pages'][0].split('\n')
+                server.posts.append(titles)
+                self.reply(200, export([title for title in titles if title not in server.left_out]))
+
+            def do_GET(self):
+                title = urllib.parse.unquote(self.path.split('/wiki/Special:Export/', 1)[1])
+                server.gets.append(title)
+                self.reply(200, export([title])) if normalize_title(title) in PAGES else self.reply(404, b'')
+
+            def reply(self, status, body):
+                self.send_response(status)
+                self.send_header('Content-Type', 'application/xml; charset=utf-8')
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, *args):
+                pass
+
+        self.httpd = ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+        self.base = f'http://127.0.0.1:{self.httpd.server_address[1]}'
+        threading.Thread(target=self.httpd.serve_forever, daemon=True).start()
+
+
+@pytest.fixture
+def server(monkeypatch):
+    export_server = ExportServer()
+    request = http_client.request
+    monkeypatch.setattr(http_client, 'request', lambda method, url, **kwargs: request(
+        method, url.replace('https://en.wikipedia.org', export_server.base), **kwargs))
+    yield export_server
+    export_server.httpd.shutdown()
+    http_client.set_metrics(None)
+
+
+def run_batched(pages, batch_size, dedup):
+    epnq, rxq = queue.Queue(), queue.Queue()
+    for page_name in pages:
+        epnq.put((page_name, '/wiki/' + page_name.replace(' ', '_')))
+    epnq.put(EOS)
+    metrics = Metrics()
+    get_content_batched(epnq, rxq, batch_size, 5, dedup, None, metrics)
+    fetched = {}
+    while not rxq.empty():
+        page_name, page_url, content = rxq.get()
+        fetched[page_name] = (page_url, content)
+    return fetched, metrics.snapshot()['fetch']
+
+
+def articles(content):
+    found = []
+    parse_chunks([content], WikiReader(lambda ns: ns == 0, found.append, None))
+    return found
+
+
+def test_split_export_pages():
+    pages = split_export_pages(export(['Photon', 'AT&T', 'Hydrogen line']))
+    assert sorted(pages) == ['AT&T', 'Hydrogen line', 'Photon']
+    for title, document in pages.items():
+        assert document.startswith(HEADER) and document.endswith(b'</mediawiki>\n')
+        (article,) = articles(document)
+        assert article[0] == title
+        assert article[3] == {'revid': PAGES[title], 'timestamp': '2024-01-01T00:00:00Z', 'sha1': f'sha{PAGES[title]}'}
+    assert split_export_pages(HEADER + b'</mediawiki>\n') == {}
+
+
+def test_get_content_batched(server, tmp_path):
+    dedup = DedupIndex(str(tmp_path))
+    dedup.add_processed('Quark')
+    fetched, fetch = run_batched(['Photon', 'hydrogen_line', 'AT&T', 'Quark'], 2, dedup)
+    # Quark is processed already, the other pages are sent in batches of 2 with their names as queued
+    assert server.posts == [['Photon', 'hydrogen_line'], ['AT&T']]
+    assert server.gets == []
+    assert sorted(fetched) == ['AT&T', 'Photon', 'hydrogen_line']
+    assert fetched['hydrogen_line'][0] == '/wiki/hydrogen_line'
+    assert [article[0] for article in articles(fetched['hydrogen_line'][1])] == ['Hydrogen line']
+    assert (fetch['in'], fetch['out'], fetch['errors']) == (3, 3, 0)
+
+
+def test_pages_missing_from_batch_are_fetched_one_at_a_time(server, tmp_path):
+    server.left_out = {'Hydrogen line', 'Unknown page'}
+    fetched, fetch = run_batched(['Photon', 'Hydrogen line', 'Unknown page'], 10, DedupIndex(str(tmp_path)))
+    assert server.posts == [['Photon', 'Hydrogen line', 'Unknown page']]
+    assert server.gets == ['Hydrogen line', 'Unknown page']
+    assert sorted(fetched) == ['Hydrogen line', 'Photon']
+    assert [article[0] for article in articles(fetched['Hydrogen line'][1])] == ['Hydrogen line']
+    # The page Wikipedia does not have is an error and is not put back into the queue
+    assert (fetch['in'], fetch['out'], fetch['errors']) == (3, 2, 1)
@@ -0,0 +1,36 @@
+"""
+Cleaning of the batches of articles (process_article)
+"""
+import queue
+
+import wiki_explore
+from metrics import Metrics
+from pipeline import EOS
+from wiki_explore import process_article
+
+REVISION = {'revid': 1, 'timestamp': '2024-01-01T00:00:00Z', 'sha1': 'sha1'}
+
+
+def test_article_that_fails_to_clean(monkeypatch):
+    clean_text = wiki_explore.clean_text
+
+    def failing_clean_text(text):
+        if 'Broken' in text:
+            raise ValueError('unbalanced template')
+        return clean_text(text)
+
+    monkeypatch.setattr(wiki_explore, 'clean_text', failing_clean_text)
+    ctq, c1tq, metrics = queue.Queue(), queue.Queue(), Metrics()
+    ctq.put([('Photon', "'''Photon''' is a particle.", '/wiki/Photon', REVISION),
+             ('Broken', "'''Broken''' {{infobox", '/wiki/Broken', REVISION),
+             ('Talk:Photon', None, '/wiki/Talk:Photon', None),
+             ('Quark', "'''Quark''' is a particle.", '/wiki/Quark', REVISION)])
+    ctq.put(EOS)
+    process_article(ctq, c1tq, metrics)
+    cleaned = [c1tq.get() for _ in range(c1tq.qsize())]
+    # The rest of the batch is passed on, the failed page is not acknowledged so it stays in the work ledger
+    assert [details['page'] for details in cleaned] == ['Photon', 'Talk:Photon', 'Quark']
+    assert cleaned[1] == {'page': 'Talk:Photon', 'skipped': 'no article'}
+    assert 'particle' in cleaned[2]['sentences'] and cleaned[2]['revid'] == 1
+    clean = metrics.snapshot()['clean']
+    assert (clean['in'], clean['out'], clean['errors']) == (3, 2, 1)
@@ -0,0 +1,68 @@
+"""
+Profiling of the stages that run as threads of one process (run_profiled) and the merged report
+"""
+import os
+import threading
+import tracemalloc
+
+import pytest
+
+import profiling
+from profiling import dump_allocations, merge, run_profiled
+
+
+def busy(barrier, n):
+    # Both threads are inside their profiled target at the same time
+    barrier.wait(timeout=10)
+    return sum(i * i for i in range(n))
+
+
+@pytest.fixture(params=[True, False], ids=['thread_cprofile', 'one_cprofile_per_process'])
+def thread_cprofile(request, monkeypatch):
+    # Without THREAD_CPROFILE (Python 3.12+) the threads of the main process are sampled instead
+    monkeypatch.setattr(profiling, 'THREAD_CPROFILE', request.param)
+    monkeypatch.setattr(profiling, '_sampler', None)
+    monkeypatch.setattr(profiling, '_stages', {})
+    return request.param
+
+
+def test_concurrent_threads(thread_cprofile, tmp_path):
+    options = {'mode': 'cprofile', 'interval': 0.001, 'directory': str(tmp_path), 'tracemalloc': 0}
+    barrier = threading.Barrier(2)
+    results = {}
+
+    def run(stage):
+        results[stage] = run_profiled(busy, stage, options, barrier, 1000000)
+
+    threads = [threading.Thread(target=run, args=(stage,)) for stage in ('write', 'write_xml')]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    # Every target ran to its end, none failed on starting its profiler
+    assert results == {'write': sum(i * i for i in range(1000000)), 'write_xml': sum(i * i for i in range(1000000))}
+    files = os.listdir(tmp_path)
+    if thread_cprofile:
+        assert sorted(file_name.split('-')[0] for file_name in files if file_name.endswith('.prof')) == [
+            'write', 'write_xml']
+    else:
+        assert not [file_name for file_name in files if file_name.endswith('.prof')]
+        assert f'sample-{os.getpid()}.collapsed' in files
+    report = merge(str(tmp_path))
+    assert '== write: ' in report and '== write_xml: ' in report
+
+
+def test_one_allocation_snapshot_per_process(tmp_path):
+    options = {'mode': 'sample', 'interval': 0.01, 'directory': str(tmp_path), 'tracemalloc': 1}
+    try:
+        for stage in ('write', 'write_xml'):
+            run_profiled(list, stage, options, range(1000))
+        # The threads of the main process leave the snapshot to the end of the session
+        assert not [file_name for file_name in os.listdir(tmp_path) if file_name.endswith('.tracemalloc')]
+        dump_allocations(str(tmp_path), 'main')
+    finally:
+        tracemalloc.stop()
+    assert [file_name for file_name in os.listdir(tmp_path) if file_name.endswith('.tracemalloc')] == [
+        f'main-{os.getpid()}.tracemalloc']
+    report = merge(str(tmp_path))
+    assert 'held at the end of 1 processes' in report and 'write memory' not in report